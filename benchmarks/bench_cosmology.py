@@ -0,0 +1,110 @@
+"""
+Benchmark the build of the comoving distance table done by
+cosmology.set_cosmology: vectorized Gauss-Legendre quadrature
+against the loop calling romberg on each redshift interval,
+the table taken from the cache on disk or in memory, and the
+lookups in the tables for arrays of redshifts or distances against
+np.interp and the closed form used by Cosmology(..., exact=True).
+
+Run from the top directory of the repository:
+    python -m benchmarks.bench_cosmology [nrepeat]
+"""
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+
+import src.cosmology as cosmo
+
+def romberg_table(zz):
+    """Comoving distance table built with a romberg call per interval"""
+    table = np.zeros(len(zz))
+    for i in range(1, len(zz)):
+        table[i] = table[i-1] + cosmo.romberg(cosmo.f, zz[i-1], zz[i])
+    return table
+
+
+def main(nrepeat=20):
+    cosmo.set_Planck15()
+    zz = cosmo.redshift
+    print(f'{len(zz)} redshifts up to z={cosmo.zmax}, dz={cosmo.dz}')
+
+    start = time.perf_counter()
+    reference = romberg_table(zz)
+    tloop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(nrepeat):
+        table = cosmo.comoving_table(zz)
+    tvec = (time.perf_counter() - start)/nrepeat
+
+    err = np.max(np.abs(table[1:] - reference[1:])/reference[1:])
+    print(f"{'method':>12} {'time (ms)':>10}")
+    print(f"{'romberg':>12} {1e3*tloop:10.1f}")
+    print(f"{'vectorized':>12} {1e3*tvec:10.2f}")
+    print(f'Speed-up: {tloop/tvec:.0f}, max rel difference: {err:.2e}')
+
+    # set_cosmology with the tables cached on disk and in memory
+    tmpdir = tempfile.mkdtemp()
+    cache_dir = cosmo.cache_dir
+    try:
+        cosmo.cache_dir = tmpdir
+        cosmo.table_cache.clear()
+        times = {}
+        for label in ['build', 'disk', 'memory']:
+            if label == 'disk':
+                cosmo.table_cache.clear()
+            start = time.perf_counter()
+            cosmo.set_Planck15()
+            times[label] = time.perf_counter() - start
+        print(f"{'set_cosmology':>14} " +
+              ' '.join(f'{label} {1e3*tt:.3f} ms' for label, tt in times.items()))
+    finally:
+        cosmo.cache_dir = cache_dir
+        shutil.rmtree(tmpdir)
+
+    # Lookups in the tables for arrays
+    model = cosmo.get_cosmology()
+    z = np.random.default_rng(1).uniform(0., 10., 10**6)
+    r = model.comoving_distance(z)
+    model.get_inverse_table()
+    print(f"{'lookup, 1e6 values':>20} {'np.interp (ms)':>15} {'uniform (ms)':>13}")
+    for label, slow, fast in [
+            ('comoving_distance',
+             lambda: np.interp(z, cosmo.redshift, model.r_comoving),
+             lambda: model.comoving_distance(z)),
+            ('redshift_at_distance',
+             lambda: np.interp(r, model.r_comoving, cosmo.redshift),
+             lambda: model.redshift_at_distance(r))]:
+        times = []
+        for func in [slow, fast]:
+            start = time.perf_counter()
+            for i in range(nrepeat):
+                func()
+            times.append((time.perf_counter() - start)/nrepeat)
+        print(f'{label:>20} {1e3*times[0]:15.2f} {1e3*times[1]:13.2f}')
+
+    # Closed form for flat cosmologies, without a table
+    start = time.perf_counter()
+    exact = cosmo.Cosmology(omega0=model.WM, omegab=model.WB,
+                            lambda0=model.WV, h0=model.h, exact=True)
+    tinit = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(nrepeat):
+        rexact = exact.comoving_distance(z)
+    texact = (time.perf_counter() - start)/nrepeat
+    zlow = np.geomspace(1e-8, 1e-2, 7)
+    errlow = np.max(np.abs(model.comoving_distance(zlow)/
+                           exact.comoving_distance(zlow) - 1))
+    print(f'Closed form: init {1e3*tinit:.3f} ms, '
+          f'comoving_distance {1e3*texact:.2f} ms, '
+          f'max rel difference to the table {np.max(np.abs(r/rexact - 1)):.1e}'
+          f' (z<0.01: {errlow:.1e})')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(nrepeat=int(sys.argv[1]))
+    else:
+        main()
@@ -0,0 +1,97 @@
+"""
+Benchmark storage options for gne_input.hdf5: write throughput,
+compression ratio and read-back speed on a synthetic subvolume.
+The precision policies are applied to all float datasets.
+
+Run from the top directory of the repository:
+    python -m benchmarks.bench_storage [ngal]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import h5py
+
+from src.generate_input import generate_input_file
+from src.writer import GneWriter, hdf5plugin
+import benchmarks.synthetic as syn
+
+options = {
+    'contiguous': None,
+    'chunked': {'chunks': 65536},
+    'lzf': {'compression': 'lzf', 'chunks': 65536},
+    'lzf+shuffle': {'compression': 'lzf', 'shuffle': True, 'chunks': 65536},
+    'gzip1+shuffle': {'compression': 'gzip', 'compression_opts': 1,
+                      'shuffle': True, 'chunks': 65536},
+    'gzip4+shuffle': {'compression': 'gzip', 'compression_opts': 4,
+                      'shuffle': True, 'chunks': 65536},
+    'gzip9+shuffle': {'compression': 'gzip', 'compression_opts': 9,
+                      'shuffle': True, 'chunks': 65536},
+}
+gzip4 = {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True,
+         'chunks': 65536}
+precisions = {
+    'gzip4+float32': (gzip4, 'float32'),
+    'gzip4+bits:16': (gzip4, 'bits:16'),
+    'gzip4+bits:10': (gzip4, 'bits:10'),
+}
+if hdf5plugin is not None:
+    options.update({
+        'blosc': {'compression': 'blosc', 'chunks': 65536},
+        'zstd+shuffle': {'compression': 'zstd', 'shuffle': True,
+                         'chunks': 65536},
+        'bitshuffle': {'compression': 'bitshuffle', 'chunks': 65536},
+    })
+
+def main(ngal=500000):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        root = os.path.join(tmpdir, 'input', 'ivol')
+        outroot = os.path.join(tmpdir, 'output', 'ivol')
+        syn.make_subvolume(root, 0, ngal)
+        config = syn.get_config(root, outroot)
+        generate_input_file(config, 0)
+
+        # Content of a GALFORM-like output file
+        with h5py.File(outroot + '0/gne_input.hdf5', 'r') as hf:
+            datasets = {key: (hf['data'][key][:], hf['data'][key].attrs['units'])
+                        for key in hf['data']}
+        nbytes = sum(vals.nbytes for vals, units in datasets.values())
+        print(f'{len(datasets)} datasets, {nbytes/1e6:.1f} MB uncompressed')
+        if hdf5plugin is None:
+            print('(hdf5plugin not installed, plugin codecs skipped)')
+
+        print(f"{'option':>15} {'write MB/s':>11} {'ratio':>7} "
+              f"{'read MB/s':>10} {'max rel err':>12}")
+        testfile = os.path.join(tmpdir, 'bench.hdf5')
+        allopts = {label: (storage, None) for label, storage in options.items()}
+        allopts.update(precisions)
+        for label, (storage, policy) in allopts.items():
+            precision = {name: policy for name in datasets}
+            start = time.perf_counter()
+            with GneWriter(testfile, storage=storage,
+                           precision=precision) as writer:
+                for name, (vals, units) in datasets.items():
+                    writer.write(name, vals, units)
+            twrite = time.perf_counter() - start
+            ratio = nbytes/os.path.getsize(testfile)
+
+            start = time.perf_counter()
+            err = 0.
+            with h5py.File(testfile, 'r') as hf:
+                for name in datasets:
+                    hf['data'][name][:]
+                    err = max(err, hf['data'][name].attrs.get('max_rel_error', 0.))
+            tread = time.perf_counter() - start
+            print(f'{label:>15} {nbytes/1e6/twrite:11.1f} {ratio:7.2f} '
+                  f'{nbytes/1e6/tread:10.1f} {err:12.2e}')
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(ngal=int(sys.argv[1]))
+    else:
+        main()
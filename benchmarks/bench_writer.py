@@ -0,0 +1,87 @@
+"""
+Benchmark the single-session writer against reopening the output
+file for each dataset and header attribute.
+
+Run from the top directory of the repository:
+    python -m benchmarks.bench_writer [ngal]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import h5py
+
+from src.generate_input import generate_input_file
+from src.writer import GneWriter
+import benchmarks.synthetic as syn
+
+def write_reopening(outfile, header, datasets):
+    """Write the output reopening the file for each item"""
+    nopens = 0
+    with h5py.File(outfile, 'w') as hf:
+        hf.create_dataset('header', (), dtype='f4')
+        hf.create_group('data')
+    nopens += 1
+    for key, value in header.items():
+        with h5py.File(outfile, 'a') as hf:
+            hf['header'].attrs[key] = value
+        nopens += 1
+    for name, (vals, units) in datasets.items():
+        with h5py.File(outfile, 'a') as hf:
+            dd = hf['data'].create_dataset(name, data=vals)
+            dd.attrs['units'] = units
+        nopens += 1
+    return nopens
+
+
+def write_single_session(outfile, header, datasets):
+    """Write the output with one GneWriter session"""
+    nopens = GneWriter.nopens
+    with GneWriter(outfile) as writer:
+        for key, value in header.items():
+            writer.set_header(key, value)
+        for name, (vals, units) in datasets.items():
+            writer.write(name, vals, units)
+    return GneWriter.nopens - nopens
+
+
+def main(ngal=200000, nrep=3):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        root = os.path.join(tmpdir, 'input', 'ivol')
+        outroot = os.path.join(tmpdir, 'output', 'ivol')
+        syn.make_subvolume(root, 0, ngal)
+        config = syn.get_config(root, outroot)
+
+        start = time.perf_counter()
+        generate_input_file(config, 0)
+        print(f'generate_input_file ({ngal} galaxies): '
+              f'{time.perf_counter() - start:.3f} s')
+
+        # Reuse the generated content for the write comparison
+        outfile = outroot + '0/gne_input.hdf5'
+        with h5py.File(outfile, 'r') as hf:
+            header = dict(hf['header'].attrs)
+            datasets = {key: (hf['data'][key][:], hf['data'][key].attrs['units'])
+                        for key in hf['data']}
+
+        testfile = os.path.join(tmpdir, 'bench.hdf5')
+        for label, func in [('reopen per item', write_reopening),
+                            ('single session', write_single_session)]:
+            times = []
+            for irep in range(nrep):
+                start = time.perf_counter()
+                nopens = func(testfile, header, datasets)
+                times.append(time.perf_counter() - start)
+            print(f'{label:>16}: {nopens:4d} opens, '
+                  f'best of {nrep} = {min(times):.4f} s')
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(ngal=int(sys.argv[1]))
+    else:
+        main()
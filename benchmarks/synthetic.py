@@ -0,0 +1,156 @@
+"""
+Synthetic GALFORM-like subvolumes for benchmarks
+"""
+import os
+import h5py
+import numpy as np
+
+lines = ['Halpha', 'Hbeta', 'NII6583', 'OII3727', 'OIII5007', 'SII6716']
+line_prefix = 'L_tot_'
+line_suffix_ext = '_ext'
+
+gal_props = ['index', 'type', 'vxgal', 'vygal', 'vzgal',
+             'rbulge', 'rcomb', 'rdisk', 'mhot', 'vbulge',
+             'mcold', 'mcold_burst', 'cold_metal', 'metals_burst',
+             'mstars_bulge', 'mstars_burst', 'mstars_disk',
+             'mstardot', 'mstardot_burst', 'mstardot_average',
+             'M_SMBH', 'SMBH_Mdot_hh', 'SMBH_Mdot_stb', 'SMBH_Spin']
+
+def get_line_datasets():
+    """Names of the luminosity datasets"""
+    datasets = []
+    for line in lines:
+        datasets.append(f'{line_prefix}{line}')
+        datasets.append(f'{line_prefix}{line}{line_suffix_ext}')
+    return datasets
+
+
+def make_subvolume(root, ivol, ngal, group='Output001', boxside=125.,
+                   seed=42):
+    """
+    Write galaxies.hdf5, agn.hdf5 and tosedfit.hdf5 files with
+    random GALFORM-like properties
+
+    Parameters
+    ----------
+    root : str
+        Root of the subvolume directories
+    ivol : integer
+        Number of subvolume
+    ngal : integer
+        Number of galaxies
+    group : str
+        Name of the group with the datasets
+    boxside : float
+        Side of the subvolume (Mpc/h)
+    seed : integer
+        Seed for the random numbers
+    """
+    rng = np.random.default_rng(seed)
+    path = root + str(ivol) + '/'
+    os.makedirs(path, exist_ok=True)
+
+    with h5py.File(path+'galaxies.hdf5', 'w') as ff:
+        grp = ff.create_group(group)
+        grp.create_dataset('redshift', data=0.9)
+        grp.create_dataset('mhhalo', data=10**rng.uniform(9., 14., ngal))
+        for pos in ['xgal', 'ygal', 'zgal']:
+            grp.create_dataset(pos, data=rng.uniform(0., boxside, ngal))
+        for prop in gal_props:
+            if prop == 'index':
+                vals = np.arange(ngal)
+            elif prop == 'type':
+                vals = rng.integers(0, 3, ngal, dtype=np.int32)
+            elif prop.startswith('v'):
+                vals = rng.normal(0., 300., ngal)
+            else:
+                vals = 10**rng.uniform(5., 11., ngal)
+                vals[rng.random(ngal) < 0.05] = 0.
+            grp.create_dataset(prop, data=vals)
+
+    with h5py.File(path+'agn.hdf5', 'w') as ff:
+        grp = ff.create_group(group)
+        grp.create_dataset('Lbol_AGN', data=10**rng.uniform(-2., 4., ngal))
+
+    with h5py.File(path+'tosedfit.hdf5', 'w') as ff:
+        grp = ff.create_group(group)
+        grp.create_dataset('mag_UKIRT-K_o_tot_ext',
+                           data=rng.uniform(-25., -15., ngal))
+        grp.create_dataset('mag_SDSSz0.1-r_o_tot_ext',
+                           data=rng.uniform(-25., -15., ngal))
+        for line in lines:
+            lum = 10**rng.uniform(-2., 3., ngal)
+            lum[rng.random(ngal) < 0.05] = 0.
+            grp.create_dataset(f'{line_prefix}{line}', data=lum)
+            grp.create_dataset(f'{line_prefix}{line}{line_suffix_ext}',
+                               data=lum*rng.uniform(0.1, 1., ngal))
+
+
+def get_config(root, outroot, group='Output001', boxside=125.):
+    """
+    Configuration dictionary for the synthetic subvolumes,
+    following src.config.get_GP20cosma_config
+
+    Parameters
+    ----------
+    root : str
+        Root of the input subvolume directories
+    outroot : str
+        Root of the output subvolume directories
+    group : str
+        Name of the group with the datasets
+    boxside : float
+        Side of the subvolume (Mpc/h)
+
+    Returns
+    -------
+    config : dict
+    """
+    mp = 9.35e8
+    line_datasets = get_line_datasets()
+    config = {
+        'root': root,
+        'outroot': outroot,
+        'h0': 0.704,
+        'omega0': 0.307,
+        'omegab': 0.0482,
+        'lambda0': 0.693,
+        'boxside': boxside,
+        'mp': mp,
+        'snap': 39,
+        'mcold_disc': 'mcold',
+        'mcold_z_disc': 'cold_metal',
+        'mcold_burst': 'mcold_burst',
+        'mcold_z_burst': 'metals_burst',
+        'lines': lines,
+        'line_prefix': line_prefix,
+        'line_suffix_ext': line_suffix_ext,
+    }
+    config['selection'] = {
+        'galaxies.hdf5': {
+            'group': group,
+            'datasets': ['mhhalo', 'xgal', 'ygal', 'zgal'],
+            'units': ['Msun/h', 'Mpc/h', 'Mpc/h', 'Mpc/h'],
+            'low_limits': [20 * mp, 0., 0., 0.],
+            'high_limits': [None, boxside, boxside, boxside]
+        }
+    }
+    config['file_props'] = {
+        'galaxies.hdf5': {
+            'group': group,
+            'datasets': ['redshift'] + gal_props,
+            'units': ['redshift'] + ['-'] * len(gal_props)
+        },
+        'agn.hdf5': {
+            'group': group,
+            'datasets': ['Lbol_AGN'],
+            'units': ['1e40 h^-2 erg/s']
+        },
+        'tosedfit.hdf5': {
+            'group': group,
+            'datasets': ['mag_UKIRT-K_o_tot_ext',
+                         'mag_SDSSz0.1-r_o_tot_ext'] + line_datasets,
+            'units': ['AB apparent'] * 2 + ['1e40 h^2 erg/s'] * len(line_datasets)
+        }
+    }
+    return config
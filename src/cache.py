@@ -0,0 +1,178 @@
+"""
+Cache of the input columns read for a subvolume
+"""
+from collections import OrderedDict, Counter
+import numpy as np
+
+import src.utils as u
+
+# Default memory budget of the cache in bytes
+default_budget = 2**28
+
+class ColumnCache:
+    """
+    Least recently used cache of the columns read from the input files
+    of a subvolume, bounded by a memory budget.
+
+    For each column, the values read last are kept together with the
+    rows they correspond to, so that later requests for the same rows,
+    or a subset of them, are served from memory. The returned arrays
+    can share memory with the cached ones and should not be modified
+    in place. As blocks of rows are processed in increasing order,
+    the entries for rows before a requested block are dropped first.
+
+    Parameters
+    ----------
+    budget : int
+        Maximum number of bytes held by the cache, 0 to disable it
+
+    Attributes
+    ----------
+    nreads : collections.Counter
+        Number of times each (file, dataset) has been read from disk
+    nhits : int
+        Number of requests served from memory
+    """
+    def __init__(self, budget=None):
+        self.budget = default_budget if budget is None else budget
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.nreads = Counter()
+        self.nhits = 0
+
+    def read(self, key, dset, rows=None, start=0, stop=None):
+        """
+        Values of a dataset at the given rows within [start, stop)
+
+        Parameters
+        ----------
+        key : tuple
+            Identifier of the column, (file, dataset)
+        dset : h5py.Dataset
+            Dataset to be read on a cache miss
+        rows : numpy array of int
+            Sorted and unique rows, None for all the rows in the range
+        start : int
+            First row of the range
+        stop : int
+            Row after the last one of the range, by default the
+            length of the dataset
+
+        Returns
+        -------
+        vals : numpy array
+        """
+        if stop is None:
+            stop = dset.shape[0]
+        if rows is not None and len(rows) == stop - start:
+            rows = None
+        if key in self.entries:
+            vals = _lookup(self.entries[key], rows, start, stop)
+            if vals is not None:
+                self.entries.move_to_end(key)
+                self.nhits += 1
+                return vals
+
+        if rows is None:
+            vals = dset[start:stop]
+        else:
+            vals = u.read_rows(dset, rows, start, stop)
+        self.nreads[key] += 1
+        self.drop_before(start)
+        self.store(key, (start, stop, rows, vals))
+        return vals
+
+    def store(self, key, entry):
+        """Keep an entry, evicting the least recently used ones"""
+        self.discard(key)
+        nbytes = _get_nbytes(entry)
+        if nbytes > self.budget:
+            return
+        while self.nbytes + nbytes > self.budget:
+            self.discard(next(iter(self.entries)))
+        self.entries[key] = entry
+        self.nbytes += nbytes
+
+    def drop_before(self, start):
+        """Remove the entries for rows before the given one"""
+        for key in [key for key, entry in self.entries.items()
+                    if entry[1] <= start]:
+            self.discard(key)
+
+    def discard(self, key):
+        """Remove an entry from the cache, if present"""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= _get_nbytes(entry)
+
+    def clear(self):
+        """Remove all the entries"""
+        self.entries.clear()
+        self.nbytes = 0
+
+
+def _get_nbytes(entry):
+    """Memory held by a cache entry"""
+    estart, estop, erows, evals = entry
+    nbytes = evals.nbytes
+    if erows is not None:
+        nbytes += erows.nbytes
+    return nbytes
+
+
+def _lookup(entry, rows, start, stop):
+    """Requested values from a cache entry, None if not all there"""
+    estart, estop, erows, evals = entry
+    if erows is None:
+        if start < estart or stop > estop:
+            return None
+        if rows is None:
+            return evals[start - estart:stop - estart]
+        return evals[rows - estart]
+
+    if rows is None:
+        rows = np.arange(start, stop)
+    if len(rows) > len(erows):
+        return None
+    if len(rows) == 0:
+        return evals[:0]
+    idx = np.searchsorted(erows, rows)
+    if idx[-1] >= len(erows) or not np.array_equal(erows[idx], rows):
+        return None
+    if len(idx) == len(erows):
+        return evals
+    return evals[idx]
+
+
+class CachedGroup:
+    """
+    Input hdf5 group whose columns are read through a shared cache.
+    Indexing it gives the h5py datasets, as for the group itself.
+
+    Parameters
+    ----------
+    group : h5py.Group
+        Open hdf5 group
+    ifile : str
+        Name of the input file, to identify its columns in the cache
+    cache : ColumnCache
+        Cache shared by the input files of the subvolume
+    index : dict
+        Sorted index (index.SortedIndex) of some datasets
+    """
+    def __init__(self, group, ifile, cache, index=None):
+        self.group = group
+        self.ifile = ifile
+        self.cache = cache
+        self.index = {} if index is None else index
+
+    def __getitem__(self, name):
+        return self.group[name]
+
+    def __contains__(self, name):
+        return name in self.group
+
+    def read_column(self, name, rows=None, start=0, stop=None):
+        """Values of a dataset at the given rows, see ColumnCache.read"""
+        return self.cache.read((self.ifile, name), self.group[name],
+                               rows=rows, start=start, stop=stop)
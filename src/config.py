@@ -102,8 +102,19 @@ def get_GP20cosma_config(snap, subvols, cosmo_var=None, laptop=False, verbose=Fa
         'mcold_z_burst': 'metals_burst',
     }
     config['snap'] = snap
+
+    # Types of the output datasets (see src.generate_input.get_column_dtypes),
+    # with the host halo indexes in the smallest type fitting each subvolume
+    config['dtypes'] = {'type': 'int8', 'index': 'narrowest',
+                        'derived': 'float64'}
     
-    # File selection criteria
+    # File selection criteria, given either as limits or, instead, as
+    # an expression (see src.selection.Selection), for example
+    # 'expression': 'mhhalo >= 20*mp & (mstars_disk + mstars_bulge) > 1e9'
+    # Expressions can also use derived quantities (e.g. Zgas_disc,
+    # ratio_Halpha or apparent magnitudes), computed only when needed.
+    # Several named samples can be written at once, as boolean datasets
+    # sample_<name>, with 'samples': {name: expression}
     config['selection'] = {
         'galaxies.hdf5': {
             'group': 'Output###',
@@ -235,6 +246,15 @@ def get_GP20SU_config(snap, subvols, cosmo_var='1', laptop=False, verbose=False)
         'mcold_z_burst': 'metals_burst',
     }
     config['snap'] = snap
+
+    # Types of the output datasets (see src.generate_input.get_column_dtypes),
+    # with the host halo indexes in the smallest type fitting each subvolume
+    config['dtypes'] = {'type': 'int8', 'index': 'narrowest',
+                        'derived': 'float64'}
+
+    # Storage of the output datasets (see src.writer.get_storage_kwargs)
+    config['storage'] = {'compression': 'gzip', 'compression_opts': 4,
+                         'shuffle': True}
     
     # File selection criteria
     config['selection'] = {
@@ -370,6 +390,15 @@ def get_GP20UNIT1Gpc_config(snap, subvols, cosmo_var='fnl0',
         'mcold_z_burst': 'metals_burst',
     }
     config['snap'] = snap
+
+    # Types of the output datasets (see src.generate_input.get_column_dtypes),
+    # with the host halo indexes in the smallest type fitting each subvolume
+    config['dtypes'] = {'type': 'int8', 'index': 'narrowest',
+                        'derived': 'float64'}
+
+    # Storage of the output datasets (see src.writer.get_storage_kwargs)
+    config['storage'] = {'compression': 'gzip', 'compression_opts': 4,
+                         'shuffle': True}
     
     # File selection criteria
     config['selection'] = {
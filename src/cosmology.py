@@ -6,6 +6,13 @@ This module contains various functions to compute distances and
 times in a Universe with a given cosmology.
 List of functions:
   set_cosmology(): lets user specify a cosmology.
+  Cosmology: class with the functions below as methods, for
+             using several cosmologies at the same time.
+  get_cosmology(): returns the Cosmology set with set_cosmology().
+  comoving_table(zz): comoving distance on a grid of redshifts.
+  uniform_interp(x,x0,inv_dx,table): interpolation in a uniform grid.
+  carlson_rf_conj(x,y): Carlson elliptic integral R_F(x,y,y*).
+  get_comoving_table(): cached comoving distance table.
   cosmology_set(): determines wheter an input cosmology
                    has been specfied.
   report_cosmology(): report back parameters for specified 
@@ -53,7 +60,12 @@ Based upon the 'Cosmology Calculator' (Wright, 2006, PASP,
 118, 1711) and Fortran 90 code written by John Helly.
 """
 
+import os
 import sys
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
 import numpy as np
 
 WM = None
@@ -73,6 +85,20 @@ redshift = np.arange(0.0,zmax,dz)
 inv_dz = 1.0/dz
 
 zlow_lim = 0.001
+flat_lim = 1e-10 # |Omega_k| below which a cosmology is taken as flat
+eps = np.finfo(float).eps
+maxiter = 50 # Newton iterations for redshift_at_distance
+
+# Cache of comoving distance tables, in memory (least recently used
+# ones dropped first, changed only holding table_lock) and on disk,
+# as .npy files, in cache_dir (None to disable it), by default
+# $GNE_COSMOLOGY_CACHE
+table_cache = OrderedDict()
+table_cache_size = 8
+table_lock = threading.Lock()
+cache_home = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+cache_dir = os.environ.get('GNE_COSMOLOGY_CACHE',
+                           os.path.join(cache_home, 'gne_cosmology'))
 #zlow = 0.00001 ; dlz = np.log(zmax)/float(nzmax) 
 #lredshift = np.arange(np.log(zlow),np.log(zmax),dz)
 
@@ -137,8 +163,865 @@ def romberg(f, a, b, max_steps=10, acc=1e-8):
     return Rp[max_steps]  # Return our best guess
 
 
+def comoving_table(zz, npoints=4, cosmology=None):
+    """
+    comoving_table(): returns the comoving distance (in Mpc/h) at
+                      each redshift of a sorted grid starting at z=0,
+                      integrating f(z) over all the grid intervals
+                      at once with Gauss-Legendre quadrature.
+
+    USAGE: r = comoving_table(zz,[npoints=4],[cosmology=None])
+
+           zz: sorted redshifts, with zz[0]=0
+           npoints: number of quadrature points per interval
+           cosmology: Cosmology, by default the one set with
+                      set_cosmology()
+    """
+    if cosmology is None:
+        cosmology = get_cosmology()
+    x, w = np.polynomial.legendre.leggauss(npoints)
+    half = 0.5*np.diff(zz)
+    mid = 0.5*(zz[1:] + zz[:-1])
+    integrals = half*(cosmology.f(mid[:,None] + half[:,None]*x) @ w)
+    table = np.zeros(len(zz))
+    np.cumsum(integrals, out=table[1:])
+    return table
+
+
+def uniform_interp(x, x0, inv_dx, table):
+    """
+    uniform_interp(): linear interpolation in a table given on a
+                      uniform grid starting at x0, with spacing
+                      1/inv_dx, finding the bin of each value
+                      directly instead of with a binary search.
+                      As np.interp, values outside the grid take
+                      those at its ends.
+
+    USAGE: y = uniform_interp(x,x0,inv_dx,table)
+    """
+    nbin = len(table) - 1
+    u = np.clip((np.asarray(x, dtype=float) - x0)*inv_dx, 0.0, nbin)
+    with np.errstate(invalid='ignore'):
+        ibin = np.minimum(u.astype(np.intp), nbin - 1)
+    ibin[ibin < 0] = 0 # Bins of NaN values
+    low = table[ibin]
+    return low + (u - ibin)*(table[ibin + 1] - low)
+
+
+def carlson_rf_conj(x, y, errtol=1.5e-3):
+    """
+    carlson_rf_conj(): returns the Carlson symmetric elliptic integral
+                       of the first kind, R_F(x,y,y*), for real x and
+                       complex y, so that the result is real, with the
+                       duplication algorithm (Carlson 1995, Numer.
+                       Algorithms 10, 13), as in DLMF 19.36.1. The
+                       relative error is ~errtol^6/4, double precision
+                       for the default value. With the pair of complex
+                       conjugate arguments, the algorithm only needs
+                       one complex square root per iteration.
+
+    USAGE: rf = carlson_rf_conj(x,y)
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float),
+                               np.asarray(y, dtype=complex))
+    while True:
+        mu = (x + 2.0*y.real)/3.0
+        dev = np.maximum((x - mu)**2, (y.real - mu)**2 + y.imag**2)
+        # Comparison False for NaN values, which are not iterated over
+        if not np.any(dev > (errtol*mu)**2):
+            break
+        sy = np.sqrt(y)
+        lam = 2.0*np.sqrt(x)*sy.real + sy.real**2 + sy.imag**2
+        x = (x + lam)/4.0
+        y = (y + lam)/4.0
+    X = 1.0 - x/mu
+    Y = 1.0 - y/mu
+    Y2 = Y.real**2 + Y.imag**2
+    e2 = 2.0*X*Y.real + Y2
+    e3 = X*Y2
+    return (1.0 + (e2/24.0 - 0.1 - 3.0*e3/44.0)*e2 + e3/14.0)/np.sqrt(mu)
+
+
+def _get_umask():
+    """Current umask, which os.umask only returns when changing it"""
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+# Read once, as changing the umask, even briefly, affects all threads
+umask = _get_umask()
+
+
+def _get_table_file(key):
+    """Name of the file storing the table with a given key"""
+    digest = hashlib.sha256(repr(key).encode()).hexdigest()[:24]
+    return os.path.join(cache_dir, f'r_comoving_{digest}.npy')
+
+
+def _load_table(key):
+    """Table stored on disk, memory mapped, None if there is none"""
+    if cache_dir is None:
+        return None
+    try:
+        table = np.load(_get_table_file(key), mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if table.shape != (nzmax,):
+        return None
+    return table
+
+
+def _save_table(key, table):
+    """
+    Store a table on disk. It is written to a temporary file which
+    is then renamed, so that concurrent jobs never read a partial
+    table, whichever of them finishes last. The file gets the
+    permissions set by the umask, as other files, rather than those
+    of tempfile.mkstemp (only readable by its owner), so that a
+    shared cache directory can be used by other users.
+    """
+    if cache_dir is None:
+        return
+    tmpfile = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmpfile = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp:
+            np.save(tmp, table)
+        os.chmod(tmpfile, 0o666 & ~umask)
+        os.replace(tmpfile, _get_table_file(key))
+    except OSError:
+        print(f'WARNING: comoving distance table not cached in {cache_dir}')
+        if tmpfile is not None and os.path.exists(tmpfile):
+            os.remove(tmpfile)
+
+
+def get_comoving_table(cosmology=None):
+    """
+    get_comoving_table(): returns the read-only comoving distance
+                          table for a Cosmology (by default the one
+                          set with set_cosmology()), from the cache in
+                          memory or on disk, if present, or built
+                          and stored in both otherwise. It can be
+                          called from several threads: the cache
+                          in memory is changed holding table_lock.
+    """
+    if cosmology is None:
+        cosmology = get_cosmology()
+    key = cosmology.get_table_key()
+    with table_lock:
+        if key in table_cache:
+            table_cache.move_to_end(key)
+            return table_cache[key]
+
+    # Built without the lock, not to hold other threads meanwhile
+    table = _load_table(key)
+    if table is None:
+        table = comoving_table(redshift, cosmology=cosmology)
+        table.setflags(write=False)
+        _save_table(key, table)
+    with table_lock:
+        table = table_cache.setdefault(key, table)
+        table_cache.move_to_end(key)
+        while len(table_cache) > table_cache_size:
+            table_cache.popitem(last=False)
+    return table
+
+
+class Cosmology:
+    """
+    Cosmological model with its own parameters and comoving distance
+    table, so that several cosmologies can be used at the same time,
+    e.g. from different threads. The table is shared with the other
+    instances with the same parameters and is read-only. It is not
+    pickled, but taken again from the table cache when unpickled,
+    so instances are cheap to send to other processes.
+
+    The parameters are those of set_cosmology(), and the methods
+    mirror the functions of this module.
+
+    With exact=True, flat cosmologies without radiation get the
+    comoving distance from its closed form in terms of elliptic
+    integrals, for any redshift and without building the table.
+    The table is then only built if redshift_at_distance is used.
+    For large arrays, this is ~20 times slower than the lookups in
+    the table (see benchmarks/bench_cosmology.py).
+
+    Examples
+    --------
+    >>> cosmology = Cosmology(omega0=0.3089, omegab=0.0486,
+    ...                       lambda0=0.6911, h0=0.6774)
+    >>> dL = cosmology.luminosity_distance(0.5)
+    """
+    def __init__(self, omega0=None, omegab=None, lambda0=None, h0=None,
+                 universe="Flat", include_radiation=False, exact=False):
+        if(h0 is None):
+            self.h = 0.674
+        else:
+            self.h = h0
+        if(include_radiation):
+            self.WR = 8.985075e-5
+        else:
+            self.WR = 0.0
+        if(omegab is None):
+            self.WB = 0.0224/(self.h*self.h)
+        else:
+            self.WB = omegab
+        if(omega0 is None):
+            self.WM = 0.315
+        else:
+            self.WM = omega0
+        self.WV = None
+        if(lambda0 is None):
+            if(universe in ("Flat","F","flat","f")):
+                self.WV = 1.0 - (self.WM + self.WR)
+            if(universe in ("Open","O","open","o")):
+                self.WV = 0
+        else:
+            self.WV = lambda0
+        self.WK = 1.0 - (self.WM + self.WV + self.WR)
+        self.kmpersec_to_mpchpergyr = kilo * (Gyr/Mpc) * self.h
+        self.exact = exact and self.flat_lcdm()
+        if exact and not self.exact:
+            print('WARNING: no closed form for the comoving distance,'
+                  ' a table is used for non-flat cosmologies or'
+                  ' with radiation')
+        self.r_comoving = None if self.exact else get_comoving_table(self)
+        self.z_comoving = None
+        self.inv_dr = None
+
+    def get_table_key(self):
+        """
+        get_table_key(): returns the key of the comoving distance
+                         table for the cosmology and redshift grid.
+        """
+        return (self.WM, self.WV, self.WB, self.WR, self.h, zmax, dz, nzmax)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['r_comoving']
+        state['z_comoving'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.r_comoving = None if self.exact else get_comoving_table(self)
+
+    def flat_lcdm(self):
+        """
+        flat_lcdm(): returns True for a flat cosmology without
+                     radiation, with non-zero matter and vacuum
+                     densities, for which the comoving distance
+                     has a closed form.
+        """
+        return (self.WR == 0.0 and abs(self.WK) < flat_lim and
+                self.WM > 0.0 and self.WV > 0.0)
+
+    def get_table(self):
+        """
+        get_table(): returns the comoving distance table, built
+                     the first time it is needed for exact cosmologies.
+        """
+        if self.r_comoving is None:
+            self.r_comoving = get_comoving_table(self)
+        return self.r_comoving
+
+    def exact_comoving_distance(self, z):
+        """
+        exact_comoving_distance(): returns the comoving distance
+                (in Mpc/h) to redshift, z, for a flat cosmology without
+                radiation. With s = (Omega_M/Omega_V)^(1/3),
+                r = DH/(s*sqrt(Omega_V)) * Int_{s}^{s(1+z)} dt/sqrt(t^3+1),
+                which is 2*R_F(U1^2,U2^2,U3^2) for the roots of t^3+1,
+                -1 and (1 +- i*sqrt(3))/2 (DLMF 19.29.8), with U3
+                the complex conjugate of U2.
+                Negative redshifts are taken as 0, as for the table.
+        USAGE: r = exact_comoving_distance(z)
+        """
+        z = np.maximum(np.asarray(z, dtype=float), 0.0)
+        s = np.cbrt(self.WM/self.WV)
+        x, y = s*(1.0 + z), s
+        root = 0.5 + 0.5j*np.sqrt(3.0)
+        X1, Y1 = np.sqrt(1.0 + x), np.sqrt(1.0 + y)
+        X2, Y2 = np.sqrt(x - root), np.sqrt(y - root)
+        X3, Y3 = np.conj(X2), np.conj(Y2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # x - y = s*z, without the cancellation at low redshift
+            U1 = ((X1*Y2*Y3).real + (Y1*X2*X3).real)/(s*z)
+            U2 = (Y1*X2*Y3 + X1*Y2*X3)/(s*z)
+            integral = 2.0*carlson_rf_conj(U1*U1, U2*U2)
+        integral = np.where(z == 0.0, 0.0, integral)
+        r = DH*integral/(s*np.sqrt(self.WV))
+        return r[()]
+
+    def report_cosmology(self):
+        """
+        report_cosmology(): reports parameters for inputted cosmology
+        USAGE: report_comology()
+        """
+        print("***********************")
+        print("COSMOLOGY:")
+        print("   Omega_M = {0:5.3f}".format(self.WM))
+        print("   Omega_b = {0:5.3f}".format(self.WB))
+        print("   Omega_V = {0:5.3f}".format(self.WV))
+        print("   h       = {0:5.3f}".format(self.h))
+        print("   Omega_R = {0:5.3e}".format(self.WR))
+        print("   Omega_k = {0:5.3f}".format(self.WK))
+        print("***********************")
+        return
+
+    def f(self, z):
+        """
+        f(z): Function relating comoving distance to redshift.
+              Integrating f(z)dz from 0 to z' gives comoving
+              distance r(z'). Result is in Mpc/h.
+        """
+        a = 1.0/(1.0+z)
+        result = self.WK*np.power(a,-2) + self.WV + \
+            self.WM*np.power(a,-3) + self.WR*np.power(a,-4)
+        result = DH/np.sqrt(result)
+        return result
+
+    def E(self, z):
+        """
+        E(z): Peebles' E(z) function.
+        """
+        a = 1.0/(1.0+z)
+        result = self.WK*np.power(a,-2) + self.WV + \
+                 self.WM*np.power(a,-3) + self.WR*np.power(a,-4)
+        return np.sqrt(result)
+
+    def H(self, z):
+        """
+        H(z): Function to return the Hubble parameter as measured
+               by an observer at redshift, z.
+        """
+        result = 100.0*self.E(z)
+        return result
+
+    def tHubble(self, z):
+        """
+        tHubble(z): Function to return the Hubble time at z in Gyr.
+        """
+        result = 1./(self.H(z)*self.kmpersec_to_mpchpergyr)
+        return result
+
+    def comoving_distance(self, z):
+        """
+        comoving_distance(): returns the comoving distance (in Mpc/h)
+                             corresponding to redshift, z.
+                       
+        USAGE: r = comoving_distance(z)
+        NOTE: for arrays, the bin of the uniform redshift grid
+              is found directly from z*inv_dz
+        """
+        if self.exact:
+            return self.exact_comoving_distance(z)
+        if np.ndim(z) > 0:
+            return uniform_interp(z,0.0,inv_dz,self.r_comoving)
+        r = np.interp(z,redshift,self.r_comoving)
+        return r
+
+    def get_inverse_table(self):
+        """
+        get_inverse_table(): returns the redshift on a grid uniform
+                             in comoving distance, with as many points
+                             as the redshift grid, and the inverse of
+                             its spacing.
+        """
+        if self.z_comoving is None:
+            r_comoving = self.get_table()
+            rgrid = np.linspace(0.0,r_comoving[-1],nzmax)
+            self.z_comoving = np.interp(rgrid,r_comoving,redshift)
+            self.z_comoving.setflags(write=False)
+            self.inv_dr = (nzmax - 1)/r_comoving[-1]
+        return self.z_comoving, self.inv_dr
+
+    def redshift_at_distance(self, r):
+        """
+        redshift_at_distance(): returns the redshift corresponding
+                                to comoving distance, r (in Mpc/h).
+        USAGE: z = redshift_at_distance(z)
+        NOTE: for arrays, the bin of the comoving distance table
+              is found with a table uniform in comoving distance
+              instead of a binary search, and the interpolation
+              within it is that of the scalar case.
+              For exact cosmologies, the result from the table is
+              refined with Newton iterations on the closed form,
+              until they converge to double precision.
+        """
+        if np.ndim(r) > 0:
+            r = np.asarray(r, dtype=float)
+            r_comoving = self.get_table()
+            z_comoving, inv_dr = self.get_inverse_table()
+            z = uniform_interp(r,0.0,inv_dr,z_comoving)
+            nbin = len(r_comoving) - 1
+            with np.errstate(invalid='ignore'):
+                ibin = np.clip((z*inv_dz).astype(np.intp), 0, nbin - 1)
+            # Bins off by one near their edges
+            while True:
+                down = (ibin > 0) & (r < r_comoving[ibin])
+                up = (ibin < nbin - 1) & (r >= r_comoving[ibin + 1])
+                if not (down.any() or up.any()):
+                    break
+                ibin += up.astype(np.intp) - down
+            low = r_comoving[ibin]
+            slope = (redshift[ibin + 1] - redshift[ibin])/(r_comoving[ibin + 1] - low)
+            z = np.clip(slope*(r - low) + redshift[ibin], redshift[0], redshift[-1])
+        else:
+            z = np.interp(r,self.get_table(),redshift)
+        if self.exact:
+            # r(z) is concave, so after the first step the iterations
+            # approach the solution from below
+            for i in range(maxiter):
+                step = (self.exact_comoving_distance(z) - r)/self.f(z)
+                z = z - step
+                if not np.any(np.abs(step) > 4.0*eps*(1.0 + z)):
+                    break
+        return z
+
+    def age_of_universe(self, z):
+        """
+        age_of_universe(): returns the age of the Universe (in Gyr) at
+                           a redshift, z, for the given cosmology.
+        USAGE: age = age_of_universe(z)
+        """
+        a = 1.0/(1.0+z)
+        if(self.WM >= 0.99999): # Einstein de Sitter Universe
+            result = invH0*2.0*np.sqrt(a)/(3.0*self.h)
+        else:
+            if(self.WV <= 0.0): # Open Universe
+                zplus1 = 1.0/a
+                result1 = (self.WM/(2.0*self.h*np.power(1-self.WM,1.5)))
+                result2 = 2.0*np.sqrt(1.0-self.WM)*np.sqrt(self.WM*(zplus1-1.0)+1.0)
+                result3 = np.arccosh((self.WM*(zplus1-1.0)-self.WM+2.0)/(self.WM*zplus1))
+                result = invH0*result1*(result2/result3)
+            else: # Flat Universe with non-zero Cosmological Constant
+                result1 = (2.0/(3.0*self.h*np.sqrt(1.0-self.WM)))
+                result2 = np.arcsinh(np.sqrt((1.0/self.WM-1.0)*a)*a)
+                result = invH0*result1*result2
+        return result
+
+    def lookback_time(self, z):
+        """
+        lookback_time(): returns the lookback time (in Gyr) to 
+                         redshift, z.
+        USAGE: t = lookback_time(z)
+        """
+        t = self.age_of_universe(0.0) - self.age_of_universe(z)
+        return t
+
+    def angular_diameter_distance(self, z):
+        """
+        angular_diameter_distance(): returns the angular diameter
+                                     distance (in Mpc/h) corresponding
+                                     to redshift, z.
+                                     Da = size/rad
+        USAGE: dA = angular_diameter_distance(z)    
+        """
+        dr = self.comoving_distance(z)*Mpc/(c/H100) #Unitless
+        x = np.sqrt(np.abs(self.WK))*dr
+        if np.ndim(x) > 0:
+            ratio = np.ones_like(x)*-1.00
+            mask = (x > 0.1)
+            y = x[np.where(mask)]
+            if(self.WK > 0.0):
+                np.place(ratio,mask,0.5*(np.exp(y)-np.exp(-y))/y)
+            else:
+                np.place(ratio,mask,np.sin(y)/y)
+            mask = (x <= 0.1)
+            y = np.power(x[np.where(mask)],2)
+            if(self.WK < 0.0): 
+                y = -y
+            np.place(ratio,mask,1.0 + y/6.0 + np.power(y,2)/120.0)
+        else:        
+            ratio = -1.0
+            if(x > 0.1):
+                if(self.WK > 0.0):
+                    ratio = 0.5*(np.exp(x)-np.exp(-x))/x
+                else:
+                    ratio = np.sin(x)/x
+            else:
+                y = np.power(x,2)
+                if(self.WK < 0.0): 
+                    y = -y
+                ratio = 1.0 + y/6.0 + np.power(y,2)/120.0
+        dt = ratio*dr/(1.0+z)
+        dA = (c/H100)*dt/Mpc
+        return dA
+
+    def angular_scale(self, z):
+        """
+        angular_scale(): returns the angular scale (in kpc/h/arcsec)
+                         corresponding to redshift, z.
+                   
+        USAGE: a = angular_scale(z)
+        """
+        da = self.angular_diameter_distance(z) #Mpc/h/rad
+        a = da/206.26480 # 1 rad = 206265 arcsec
+        return a
+
+    def luminosity_distance(self, z):
+        """
+        luminosity_distance(): returns the luminosity distance
+                               (in Mpc/h) corresponding to a
+                               redshift, z.
+        USAGE: dL = luminosity_distance(z)
+        """
+        dL = self.angular_diameter_distance(z)*(1.0+z)**2
+        return dL
+
+    def comoving_volume(self, z, verbose=False):
+        """
+        comoving_volume(): returns the comoving volume (in (Mpc/h)^3)
+                           contained within a sphere extending out
+                           to redshift, z.
+        Example:
+        import Cosmology as cosmo
+        cosmo.set_Planck15()
+        cosmo.comoving_volume(0.9,verbose=True)
+        > cV (z=0.9) = 4.03e+10 (Mpc/h)^-3
+        """
+
+        if (z<zlow_lim):
+            return 0.0
+    
+        dr = self.comoving_distance(z)*Mpc/(c/H100) #Unitless: DC/DH
+        x = np.sqrt(np.abs(self.WK))*dr
+        if np.ndim(z) > 0:
+            ratio = np.ones_like(z)*-1.0
+            mask = (x > 0.1)
+            y = x[np.where(mask)]
+            if(self.WK > 0.0):
+                rat = (0.125*(np.exp(2.0*y)-np.exp(-2.0*y))-y/2.0)
+            else:
+                rat = (y/2.0 - np.sin(2.0*y)/4.0)
+            np.place(ratio,mask,rat/(np.power(y,3)/3.0))
+            mask = (x <= 0.1)
+            y = np.power(x[np.where(mask)],2)
+            if(self.WK < 0.0): 
+                y = -y
+            np.place(ratio,mask,1.0 + y/5.0 + np.power(y,2)*(2.0/105.0))
+        else:  
+            ratio = -1.0
+            if(x > 0.1):
+                if(self.WK > 0.0):
+                    ratio = (0.125*(np.exp(2.0*x)-np.exp(-2.0*x))-x/2.0)
+                else:
+                    ratio = (x/2.0 - np.sin(2.0*x)/4.0)
+                ratio = ratio/(np.power(x,3)/3.0)
+            else:
+                y = np.power(x,2)
+                if(self.WK < 0.0): 
+                    y = -y
+                ratio = 1.0 + y/5.0 + np.power(y,2)*(2.0/105.0)
+
+        vol = 4.0*np.pi*ratio*np.power((c/H100)*dr/Mpc,3)/3.0
+
+        if verbose:
+            print('cV (z={:.1f}) = {:.4e} (Mpc/h)^-3'.format(z,vol))
+        return vol
+
+    def cv_survey(self,z1,z2,area,verbose=False):
+        '''
+        Get the volume of a survey.
+        A cosmology needs to have been set.
+        Parameters:
+        z1 : float, lower redshift limit of the survey
+        z2 : float, higher redshift limit of the survey
+        area : float, total area of the survey (deg2)
+        Returns:
+        vsurvey : survey's comoving volume [(Mpc/h)^-3]
+        Example:
+        import Cosmology as cosmo
+        cosmo.set_bahamasW9()
+        cosmo.cv_survey(0.9,1.0,14000,verbose=True)
+        > V survey (dz=0.1) = 3.9e+09 (Mpc/h)^-3
+        '''
+
+        if (z1<zlow_lim):
+            dV = self.comoving_volume(z2)
+        else:
+            dV = self.comoving_volume(z2) - self.comoving_volume(z1)
+        
+        vsurvey = dV*area/asky
+    
+        if verbose:
+            print('V survey (dz={:.1f}) = {:.4e} (Mpc/h)^-3'.format(z2-z1,vsurvey))    
+        return vsurvey
+
+    def dVdz(self, z):
+        """
+        dVdz() : returns the comoving volume element dV/dz
+                 at redshift, z, for all sky (Mpc/h)^3.
+                 dV = (c/H100)*(1+z)**2*D_A**2/E(z) dz dOmega
+                 f(z) = (c/H100)/E(z)
+                 ==> dV/dz(z,all sky) = 4*PI*f(z)*(1+z)**2*D_A**2
+             
+        USAGE: dVdz = dVdz(z)
+        """
+        dA = self.angular_diameter_distance(z)
+        return self.f(z)*np.power(dA,2)*np.power(1.0+z,2)*4.0*np.pi
+
+    def distance_modulus(self, z):
+        '''
+        Dinstance modulus 5log10(Dl/10) - 5logh
+        Dl is expected in Mpc/h
+        '''
+        if (z < zlow_lim):
+            dm = 0.0
+        else:
+            dL = self.luminosity_distance(z)
+            dm = 5.0*np.log10(dL) + 25
+        return dm
+
+    def band_corrected_distance_modulus(self, z):
+        """
+        band_corrected_distance_modulus(): returns the Band Corrected
+                Distance Modulus (BCDM) at redshift, z.
+        USAGE: bcdm = band_corrected_distance_modulus(z)
+        FURTHER INFORMATION:
+        There is no h dependence as we work always in length units of Mpc/h 
+        such that our absolute magnitudes are really Mabs-5logh and no 
+        additional h dependence is needed here to get apparent magnitudes 
+        that are h independent.
+    
+        In Galform versions 2.5.1 onwards the additional -2.5 * log10(1.0+z)
+        is needed to convert from absolute to apparent magnitude as the 
+        definition of absolute magnitude in the Galform code has been changed
+        by a factor of (1+z). With the new definition a galaxy with a SED in 
+        which f_nu is a constant will, quite sensibly, have the same AB 
+        absolute magnitude independent wave band range (including whether it 
+        is rest or observer frame) and independent of redshift. 
+    
+        One way of thinking about this is that while the standard luminosity
+        distance and corresponding distance modulus applies to bolometric 
+        luminosities, for a filter of finite width the flux depends on the
+        band width of the filter in the galaxy's rest frame and it is this 
+        that we are taking into account when defining this "band corrected"
+        distance modulus. 
+        """
+        dref = 10.0/mega # 10pc in Mpc
+        if np.ndim(z) > 0:
+            z = np.asarray(z)
+            dL = self.luminosity_distance(np.maximum(z,zlow_lim))
+            bcdm = 5.0*np.log10(dL/dref) - 2.5*np.log10(1.0+z)
+            return np.where(z < zlow_lim,0.0,bcdm)
+        if (z < zlow_lim):
+            bcdm = 0.0
+        else:
+            dL = self.luminosity_distance(z)
+            bcdm = 5.0*np.log10(dL/dref) - 2.5*np.log10(1.0+z)
+        return bcdm
+
+    def Hubble(self):
+        """
+        Hubble(): returns h for the specified cosmology
+    
+        USAGE: h = Hubble()
+        """
+        return self.h
+
+    def Omega_M(self):
+        """
+        Omega_M(): returns Omega_M for the specified cosmology
+    
+        USAGE: wm = Omega_M()
+        """
+        return self.WM
+
+    def Omega_b(self):
+        """
+        Omega_b(): returns Omega_b for the specified cosmology
+                   
+        USAGE: wb = Omega_b()
+        """
+        return self.WB
+
+    def Omega_V(self):
+        """
+        Omega_V(): returns Omega_V for the specified cosmology
+                   
+        USAGE: wv = Omega_V()
+        """
+        return self.WV
+
+    def Omega_r(self):
+        """
+        Omega_r(): returns Omega_r for the specified cosmology
+        USAGE: wr = Omega_r()
+        """
+        return self.WR
+
+    def Omega_k(self):
+        """
+        Omega_k(): returns Omega_k for the specified cosmology
+                   
+        USAGE: wk = Omega_k()
+        """
+        return self.WK
+
+    def omegam(self, z):
+        """
+        Matter density at z
+        """
+        a = 1.0/(1.0+z)
+        omegam=self.WM*np.power(a,-3)/(self.E(z)**2)
+        return omegam
+
+    def omegab(self, z):
+        """
+        Baryonic density at z
+        """
+        a = 1.0/(1.0+z)
+        omegab=self.WB*np.power(a,-3)/(self.E(z)**2)
+        return omegab
+
+    def omegav(self, z):
+        """
+        Vacuum/Cosmological constant density at z
+        """
+        a = 1.0/(1.0+z)
+        omegav=self.WV/(self.E(z)**2)
+        return omegav
+
+    def omegar(self, z):
+        """
+        Radiation density at z
+        """
+        a = 1.0/(1.0+z)
+        omegar=self.WR*np.power(a,-4)/(self.E(z)**2)
+        return omegar
+
+    def kaiser_factor(self,z,bias,gamma=None):
+        """
+        Calculate the Kaiser Factor from either a linear bias value
+        or an array bias 
+        """
+        if (gamma is None):
+            gamma = 0.55
+    
+        omb = np.power(self.omegam(z),gamma)/bias 
+        kaiser_factor = 1. + (2./3.)*omb + (1./5.)*omb**2.
+
+        return kaiser_factor
+
+    def ndeg2nV(self,ndeg,z1,z2,verbose=False):
+        '''
+        Transforms number of objects per deg2 per dz to 
+        number density (N/V). 
+        A cosmology needs to have been set.
+        Parameters:
+        ndeg : float, number of objects per deg2 per dz
+        z1 : float, lower redshift limit of the survey
+        z2 : float, higher redshift limit of the survey
+        Returns:
+        nV : Number density (NV) [(Mpc/h)^-3]
+        Example:
+        import Cosmology as cosmo
+        cosmo.set_bahamasW9()
+        cosmo.ndeg2nV(2400,0.6,1.6)
+        > 0.0002671477226063551
+        '''
+
+        dV = self.comoving_volume(z2) - self.comoving_volume(z1)
+        dz = z2-z1
+        nV = ndeg*dz*asky/dV
+    
+        if verbose:
+            print('n (dz={:.1f}) = {:.4e} (Mpc/h)^-3'.format(dz,nV))
+    
+        return nV
+
+    def logL2flux(self,log10luminosity,inz):
+        """
+        Returns flux in units of erg/s/cm^2 from input of
+        log10(Luminosity in units of h-2erg/s)
+        and corresponding redshifts.
+        """
+        if log10luminosity>-9.:
+            zz = max(inz,zlow_lim)
+        
+            # Luminosity distance in cm/h
+            d_L = self.luminosity_distance(zz)*Mpc2cm
+
+            # Luminosities are in h-2 erg/s units
+            den = 4.0*np.pi*(d_L**2)
+            emission_line_flux = log10luminosity - np.log10(den)
+            # Flux in erg/s/cm^2
+            emission_line_flux = 10**(emission_line_flux)
+        else:
+            emission_line_flux = 0.
+
+        return emission_line_flux
+
+    def emission_line_flux(self,luminosity_data,inz):
+        """
+        Returns flux in units of erg/s/cm^2 from input of 
+        bolometric luminosity_data in units of E+40*h-2erg/s
+        and corresponding redshifts.
+        """
+
+        if luminosity_data>0.:
+            zz = max(inz,zlow_lim)
+        
+            # Luminosity distance in cm/h
+            d_L = self.luminosity_distance(zz)*Mpc2cm
+
+            # Luminosities are in 10^40 h-2 erg/s units
+            den = 4.0*np.pi*(d_L**2)
+            emission_line_flux = np.log10(luminosity_data/den) + 40.
+            # Flux in erg/s/cm^2
+            emission_line_flux = 10**(emission_line_flux)
+        else:
+            emission_line_flux = 0.
+        
+        return emission_line_flux
+
+    def emission_line_luminosity(self,flux_data,inz):
+        """
+        Returns bolometric luminosity in units of E+40*erg/s from input of 
+        flux_data in units of erg/s/cm^2 and corresponding redshifts.
+        """
+
+        if flux_data>0.:
+            zz = max(inz,zlow_lim)
+        
+            # Luminosity distance in cm/h
+            d_L = self.luminosity_distance(zz)*Mpc2cm
+        
+            emission_line_luminosity = np.log10(4.0*np.pi*(d_L**2)*flux_data) - 40.
+            emission_line_luminosity = 10**(emission_line_luminosity)
+        else:
+            emission_line_luminosity = 0.
+        
+        return emission_line_luminosity
+
+    def polar2cartesians(self,ra,dec,zz):
+        """ Returns cartesian coordinates given polar ones in degrees"""
+        dz = self.comoving_distance(zz)
+        cx = dz*np.cos(dec*(np.pi/180.))*np.cos(ra*(np.pi/180.))
+        cy = dz*np.cos(dec*(np.pi/180.))*np.sin(ra*(np.pi/180.))
+        cz = dz*np.sin(dec*(np.pi/180.))
+        return cx,cy,cz
+
+
+# Cosmology used by the functions of this module
+default = None
+
+def get_cosmology():
+    """
+    get_cosmology(): returns the Cosmology set with set_cosmology()
+                     (will exit if no cosmology has been set)
+    """
+    if default is None:
+        print('STOP: A cosmology needs to be set with set_cosmology()')
+        sys.exit(1)
+    return default
+
+
 def set_cosmology(omega0=None,omegab=None,lambda0=None,h0=None, \
-                      universe="Flat",include_radiation=False):
+                      universe="Flat",include_radiation=False,exact=False):
     """
     set_cosmology(): Sets the cosmological parameters and evaluates
                      the comoving distance relation as a function
@@ -161,43 +1044,31 @@ def set_cosmology(omega0=None,omegab=None,lambda0=None,h0=None, \
                      -- can be "True" (i.e. set Omega_R = 4.165e-5/(h*h))
                      of "False" (i.e. set Omega_R = 0.0)
                      (default value is False)
+           exact: closed form comoving distances for flat
+                  cosmologies without radiation (default value is False)
           Default values: Planck18
+
+    The module functions use this cosmology, also kept in the
+    module variables WM, WV, WB, WR, WK, h and r_comoving. With
+    exact=True the table is not built and r_comoving is NaN
+    (get_cosmology().get_table() builds it, if needed).
     """
+    global default
+    default = Cosmology(omega0=omega0, omegab=omegab, lambda0=lambda0,
+                        h0=h0, universe=universe,
+                        include_radiation=include_radiation,
+                        exact=exact)
 
-    global WM, WV, WB, WR, WK, h
-    if(h0 is None):
-        h = 0.674
-    else:
-        h = h0    
-    if(include_radiation):
-        WR = 8.985075e-5
-    else:
-        WR = 0.0
-    if(omegab is None):
-        WB = 0.0224/(h*h)
-    else:
-        WB = omegab
-    if(omega0 is None):
-        WM = 0.315
-    else:
-        WM = omega0
-    if(lambda0 is None):
-        if(universe in ("Flat","F","flat","f")):
-            WV = 1.0 - (WM + WR)
-        if(universe in ("Open","O","open","o")):
-            WV = 0
-    else:
-        WV = lambda0
-    WK = 1.0 - (WM + WV + WR)
+    global WM, WV, WB, WR, WK, h, kmpersec_to_mpchpergyr
+    WM, WV, WB, WR, WK = default.WM, default.WV, default.WB, default.WR, default.WK
+    h = default.h
+    kmpersec_to_mpchpergyr = default.kmpersec_to_mpchpergyr
 
     global r_comoving, redshift
-    for i in range(1,len(redshift)):
-        z1 = redshift[i-1]
-        z2 = redshift[i]
-        r_comoving[i] = r_comoving[i-1] + romberg(f,z1,z2)
-
-    global kmpersec_to_mpchpergyr
-    kmpersec_to_mpchpergyr = kilo * (Gyr/Mpc) * h
+    if default.exact:
+        r_comoving[:] = np.nan
+    else:
+        r_comoving[:] = default.r_comoving
 
     return
 
@@ -232,6 +1103,7 @@ def set_Planck15(): #UNIT
     return
 
 
+
 def cosmology_set():
     """
     cosmology_set(): determines whether an input cosmology
@@ -239,602 +1111,289 @@ def cosmology_set():
                      no ==> FALSE).
     USAGE: cosmology_set()
     """
-    if(WM is None):
-        return False
-    else:
-        return True
-    
+    return default is not None
+
 
 def report_cosmology():
     """
-    report_cosmology(): reports parameters for inputted cosmology
-    USAGE: report_comology()
-    """
-    print("***********************")
-    print("COSMOLOGY:")
-    print("   Omega_M = {0:5.3f}".format(WM))
-    print("   Omega_b = {0:5.3f}".format(WB))
-    print("   Omega_V = {0:5.3f}".format(WV))
-    print("   h       = {0:5.3f}".format(h))
-    print("   Omega_R = {0:5.3e}".format(WR))
-    print("   Omega_k = {0:5.3f}".format(WK))
-    print("***********************")
-    return
+    report_cosmology(): see Cosmology.report_cosmology,
+                        using the cosmology set with set_cosmology()
+    """
+    return get_cosmology().report_cosmology()
 
 
 def f(z):
     """
-    f(z): Function relating comoving distance to redshift.
-          Integrating f(z)dz from 0 to z' gives comoving
-          distance r(z'). Result is in Mpc/h.
-          
-          Note: uses global cosmology variables.          
+    f(): see Cosmology.f,
+         using the cosmology set with set_cosmology()
     """
-    a = 1.0/(1.0+z)
-    result = WK*np.power(a,-2) + WV + \
-        WM*np.power(a,-3) + WR*np.power(a,-4)
-    result = DH/np.sqrt(result)
-    return result
+    return get_cosmology().f(z)
 
 
 def E(z):
     """
-    E(z): Peebles' E(z) function.
-              
-          Note: uses global cosmology variables.  
+    E(): see Cosmology.E,
+         using the cosmology set with set_cosmology()
     """
-    a = 1.0/(1.0+z)
-    result = WK*np.power(a,-2) + WV + \
-             WM*np.power(a,-3) + WR*np.power(a,-4)
-    return np.sqrt(result)
-
-
-def rez(lz):
-    """
-    E(ln_z): Function relating comoving distance to redshift.
-          Integrating rez(z)d(ln_z) from zlow to z' gives comoving
-          distance r(z'). Result is in Mpc/h.
-          
-          Note: uses global cosmology variables.          
-    """
-    
-    z = exp(lz)
-    a = 1.0/(1.0+z)
-    result = WK*np.power(a,-2) + WV + \
-        WM*np.power(a,-3) + WR*np.power(a,-4)
-
-    result = DH/np.sqrt(result)
-    return result
-
+    return get_cosmology().E(z)
 
 
 def H(z):
     """
-    H(z): Function to return the Hubble parameter as measured
-           by an observer at redshift, z.
+    H(): see Cosmology.H,
+         using the cosmology set with set_cosmology()
     """
-    cosmology_set()
-    result = 100.0*E(z)
-    return result
+    return get_cosmology().H(z)
+
 
 def tHubble(z):
     """
-    tHubble(z): Function to return the Hubble time at z in Gyr.
+    tHubble(): see Cosmology.tHubble,
+               using the cosmology set with set_cosmology()
     """
-    cosmology_set()
-    result = 1./(H(z)*kmpersec_to_mpchpergyr)
-    return result
+    return get_cosmology().tHubble(z)
+
 
 def comoving_distance(z):
     """
-    comoving_distance(): returns the comoving distance (in Mpc/h)
-                         corresponding to redshift, z.
-                       
-    USAGE: r = comoving_distance(z)
-    NOTE: requires that a cosmology must first have been
-          set using set_cosmology()
+    comoving_distance(): see Cosmology.comoving_distance,
+                         using the cosmology set with set_cosmology()
     """
-    cosmology_set()
-    r = np.interp(z,redshift,r_comoving)
-    return r
+    return get_cosmology().comoving_distance(z)
+
 
 def redshift_at_distance(r):
     """
-    redshift_at_distance(): returns the redshift corresponding
-                            to comoving distance, r (in Mpc/h).
-    USAGE: z = redshift_at_distance(z)
-    NOTE: requires that a cosmology must first have been
-          set using set_cosmology()
+    redshift_at_distance(): see Cosmology.redshift_at_distance,
+                            using the cosmology set with set_cosmology()
     """
-    cosmology_set()
-    z = np.interp(r,r_comoving,redshift)
-    return z
+    return get_cosmology().redshift_at_distance(r)
 
 
 def age_of_universe(z):
     """
-    age_of_universe(): returns the age of the Universe (in Gyr) at
-                       a redshift, z, for the given cosmology.
-    USAGE: age = age_of_universe(z)
-    NOTE: requires that a cosmology must first have been
-          set using set_cosmology()
+    age_of_universe(): see Cosmology.age_of_universe,
+                       using the cosmology set with set_cosmology()
     """
-    cosmology_set()
-    a = 1.0/(1.0+z)
-    if(WM >= 0.99999): # Einstein de Sitter Universe
-        result = invH0*2.0*np.sqrt(a)/(3.0*h)
-    else:
-        if(WV <= 0.0): # Open Universe
-            zplus1 = 1.0/a
-            result1 = (WM/(2.0*h*np.power(1-WM,1.5)))
-            result2 = 2.0*np.sqrt(1.0-WM)*np.sqrt(WM*(zplus1-1.0)+1.0)
-            result3 = np.arccosh((WM*(zplus1-1.0)-WM+2.0)/(WM*zplus1))
-            result = invH0*result1*(result2/result3)
-        else: # Flat Universe with non-zero Cosmological Constant
-            result1 = (2.0/(3.0*h*np.sqrt(1.0-WM)))
-            result2 = np.arcsinh(np.sqrt((1.0/WM-1.0)*a)*a)
-            result = invH0*result1*result2
-    return result
+    return get_cosmology().age_of_universe(z)
 
 
 def lookback_time(z):
     """
-    lookback_time(): returns the lookback time (in Gyr) to 
-                     redshift, z.
-    USAGE: t = lookback_time(z)
-    
-    NOTE: requires that a cosmology must first have been
-          set using set_cosmology()    
+    lookback_time(): see Cosmology.lookback_time,
+                     using the cosmology set with set_cosmology()
     """
-    cosmology_set()
-    t = age_of_universe(0.0) - age_of_universe(z)
-    return t
+    return get_cosmology().lookback_time(z)
 
 
 def angular_diameter_distance(z):
     """
-    angular_diameter_distance(): returns the angular diameter
-                                 distance (in Mpc/h) corresponding
-                                 to redshift, z.
-                                 Da = size/rad
-    USAGE: dA = angular_diameter_distance(z)    
-    NOTE: requires that a cosmology must first have been
-          set using set_cosmology()    
-    """
-    cosmology_set()
-    dr = comoving_distance(z)*Mpc/(c/H100) #Unitless
-    x = np.sqrt(np.abs(WK))*dr
-    if np.ndim(x) > 0:
-        ratio = np.ones_like(x)*-1.00
-        mask = (x > 0.1)
-        y = x[np.where(mask)]
-        if(WK > 0.0):
-            np.place(ratio,mask,0.5*(np.exp(y)-np.exp(-y))/y)
-        else:
-            np.place(ratio,mask,np.sin(y)/y)
-        mask = (x <= 0.1)
-        y = np.power(x[np.where(mask)],2)
-        if(WK < 0.0): 
-            y = -y
-        np.place(ratio,mask,1.0 + y/6.0 + np.power(y,2)/120.0)
-    else:        
-        ratio = -1.0
-        if(x > 0.1):
-            if(WK > 0.0):
-                ratio = 0.5*(np.exp(x)-np.exp(-x))/x
-            else:
-                ratio = np.sin(x)/x
-        else:
-            y = np.power(x,2)
-            if(WK < 0.0): 
-                y = -y
-            ratio = 1.0 + y/6.0 + np.power(y,2)/120.0
-    dt = ratio*dr/(1.0+z)
-    dA = (c/H100)*dt/Mpc
-    return dA
+    angular_diameter_distance(): see Cosmology.angular_diameter_distance,
+                                 using the cosmology set with set_cosmology()
+    """
+    return get_cosmology().angular_diameter_distance(z)
 
 
 def angular_scale(z):
     """
-    angular_scale(): returns the angular scale (in kpc/h/arcsec)
-                     corresponding to redshift, z.
-                   
-    USAGE: a = angular_scale(z)
-    NOTE: requires that a cosmology must first have been
-          set using set_cosmology()    
-    """
-    cosmology_set()
-    da = angular_diameter_distance(z) #Mpc/h/rad
-    a = da/206.26480 # 1 rad = 206265 arcsec
-    return a
-    
+    angular_scale(): see Cosmology.angular_scale,
+                     using the cosmology set with set_cosmology()
+    """
+    return get_cosmology().angular_scale(z)
+
 
 def luminosity_distance(z):
     """
-    luminosity_distance(): returns the luminosity distance
-                           (in Mpc/h) corresponding to a
-                           redshift, z.
-    USAGE: dL = luminosity_distance(z)
-    NOTE: requires that a cosmology must first have been
-          set using set_cosmology()    
+    luminosity_distance(): see Cosmology.luminosity_distance,
+                           using the cosmology set with set_cosmology()
     """
-    dL = angular_diameter_distance(z)*(1.0+z)**2
-    return dL
-    
+    return get_cosmology().luminosity_distance(z)
+
 
 def comoving_volume(z, verbose=False):
     """
-    comoving_volume(): returns the comoving volume (in (Mpc/h)^3)
-                       contained within a sphere extending out
-                       to redshift, z.
-    Example:
-    import Cosmology as cosmo
-    cosmo.set_Planck15()
-    cosmo.comoving_volume(0.9,verbose=True)
-    > cV (z=0.9) = 4.03e+10 (Mpc/h)^-3
+    comoving_volume(): see Cosmology.comoving_volume,
+                       using the cosmology set with set_cosmology()
     """
-    cosmology_set()
-
-    if (z<zlow_lim):
-        return 0.0
-    
-    dr = comoving_distance(z)*Mpc/(c/H100) #Unitless: DC/DH
-    x = np.sqrt(np.abs(WK))*dr
-    if np.ndim(z) > 0:
-        ratio = np.ones_like(z)*-1.0
-        mask = (x > 0.1)
-        y = x[np.where(mask)]
-        if(WK > 0.0):
-            rat = (0.125*(np.exp(2.0*y)-np.exp(-2.0*y))-y/2.0)
-        else:
-            rat = (y/2.0 - np.sin(2.0*y)/4.0)
-        np.place(ratio,mask,rat/(np.power(y,3)/3.0))
-        mask = (x <= 0.1)
-        y = np.power(x[np.where(mask)],2)
-        if(WK < 0.0): 
-            y = -y
-        np.place(ratio,mask,1.0 + y/5.0 + np.power(y,2)*(2.0/105.0))
-    else:  
-        ratio = -1.0
-        if(x > 0.1):
-            if(WK > 0.0):
-                ratio = (0.125*(np.exp(2.0*x)-np.exp(-2.0*x))-x/2.0)
-            else:
-                ratio = (x/2.0 - np.sin(2.0*x)/4.0)
-            ratio = ratio/(np.power(x,3)/3.0)
-        else:
-            y = np.power(x,2)
-            if(WK < 0.0): 
-                y = -y
-            ratio = 1.0 + y/5.0 + np.power(y,2)*(2.0/105.0)
-
-    vol = 4.0*np.pi*ratio*np.power((c/H100)*dr/Mpc,3)/3.0
-
-    if verbose:
-        print('cV (z={:.1f}) = {:.4e} (Mpc/h)^-3'.format(z,vol))
-    return vol
+    return get_cosmology().comoving_volume(z, verbose)
 
 
 def cv_survey(z1,z2,area,verbose=False):
-    '''
-    Get the volume of a survey.
-    A cosmology needs to have been set.
-    Parameters:
-    z1 : float, lower redshift limit of the survey
-    z2 : float, higher redshift limit of the survey
-    area : float, total area of the survey (deg2)
-    Returns:
-    vsurvey : survey's comoving volume [(Mpc/h)^-3]
-    Example:
-    import Cosmology as cosmo
-    cosmo.set_bahamasW9()
-    cosmo.cv_survey(0.9,1.0,14000,verbose=True)
-    > V survey (dz=0.1) = 3.9e+09 (Mpc/h)^-3
-    '''
-
-    if (z1<zlow_lim):
-        dV = comoving_volume(z2)
-    else:
-        dV = comoving_volume(z2) - comoving_volume(z1)
-        
-    vsurvey = dV*area/asky
-    
-    if verbose:
-        print('V survey (dz={:.1f}) = {:.4e} (Mpc/h)^-3'.format(z2-z1,vsurvey))    
-    return vsurvey
+    """
+    cv_survey(): see Cosmology.cv_survey,
+                 using the cosmology set with set_cosmology()
+    """
+    return get_cosmology().cv_survey(z1, z2, area, verbose)
 
 
 def dVdz(z):
     """
-    dVdz() : returns the comoving volume element dV/dz
-             at redshift, z, for all sky (Mpc/h)^3.
-             dV = (c/H100)*(1+z)**2*D_A**2/E(z) dz dOmega
-             f(z) = (c/H100)/E(z)
-             ==> dV/dz(z,all sky) = 4*PI*f(z)*(1+z)**2*D_A**2
-             
-    USAGE: dVdz = dVdz(z)
-    NOTE: requires that a cosmology must first have been
-          set using set_cosmology()         
+    dVdz(): see Cosmology.dVdz,
+            using the cosmology set with set_cosmology()
     """
-    cosmology_set()
-    dA = angular_diameter_distance(z)
-    return f(z)*np.power(dA,2)*np.power(1.0+z,2)*4.0*np.pi
-    
+    return get_cosmology().dVdz(z)
+
 
 def distance_modulus(z):
-    '''
-    Dinstance modulus 5log10(Dl/10) - 5logh
-    Dl is expected in Mpc/h
-    '''
-    cosmology_set()
-    if (z < zlow_lim):
-        dm = 0.0
-    else:
-        dL = luminosity_distance(z)
-        dm = 5.0*np.log10(dL) + 25
-    return dm
+    """
+    distance_modulus(): see Cosmology.distance_modulus,
+                        using the cosmology set with set_cosmology()
+    """
+    return get_cosmology().distance_modulus(z)
 
 
 def band_corrected_distance_modulus(z):
     """
-    band_corrected_distance_modulus(): returns the Band Corrected
-            Distance Modulus (BCDM) at redshift, z.
-    USAGE: bcdm = band_corrected_distance_modulus(z)
-            
-    NOTE: requires that a cosmology must first have been
-          set using set_cosmology()
-    FURTHER INFORMATION:
-    There is no h dependence as we work always in length units of Mpc/h 
-    such that our absolute magnitudes are really Mabs-5logh and no 
-    additional h dependence is needed here to get apparent magnitudes 
-    that are h independent.
-    
-    In Galform versions 2.5.1 onwards the additional -2.5 * log10(1.0+z)
-    is needed to convert from absolute to apparent magnitude as the 
-    definition of absolute magnitude in the Galform code has been changed
-    by a factor of (1+z). With the new definition a galaxy with a SED in 
-    which f_nu is a constant will, quite sensibly, have the same AB 
-    absolute magnitude independent wave band range (including whether it 
-    is rest or observer frame) and independent of redshift. 
-    
-    One way of thinking about this is that while the standard luminosity
-    distance and corresponding distance modulus applies to bolometric 
-    luminosities, for a filter of finite width the flux depends on the
-    band width of the filter in the galaxy's rest frame and it is this 
-    that we are taking into account when defining this "band corrected"
-    distance modulus. 
-    """
-    cosmology_set()
-    if (z < zlow_lim):
-        bcdm = 0.0
-    else:
-        dref = 10.0/mega # 10pc in Mpc
-        dL = luminosity_distance(z)
-        bcdm = 5.0*np.log10(dL/dref) - 2.5*np.log10(1.0+z)
-    return bcdm
+    band_corrected_distance_modulus(): see Cosmology.band_corrected_distance_modulus,
+                                       using the cosmology set with set_cosmology()
+    """
+    return get_cosmology().band_corrected_distance_modulus(z)
 
 
 def Hubble():
     """
-    Hubble(): returns h for the specified cosmology
-              (will exit if no cosmology has been set)
-    
-    USAGE: h = Hubble()
+    Hubble(): see Cosmology.Hubble,
+              using the cosmology set with set_cosmology()
     """
-    cosmology_set()
-    return h
+    return get_cosmology().Hubble()
+
 
 def Omega_M():
     """
-    Omega_M(): returns Omega_M for the specified cosmology
-              (will exit if no cosmology has been set)
-    
-    USAGE: wm = Omega_M()
+    Omega_M(): see Cosmology.Omega_M,
+               using the cosmology set with set_cosmology()
     """
-    cosmology_set()
-    return WM
+    return get_cosmology().Omega_M()
 
 
 def Omega_b():
     """
-    Omega_b(): returns Omega_b for the specified cosmology
-               (will exit if no cosmology has been set)
-                   
-    USAGE: wb = Omega_b()
+    Omega_b(): see Cosmology.Omega_b,
+               using the cosmology set with set_cosmology()
     """
-    cosmology_set()
-    return WB
+    return get_cosmology().Omega_b()
+
 
 def Omega_V():
     """
-    Omega_V(): returns Omega_V for the specified cosmology
-               (will exit if no cosmology has been set)
-                   
-    USAGE: wv = Omega_V()
+    Omega_V(): see Cosmology.Omega_V,
+               using the cosmology set with set_cosmology()
     """
-    cosmology_set()
-    return WV
+    return get_cosmology().Omega_V()
+
 
 def Omega_r():
     """
-    Omega_r(): returns Omega_r for the specified cosmology
-               (will exit if no cosmology has been set)
-    USAGE: wr = Omega_r()
+    Omega_r(): see Cosmology.Omega_r,
+               using the cosmology set with set_cosmology()
     """
-    cosmology_set()
-    return WR
+    return get_cosmology().Omega_r()
+
 
-    
 def Omega_k():
     """
-    Omega_k(): returns Omega_k for the specified cosmology
-               (will exit if no cosmology has been set)
-                   
-    USAGE: wk = Omega_k()
+    Omega_k(): see Cosmology.Omega_k,
+               using the cosmology set with set_cosmology()
     """
-    cosmology_set()
-    return WK
+    return get_cosmology().Omega_k()
 
 
 def omegam(z):
     """
-    Matter density at z
-              
-          Note: uses global cosmology variables.  
+    omegam(): see Cosmology.omegam,
+              using the cosmology set with set_cosmology()
     """
-    a = 1.0/(1.0+z)
-    omegam=WM*np.power(a,-3)/(E(z)**2)
-    return omegam
+    return get_cosmology().omegam(z)
+
 
 def omegab(z):
     """
-    Baryonic density at z
-              
-          Note: uses global cosmology variables.  
+    omegab(): see Cosmology.omegab,
+              using the cosmology set with set_cosmology()
     """
-    a = 1.0/(1.0+z)
-    omegab=WB*np.power(a,-3)/(E(z)**2)
-    return omegab
+    return get_cosmology().omegab(z)
 
 
 def omegav(z):
     """
-    Vacuum/Cosmological constant density at z
-              
-          Note: uses global cosmology variables.  
+    omegav(): see Cosmology.omegav,
+              using the cosmology set with set_cosmology()
     """
-    a = 1.0/(1.0+z)
-    omegav=WV/(E(z)**2)
-    return omegav
+    return get_cosmology().omegav(z)
 
 
 def omegar(z):
     """
-    Radiation density at z
-              
-          Note: uses global cosmology variables.  
+    omegar(): see Cosmology.omegar,
+              using the cosmology set with set_cosmology()
     """
-    a = 1.0/(1.0+z)
-    omegar=WR*np.power(a,-4)/(E(z)**2)
-    return omegar
+    return get_cosmology().omegar(z)
 
 
 def kaiser_factor(z,bias,gamma=None):
     """
-    Calculate the Kaiser Factor from either a linear bias value
-    or an array bias 
+    kaiser_factor(): see Cosmology.kaiser_factor,
+                     using the cosmology set with set_cosmology()
     """
-    if (gamma is None):
-        gamma = 0.55
-    
-    omb = np.power(omegam(z),gamma)/bias 
-    kaiser_factor = 1. + (2./3.)*omb + (1./5.)*omb**2.
-
-    return kaiser_factor
+    return get_cosmology().kaiser_factor(z, bias, gamma)
 
 
 def ndeg2nV(ndeg,z1,z2,verbose=False):
-    '''
-    Transforms number of objects per deg2 per dz to 
-    number density (N/V). 
-    A cosmology needs to have been set.
-    Parameters:
-    ndeg : float, number of objects per deg2 per dz
-    z1 : float, lower redshift limit of the survey
-    z2 : float, higher redshift limit of the survey
-    Returns:
-    nV : Number density (NV) [(Mpc/h)^-3]
-    Example:
-    import Cosmology as cosmo
-    cosmo.set_bahamasW9()
-    cosmo.ndeg2nV(2400,0.6,1.6)
-    > 0.0002671477226063551
-    '''
-
-    dV = comoving_volume(z2) - comoving_volume(z1)
-    dz = z2-z1
-    nV = ndeg*dz*asky/dV
-    
-    if verbose:
-        print('n (dz={:.1f}) = {:.4e} (Mpc/h)^-3'.format(dz,nV))
-    
-    return nV
+    """
+    ndeg2nV(): see Cosmology.ndeg2nV,
+               using the cosmology set with set_cosmology()
+    """
+    return get_cosmology().ndeg2nV(ndeg, z1, z2, verbose)
+
 
-    
 def logL2flux(log10luminosity,inz):
     """
-    Returns flux in units of erg/s/cm^2 from input of
-    log10(Luminosity in units of h-2erg/s)
-    and corresponding redshifts.
+    logL2flux(): see Cosmology.logL2flux,
+                 using the cosmology set with set_cosmology()
     """
-    if log10luminosity>-9.:
-        zz = max(inz,zlow_lim)
-        
-        # Luminosity distance in cm/h
-        d_L = luminosity_distance(zz)*Mpc2cm
-
-        # Luminosities are in h-2 erg/s units
-        den = 4.0*np.pi*(d_L**2)
-        emission_line_flux = log10luminosity - np.log10(den)
-        # Flux in erg/s/cm^2
-        emission_line_flux = 10**(emission_line_flux)
-    else:
-        emission_line_flux = 0.
-
-    return emission_line_flux
+    return get_cosmology().logL2flux(log10luminosity, inz)
 
 
 def emission_line_flux(luminosity_data,inz):
     """
-    Returns flux in units of erg/s/cm^2 from input of 
-    bolometric luminosity_data in units of E+40*h-2erg/s
-    and corresponding redshifts.
+    emission_line_flux(): see Cosmology.emission_line_flux,
+                          using the cosmology set with set_cosmology()
     """
-
-    if luminosity_data>0.:
-        zz = max(inz,zlow_lim)
-        
-        # Luminosity distance in cm/h
-        d_L = luminosity_distance(zz)*Mpc2cm
-
-        # Luminosities are in 10^40 h-2 erg/s units
-        den = 4.0*np.pi*(d_L**2)
-        emission_line_flux = np.log10(luminosity_data/den) + 40.
-        # Flux in erg/s/cm^2
-        emission_line_flux = 10**(emission_line_flux)
-    else:
-        emission_line_flux = 0.
-        
-    return emission_line_flux
+    return get_cosmology().emission_line_flux(luminosity_data, inz)
 
 
 def emission_line_luminosity(flux_data,inz):
     """
-    Returns bolometric luminosity in units of E+40*erg/s from input of 
-    flux_data in units of erg/s/cm^2 and corresponding redshifts.
+    emission_line_luminosity(): see Cosmology.emission_line_luminosity,
+                                using the cosmology set with set_cosmology()
     """
-
-    if flux_data>0.:
-        zz = max(inz,zlow_lim)
-        
-        # Luminosity distance in cm/h
-        d_L = luminosity_distance(zz)*Mpc2cm
-        
-        emission_line_luminosity = np.log10(4.0*np.pi*(d_L**2)*flux_data) - 40.
-        emission_line_luminosity = 10**(emission_line_luminosity)
-    else:
-        emission_line_luminosity = 0.
-        
-    return emission_line_luminosity
+    return get_cosmology().emission_line_luminosity(flux_data, inz)
 
 
 def polar2cartesians(ra,dec,zz):
-    """ Returns cartesian coordinates given polar ones in degrees"""
-    dz = comoving_distance(zz)
-    cx = dz*np.cos(dec*(np.pi/180.))*np.cos(ra*(np.pi/180.))
-    cy = dz*np.cos(dec*(np.pi/180.))*np.sin(ra*(np.pi/180.))
-    cz = dz*np.sin(dec*(np.pi/180.))
-    return cx,cy,cz
+    """
+    polar2cartesians(): see Cosmology.polar2cartesians,
+                        using the cosmology set with set_cosmology()
+    """
+    return get_cosmology().polar2cartesians(ra, dec, zz)
+
+
+def rez(lz):
+    """
+    E(ln_z): Function relating comoving distance to redshift.
+          Integrating rez(z)d(ln_z) from zlow to z' gives comoving
+          distance r(z'). Result is in Mpc/h.
+          
+          Note: uses global cosmology variables.          
+    """
+    
+    z = exp(lz)
+    a = 1.0/(1.0+z)
+    result = WK*np.power(a,-2) + WV + \
+        WM*np.power(a,-3) + WR*np.power(a,-4)
+
+    result = DH/np.sqrt(result)
+    return result
 
 if __name__== "__main__":
     #set_Planck13()
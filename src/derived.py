@@ -0,0 +1,191 @@
+"""
+Engine evaluating derived columns from the input ones
+"""
+import numpy as np
+
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+class DerivedColumn:
+    """
+    Column derived from other ones with a vectorized kernel
+
+    Parameters
+    ----------
+    name : str
+        Name of the derived column
+    inputs : list of str
+        Names of the input columns, or of other derived columns
+    kernel : function
+        Function called as kernel(out, *inputs, **params),
+        filling in place the output array out
+    units : str
+        Units of the derived column
+    dtype : str
+        Type of the output array, None for the default one of
+        the engine and 'input' for that of the first input
+    params : dict
+        Arguments of the kernel taken from the parameters given
+        to the engine, as {argument: parameter}
+    """
+    def __init__(self, name, inputs, kernel, units, dtype=None, params=None):
+        self.name = name
+        self.inputs = list(inputs)
+        self.kernel = kernel
+        self.units = units
+        self.dtype = dtype
+        self.params = {} if params is None else dict(params)
+
+
+class DerivedEngine:
+    """
+    Evaluation of a set of derived columns. The dependency graph is
+    built once, so that each column is computed after those it
+    depends on, and input columns are released as soon as the last
+    column using them has been computed.
+
+    An input of a derived column refers to another derived column
+    if there is one with that name, other than the column itself,
+    and to an input column otherwise.
+
+    Parameters
+    ----------
+    columns : list of DerivedColumn
+        Derived columns to be evaluated
+
+    Examples
+    --------
+    >>> engine = DerivedEngine([DerivedColumn('Zgas_disc',
+    ...                         ['cold_metal', 'mcold'],
+    ...                         divide_positive, 'M_Z/M')])
+    >>> derived = engine.evaluate({'mcold': mcold, 'cold_metal': mz})
+    """
+    def __init__(self, columns):
+        self.columns = {col.name: col for col in columns}
+        self.order = self._sort()
+
+        # Position of the last derived column using each input column
+        self.last_use = {}
+        for ii, col in enumerate(self.order):
+            for name in self._get_raw_inputs(col):
+                self.last_use[name] = ii
+
+    def _is_derived(self, col, name):
+        """True if an input of a column is a derived column"""
+        return name in self.columns and name != col.name
+
+    def _get_raw_inputs(self, col):
+        """Input columns, not derived ones, used by a derived column"""
+        return [name for name in col.inputs if not self._is_derived(col, name)]
+
+    def _sort(self):
+        """Derived columns sorted so that dependencies come first"""
+        order = []
+        done = set()
+        pending = list(self.columns.values())
+        while pending:
+            ready = [col for col in pending
+                     if all(name in done for name in col.inputs
+                            if self._is_derived(col, name))]
+            if not ready:
+                names = [col.name for col in pending]
+                raise ValueError(f'Cyclic dependencies among {names}')
+            for col in ready:
+                order.append(col)
+                done.add(col.name)
+                pending.remove(col)
+        return order
+
+    @property
+    def inputs(self):
+        """Names of the input columns needed by the engine"""
+        return list(self.last_use)
+
+    def subset(self, names):
+        """
+        Engine evaluating only some derived columns and those
+        they depend on
+
+        Parameters
+        ----------
+        names : list of str
+            Names of the derived columns needed
+
+        Returns
+        -------
+        engine : DerivedEngine
+        """
+        needed = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name in needed:
+                continue
+            needed.add(name)
+            col = self.columns[name]
+            pending.extend(inp for inp in col.inputs
+                           if self._is_derived(col, inp))
+        return DerivedEngine([col for col in self.order if col.name in needed])
+
+    def evaluate(self, values, dtype=float, params=None, keep=()):
+        """
+        Compute the derived columns
+
+        Parameters
+        ----------
+        values : dict
+            Arrays of the input columns. Those not in keep are
+            removed from the dictionary once they are not needed.
+        dtype : str or numpy dtype
+            Default type of the derived columns
+        params : dict
+            Parameters for the kernels
+        keep : list of str
+            Input columns that should not be removed from values
+
+        Returns
+        -------
+        derived : dict
+            Array of each derived column
+        """
+        params = {} if params is None else params
+        derived = {}
+        for ii, col in enumerate(self.order):
+            inputs = [derived[name] if self._is_derived(col, name)
+                      else values[name] for name in col.inputs]
+            if col.dtype == 'input':
+                out = np.empty_like(inputs[0])
+            else:
+                out = np.empty(len(inputs[0]),
+                               dtype=dtype if col.dtype is None else col.dtype)
+            col.kernel(out, *inputs, **{arg: params[key]
+                                        for arg, key in col.params.items()})
+            derived[col.name] = out
+
+            # Release the inputs not needed any more
+            for name in self._get_raw_inputs(col):
+                if self.last_use[name] == ii and name not in keep:
+                    values.pop(name, None)
+        return derived
+
+
+def divide_positive(out, num, den, fill=0.):
+    """Kernel giving num/den where den > 0 and fill elsewhere"""
+    if ne is not None:
+        ne.evaluate('where(den > 0, num/den, fill)', out=out,
+                    casting='same_kind',
+                    local_dict={'num': num, 'den': den, 'fill': fill})
+        return
+    out.fill(fill)
+    np.divide(num, den, out=out, where=den > 0, casting='same_kind')
+
+
+def add_constant(out, vals, constant=0.):
+    """Kernel adding a constant to the values"""
+    if ne is not None:
+        ne.evaluate('vals + constant', out=out, casting='same_kind',
+                    local_dict={'vals': vals, 'constant': constant})
+        return
+    np.add(vals, constant, out=out, casting='same_kind')
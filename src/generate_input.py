@@ -2,15 +2,29 @@
 Program to generate input files for gnerate_nebular_emission
 """
 import os
+import sys
+import traceback
+from contextlib import ExitStack
+from itertools import repeat
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import h5py
 import numpy as np
 
 import src.utils as u
 import src.cosmology as cosmo
+from src.writer import GneWriter, get_index_dtype, get_int_dtype, cast_dtype
+from src.pipeline import run_pipeline
+from src.cache import ColumnCache, CachedGroup
+from src.derived import DerivedColumn, DerivedEngine
+from src.derived import divide_positive, add_constant
+from src.selection import get_selection, get_samples, apply_selection
+from src.index import read_index
+from src.manifest import get_manifest, read_manifest, same_inputs
+from src.manifest import get_checkpoint, is_up_to_date
 
-notnum  = -999.
-
-def generate_input_file(config, ivol, verbose=False):
+def generate_input_file(config, ivol, chunk_size=None, nworkers=1,
+                        pipeline=False, files=None, verbose=False):
     """
     Generate input file for generate_nebular_emission
     
@@ -20,6 +34,23 @@ def generate_input_file(config, ivol, verbose=False):
         Configuration dictionary containing paths and file properties
     ivol : integer
         Number of subvol
+    chunk_size : integer
+        If given, the subvolume is processed in blocks of this number
+        of rows, bounding the memory footprint.
+        Otherwise, each dataset is read in full.
+        When processing blocks serially, the progress is committed
+        to the file after each block, and an interrupted run is
+        resumed from the last committed block.
+    nworkers : integer
+        If larger than 1, blocks of rows are processed in parallel
+        by this number of processes, and written at their offsets
+        within pre-sized output datasets
+    pipeline : bool
+        If True, the input datasets are prefetched and the output
+        written in background threads, overlapping I/O and computing
+    files : dict
+        Input files already open (h5py.File), by file name,
+        e.g. shared by several snapshots
     verbose : bool
         Enable verbose output
         
@@ -39,218 +70,1199 @@ def generate_input_file(config, ivol, verbose=False):
             return False
 
     outfile = outpath+'gne_input.hdf5'
+
+    # Inputs and configuration the file is generated from
+    manifest = get_manifest(config, ivol)
+
+    # Resume a partially written file, if possible
+    resizable = chunk_size is not None and nworkers < 2
+    start, nsel = 0, 0
+    if resizable:
+        start, nsel = get_checkpoint(outfile, manifest)
+    writer = GneWriter(outfile, mode='a' if start > 0 else 'w',
+                       resizable=resizable, chunk_rows=chunk_size,
+                       storage=config.get('storage'),
+                       columns=get_column_options(config, 'storage'),
+                       precision=get_column_options(config, 'precision'),
+                       dtypes=get_column_dtypes(config))
     try:
-        hf = h5py.File(outfile, 'w')
+        writer.open()
     except:
         print(f' Not able to generate file: {outfile}')
         return False
-    headnom = 'header'
-    head = hf.create_dataset(headnom,())
-    head.attrs[u'h0'] = config['h0']
-    head.attrs[u'omega0'] = config['omega0']
-    head.attrs[u'omegab'] = config['omegab']
-    head.attrs[u'lambda0'] = config['lambda0']
-    head.attrs[u'bside_Mpch'] = config['boxside']
-    head.attrs[u'mp_Msunh'] = config['mp']
-    head.attrs[u'snapnum'] = config['snap']
-    data_group = hf.create_group('data')
+    if start > 0:
+        writer.truncate(nsel)
+        print(f' * Resuming file from row {start}: {outfile}')
+    writer.set_header('h0', config['h0'])
+    writer.set_header('omega0', config['omega0'])
+    writer.set_header('omegab', config['omegab'])
+    writer.set_header('lambda0', config['lambda0'])
+    writer.set_header('bside_Mpch', config['boxside'])
+    writer.set_header('mp_Msunh', config['mp'])
+    writer.set_header('snapnum', config['snap'])
     if 'fnl' in config:
-        head.attrs[u'fnl'] = config['fnl']
+        writer.set_header('fnl', config['fnl'])
     if 'ln_As' in config:
-        head.attrs[u'ln_As'] = config['ln_As']
-    hf.close()
+        writer.set_header('ln_As', config['ln_As'])
 
-    # Paths to files to be read
-    path = u.get_path(config['root'],ivol,ending=config['ending'])
-    except_file = config.get('except_file')
-    if except_file is not None:
-        except_path =  u.get_path(config['root'],ivol)
+    with writer:
+        checkpoint = (manifest, start, nsel) if resizable else None
+        _write_data(writer, config, ivol, chunk_size=chunk_size,
+                    nworkers=nworkers, pipeline=pipeline,
+                    checkpoint=checkpoint, files=files, verbose=verbose)
+        writer.set_manifest(manifest)
 
-    # Make the selection, if relevant
-    nomask = False; mask = None
-    selection = config['selection']
-    if selection is None:
-        nomask = True
-    else:
-        for ifile, props  in selection.items():
-            if except_file is not None and ifile == config['except_file']:
-                filename = except_path+ifile
-            else:
-                filename = path+ifile
-            group = props['group']
-            datasets = props['datasets']
-            lowl = props['low_limits']
-            highl = props['high_limits']
-            units = props['units']
-
-            with h5py.File(filename, 'r') as hdf_file:
-                hf = u.open_hdf5_group(hdf_file, group)
-
-                # Read datasets and generate conditions
-                for ii, dataset in enumerate(datasets):
-                    if ii == 0:
-                        alldata = hf[dataset][:].reshape(1, -1)
-                    else:
-                        alldata = np.vstack((alldata,hf[dataset][:]))
-
-            # Build combined mask
-            mask = u.combined_mask(alldata,lowl,highl,verbose=verbose)
-            if mask is None:
-                if verbose:
-                    print(f' * No adequate data in {ifile}, continuing')
+    print(f' * Generated file: {outfile}')
+    return True
+
+
+def generate_snapshots(configs, ivol, chunk_size=None, nworkers=1,
+                       pipeline=False, overwrite=False, verbose=False):
+    """
+    Generate the input files of several snapshots of a subvolume,
+    opening only once the input files shared by them, such as a
+    galaxies.hdf5 file with one group per snapshot
+
+    Parameters
+    ----------
+    configs : dict
+        Configuration dictionary for each snapshot
+    ivol : integer
+        Number of subvol
+    chunk_size : integer
+        Number of rows per block, see generate_input_file
+    nworkers : integer
+        Number of processes per snapshot, see generate_input_file.
+        Shared files are not kept open when larger than 1, so that
+        the processes do not inherit open files.
+    pipeline : bool
+        True to overlap reading, computing and writing
+    overwrite : bool
+        True to regenerate all files, otherwise snapshots whose
+        output manifest is up to date are skipped
+    verbose : bool
+        Enable verbose output
+
+    Returns
+    -------
+    bool
+        True if all the files have been successfully generated
+    """
+    # Input files used by more than one snapshot
+    nuses = {}
+    for config in configs.values():
+        allfiles = set(config['file_props'])
+        if config['selection'] is not None:
+            allfiles |= set(config['selection'])
+        for ifile in allfiles:
+            filename = u.get_filename(config, ivol, ifile)
+            nuses[filename] = nuses.get(filename, 0) + 1
+
+    success = True
+    with ExitStack() as stack:
+        files = {}
+        if nworkers < 2:
+            for filename, nuse in nuses.items():
+                if nuse > 1:
+                    files[filename] = stack.enter_context(
+                        h5py.File(filename, 'r'))
+
+        for snap, config in configs.items():
+            if not overwrite and is_up_to_date(config, ivol):
+                print(f' * Skipping up-to-date snapshot {snap}')
                 continue
+            try:
+                done = generate_input_file(config, ivol,
+                                           chunk_size=chunk_size,
+                                           nworkers=nworkers,
+                                           pipeline=pipeline,
+                                           files=files, verbose=verbose)
+            except Exception:
+                # To stdout, captured with the output of the subvolume
+                traceback.print_exc(file=sys.stdout)
+                done = False
+            if not done:
+                print(f'WARNING: snapshot {snap} of ivol{ivol} not generated')
+                success = False
+    return success
+
+
+def add_columns(config, ivol, chunk_size=None, verbose=False):
+    """
+    Add to an existing input file for generate_nebular_emission the
+    datasets in config['file_props'] that it does not contain yet.
+    The stored gal_index is used as the selection, so that only the
+    new input datasets are read, at the selected rows, and only the
+    quantities derived from them are computed.
+    Files generated with a different selection are not updated,
+    as the stored rows would not correspond to the current one.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    ivol : integer
+        Number of subvol
+    chunk_size : integer
+        If given, the rows are processed in blocks of this size
+    verbose : bool
+        Enable verbose output
+
+    Returns
+    -------
+    bool
+        True if the file has been successfully updated, False otherwise
+    """
+    outfile = config['outroot'] + str(ivol) + '/gne_input.hdf5'
+    stored = read_manifest(outfile)
+    manifest = get_manifest(config, ivol)
+    if stored is None or not same_inputs(stored, manifest):
+        print(f'WARNING: {outfile} missing or generated from other',
+              'input files, it needs to be generated again')
+        return False
+    if stored.get('selection_hash') != manifest['selection_hash']:
+        print(f'WARNING: {outfile} generated with another selection,',
+              'it needs to be generated again')
+        return False
+
+    writer = GneWriter(outfile, mode='a',
+                       storage=config.get('storage'),
+                       columns=get_column_options(config, 'storage'),
+                       precision=get_column_options(config, 'precision'),
+                       dtypes=get_column_dtypes(config))
+    with writer:
+        data = writer.hf['data']
+        newconfig = get_missing_config(config, list(data))
+        if newconfig is None:
+            if verbose:
+                print(f' * No datasets to be added to {outfile}')
+        else:
+            # No gal_index without a selection, or if no galaxy passed it
+            gal_index = None
+            if 'gal_index' in data:
+                gal_index = data['gal_index'][:].astype(np.int64)
+            elif config['selection'] is not None:
+                gal_index = np.zeros(0, dtype=np.int64)
+            _add_data(writer, newconfig, ivol, gal_index, chunk_size,
+                      verbose=verbose)
+        writer.set_manifest(manifest)
+
+    print(f' * Updated file: {outfile}')
+    return True
+
+
+def get_missing_config(config, existing):
+    """
+    Configuration restricted to the input datasets needed to produce
+    the output datasets that do not exist yet
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    existing : list of str
+        Datasets already in the output file
+
+    Returns
+    -------
+    newconfig : dict
+        Configuration without selection and with file_props
+        reduced to the needed datasets, None if nothing is missing
+    """
+    plan = get_plan(config)
+    allneeded = {}
+    for ifile, fplan in plan.items():
+        needed = set(prop for prop in fplan['written']
+                     if prop not in existing)
+
+        # Inputs of the missing derived datasets
+        if fplan['calc_Zdisc'] and 'Zgas_disc' not in existing:
+            needed |= set([config['mcold_disc'], config['mcold_z_disc']])
+        if fplan['calc_Zbst'] and 'Zgas_bst' not in existing:
+            needed |= set([config['mcold_burst'], config['mcold_z_burst']])
+        for nom, enom, rnom in zip(fplan['L_nom'], fplan['L_ext_nom'],
+                                   fplan['ratio_nom']):
+            if rnom not in existing:
+                needed |= set([nom, enom])
+
+        allneeded[ifile] = needed
+    if not any(allneeded.values()):
+        return None
+
+    # The redshift is needed to get apparent magnitudes
+    if any('mag' in prop for needed in allneeded.values() for prop in needed):
+        for ifile, fplan in plan.items():
+            if 'redshift' in fplan['datasets']:
+                allneeded[ifile].add('redshift')
+
+    file_props = {}
+    for ifile, needed in allneeded.items():
+        fplan = plan[ifile]
+        keep = [ii for ii, prop in enumerate(fplan['datasets'])
+                if prop in needed]
+        if len(keep) > 0:
+            props = dict(config['file_props'][ifile])
+            props['datasets'] = [fplan['datasets'][ii] for ii in keep]
+            props['units'] = [fplan['units'][ii] for ii in keep]
+            file_props[ifile] = props
+    newconfig = dict(config)
+    newconfig['selection'] = None
+    newconfig['file_props'] = file_props
+    return newconfig
+
+
+def _add_data(writer, config, ivol, gal_index, chunk_size=None,
+              verbose=False):
+    """
+    Read the given rows of the input datasets in config['file_props'],
+    derive the quantities that depend on them and write the datasets
+    not yet in the output file
+
+    Parameters
+    ----------
+    writer : GneWriter
+        Writer for the output file, open in append mode
+    config : dict
+        Configuration without selection, from get_missing_config
+    ivol : integer
+        Number of subvol
+    gal_index : numpy array of int
+        Sorted selected rows, None if all rows were kept
+    chunk_size : integer
+        Number of input rows per block, None to process all at once
+    verbose : bool
+        Enable verbose output
+    """
+    plan = get_plan(config, verbose=verbose)
+    existing = list(writer.hf['data'])
+    with ExitStack() as stack:
+        groups = open_inputs(stack, config, ivol, plan)
+        tomag = _set_header(writer, config, plan, groups)
+        nrows = _get_nrows(config, plan, groups)
+        narrow_dtypes(writer, config, plan, groups, chunk_size=chunk_size)
+        nsel = nrows if gal_index is None else len(gal_index)
+        if chunk_size is None or chunk_size < 1:
+            chunk_size = max(nrows, 1)
+
+        for start in range(0, nrows, chunk_size):
+            stop = min(start + chunk_size, nrows)
+            if gal_index is None:
+                rows = None; offset = start
             else:
-                # Generate galaxy indexes from the original dataset
-                with h5py.File(outfile, 'a') as outf:
-                    ids = outf['data'].create_dataset('gal_index', data=mask)
-                    ids.attrs['units'] = 'Index in original file'
-
-                # Write the properties in the output file
-                for ii in range(np.shape(alldata)[0]):
-                    vals = alldata[ii][mask]
-                    with h5py.File(outfile, 'a') as outf:
-                        dd = outf['data'].create_dataset(datasets[ii], data=vals)
-                        dd.attrs['units'] = units[ii]
+                offset, end = np.searchsorted(gal_index, [start, stop])
+                if end == offset:
+                    continue
+                rows = gal_index[offset:end]
+            for ifile, fplan in plan.items():
+                raw = read_file_block(fplan, groups[ifile], start, stop,
+                                      rows=rows)
+                block = compute_file_block(config, fplan, raw, tomag=tomag)
+                for name, (vals, units) in block.items():
+                    if name not in existing:
+                        writer.write_at(name, vals, units, offset, nsel)
+    if verbose:
+        print(f' * Datasets added for {nsel} galaxies')
+
+
+def get_column_options(config, key):
+    """
+    Options for particular datasets, given as lists aligned with
+    'datasets' under the given key of the selection and file_props
+    dictionaries (None for the default behaviour).
+    Derived datasets take the options of the dataset they come from:
+    the cold gas mass for metallicities and the intrinsic luminosity
+    for ratios.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    key : str
+        Key with the options, e.g. 'storage' or 'precision'
+
+    Returns
+    -------
+    columns : dict
+        Options for each dataset with its own ones
+    """
+    columns = {}
+    allprops = list(config['file_props'].values())
+    if config['selection'] is not None:
+        allprops += list(config['selection'].values())
+    for props in allprops:
+        options = props.get(key)
+        if options is None:
+            continue
+        for dataset, opts in zip(props['datasets'], options):
+            if opts is not None:
+                columns[dataset] = opts
+
+    # Derived datasets
+    for name, source in get_derived(config).items():
+        if source in columns and name not in columns:
+            columns[name] = columns[source]
+    return columns
+
+
+def get_derived(config):
+    """Derived datasets and the input dataset each one comes from"""
+    derived = {'Zgas_disc': config['mcold_disc'],
+               'Zgas_bst': config['mcold_burst']}
+    for line in config['lines']:
+        derived[f'ratio_{line}'] = f"{config['line_prefix']}{line}"
+    return derived
+
+
+def get_column_dtypes(config):
+    """
+    Types of the output datasets, following config['dtypes'], which
+    maps dataset names to types (e.g. {'type': 'int8'}) and can set
+    the float type of the derived datasets with the key 'derived'.
+    Integer datasets with the type 'narrowest' take the smallest type
+    fitting their values in each subvolume, see narrow_dtypes.
+    The galaxy indexes are stored with the smallest unsigned type
+    that fits the number of rows, set once this is known.
 
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+
+    Returns
+    -------
+    dtypes : dict
+        Type of each dataset with its own one
+    """
+    dtypes = dict(config.get('dtypes', {}))
+    derived = dtypes.pop('derived', None)
+    if derived is not None:
+        for name in get_derived(config):
+            dtypes.setdefault(name, derived)
+    return dtypes
+
+
+def narrow_dtypes(writer, config, plan, groups, chunk_size=None):
+    """
+    Set the types given as 'narrowest' in config['dtypes'] to the
+    smallest integer type fitting the values of the dataset in the
+    subvolume, read in blocks of rows. The input type is kept for
+    datasets that are not integers.
+
+    Parameters
+    ----------
+    writer : GneWriter
+        Writer for the output file, whose types are updated
+    config : dict
+        Configuration dictionary containing paths and file properties
+    plan : dict
+        Datasets to be read and calculations per file, from get_plan,
+        whose types are updated
+    groups : dict
+        Open hdf5 group for each input file
+    chunk_size : integer
+        Number of rows per block, None to read each dataset at once
+
+    Returns
+    -------
+    config : dict
+        Configuration with the resolved types, to be passed to workers
+    """
+    dtypes = dict(config.get('dtypes', {}))
+    names = [name for name, dtype in dtypes.items() if dtype == 'narrowest']
+    if not names:
+        return config
+    for name in names:
+        dtypes[name] = None
+        for ifile, fplan in plan.items():
+            if name not in fplan['datasets']:
+                continue
+            dset = groups[ifile][name]
+            if not np.issubdtype(dset.dtype, np.integer) or dset.size < 1:
+                break
+            step = dset.shape[0] if not chunk_size else chunk_size
+            vmin, vmax = 0, 0
+            for start in range(0, dset.shape[0], step):
+                vals = dset[start:start + step]
+                vmin = min(vmin, vals.min()); vmax = max(vmax, vals.max())
+            dtypes[name] = get_int_dtype(vmin, vmax)
+            break
+    config = dict(config, dtypes=dtypes)
+    column_dtypes = get_column_dtypes(config)
+    writer.dtypes.update(column_dtypes)
+    for fplan in plan.values():
+        fplan['dtypes'] = column_dtypes
+    return config
+
+
+def get_plan(config, verbose=False):
+    """
+    Find out the datasets to be read from each file and the
+    quantities to be derived from them
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    verbose : bool
+        Enable verbose output
+
+    Returns
+    -------
+    plan : dict
+        Dictionary with, for each file in config['file_props'],
+        the datasets to be read, their types and the extra
+        calculations to be done
+    """
     # Metallicity variables
     mcold_disc = config['mcold_disc']
     mcold_z_disc = config['mcold_z_disc']
     mcold_burst = config['mcold_burst']
     mcold_z_burst = config['mcold_z_burst']
 
-    # Loop over files with information
-    count_props = -1
-    file_props = config['file_props']
-    redshift = None; tomag = None
-    for ifile, props  in file_props.items():
-        if except_file is not None and ifile == config['except_file']:
-            filename = except_path+ifile
-        else:
-            filename = path+ifile
-        group = props['group']
+    # Types of the datasets to be kept in memory
+    dtypes = get_column_dtypes(config)
+
+    plan = {}
+    for ifile, props in config['file_props'].items():
         datasets = props['datasets']
+        fplan = {'group': props['group'],
+                 'datasets': datasets,
+                 'units': props['units'],
+                 'dtypes': dtypes}
 
         # Check if metallicities need to be calculated
-        calc_Zdisc = set([mcold_disc,mcold_z_disc]).issubset(datasets)
-        if calc_Zdisc:
-            Zdisc = np.ones(len(mask), dtype=float)
-
-        calc_Zbst  = set([mcold_burst,mcold_z_burst]).issubset(datasets)
-        if calc_Zbst:
-            Zbst = np.ones(len(mask), dtype=float)
+        fplan['calc_Zdisc'] = set([mcold_disc,mcold_z_disc]).issubset(datasets)
+        fplan['calc_Zbst'] = set([mcold_burst,mcold_z_burst]).issubset(datasets)
 
         # Check if magnitudes are included
-        calc_mag = any('mag' in s for s in datasets)
-        if calc_mag and tomag is None:
-            cosmo.set_cosmology(omega0=config['omega0'],
-                                omegab=config['omegab'],
-                                lambda0=config['lambda0'],
-                                h0=config['h0'],
-                                universe="Flat",include_radiation=False)
-            if redshift is None:
-                # Find file with redshift 
-                for check_file, check_props in file_props.items():
-                    if 'redshift' in check_props['datasets']:
-                        if except_file is not None and check_file == config['except_file']:
-                            zfilename = except_path + check_file
-                        else:
-                            zfilename = path + check_file
-                        with h5py.File(zfilename, 'r') as hdf_zfile:
-                            zhf = u.open_hdf5_group(hdf_zfile, group)
-                            # Read redshift
-                            redshift = zhf['redshift'][()]
-                            break
-                redshift = max(redshift, 0.1) # To avoid no correction
-                tomag = cosmo.band_corrected_distance_modulus(redshift)
-                DL = cosmo.luminosity_distance(redshift)
-                with h5py.File(outfile, 'a') as outf:
-                    outf['header'].attrs['luminosity_distance_Mpch'] = DL
+        fplan['calc_mag'] = any('mag' in s for s in datasets)
 
         # Check if luminosities are included
         L_nom = []; L_ext_nom = [] ; ratio_nom = []
-        calc_ratios = any(config['line_prefix'] in s for s in datasets)
-        if calc_ratios:
-            nl = 0;
-            for line in config['lines']:
-                nom = f"{config['line_prefix']}{line}"
-                enom = f"{config['line_prefix']}{line}{config['line_suffix_ext']}"
-                if (nom in datasets) and (enom in datasets):
-                    L_nom.append(nom); L_ext_nom.append(enom)
-                    ratio_nom.append(f"ratio_{line}")
-                    nl += 1
-            if (nl>0):
-                ratios = np.ones((nl,len(mask)), dtype=float)
+        for line in config['lines']:
+            nom = f"{config['line_prefix']}{line}"
+            enom = f"{config['line_prefix']}{line}{config['line_suffix_ext']}"
+            if (nom in datasets) and (enom in datasets):
+                L_nom.append(nom); L_ext_nom.append(enom)
+                ratio_nom.append(f"ratio_{line}")
+        fplan['calc_ratios'] = len(L_nom) > 0
+        fplan['L_nom'] = L_nom
+        fplan['L_ext_nom'] = L_ext_nom
+        fplan['ratio_nom'] = ratio_nom
+
+        # Datasets read only to derive other quantities
+        inputs_only = [mcold_z_disc, mcold_z_burst, 'redshift'] + L_ext_nom
+        fplan['written'] = [prop for prop in datasets
+                            if prop not in inputs_only]
+        fplan['engine'] = DerivedEngine(get_derived_columns(config, fplan))
+
+        if verbose:
+            print(f'  - Reading {ifile} (extra calcs:',
+                  f"{fplan['calc_Zdisc']}, {fplan['calc_Zbst']},",
+                  f"{fplan['calc_mag']}, {fplan['calc_ratios']})")
+            for prop in datasets:
+                if 'mag' in prop:
+                    print(f'- Converting {prop} into an apparent mag')
+        plan[ifile] = fplan
+    return plan
+
+
+def get_derived_columns(config, fplan):
+    """
+    Quantities derived from the datasets of one input file:
+    apparent magnitudes, gas metallicities and luminosity ratios
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    fplan : dict
+        Datasets to be read and calculations for the file
+
+    Returns
+    -------
+    columns : list of DerivedColumn
+    """
+    columns = []
+    datasets = fplan['datasets']
+    if fplan['calc_mag']:
+        for ii, prop in enumerate(datasets):
+            if 'mag' in prop:
+                columns.append(DerivedColumn(prop, [prop], add_constant,
+                                             fplan['units'][ii], dtype='input',
+                                             params={'constant': 'tomag'}))
+
+    # Metallicities
+    if fplan['calc_Zdisc']:
+        columns.append(DerivedColumn('Zgas_disc', [config['mcold_z_disc'],
+                                                   config['mcold_disc']],
+                                     divide_positive, 'M_Z/M'))
+    if fplan['calc_Zbst']:
+        columns.append(DerivedColumn('Zgas_bst', [config['mcold_z_burst'],
+                                                  config['mcold_burst']],
+                                     divide_positive, 'M_Z/M'))
+
+    # Luminosity ratios
+    for nom, enom, rnom in zip(fplan['L_nom'], fplan['L_ext_nom'],
+                               fplan['ratio_nom']):
+        columns.append(DerivedColumn(rnom, [enom, nom], divide_positive,
+                                     'L_ext/L (dimensionless)'))
+    return columns
+
+
+def open_inputs(stack, config, ivol, plan, files=None):
+    """
+    Open the input files of a subvolume, whose columns are read
+    through a cache shared by all of them, so that each column is
+    read from disk at most once for a given block of rows, within
+    the memory budget config['cache_budget'] (in bytes).
+    The sorted index of the selection datasets is loaded if it is
+    up to date with the input files (see src.index.build_index).
+
+    Parameters
+    ----------
+    stack : contextlib.ExitStack
+        Stack that closes the files on exit
+    config : dict
+        Configuration dictionary containing paths and file properties
+    ivol : integer
+        Number of subvol
+    plan : dict
+        Datasets to be read and calculations per file, from get_plan
+    files : dict
+        Input files already open (h5py.File), by file name,
+        which are not closed by the stack
+
+    Returns
+    -------
+    groups : dict
+        Open hdf5 group with the column cache (CachedGroup)
+        for each input file
+    """
+    selection = config['selection']
+    if selection is None:
+        selection = {}
+    cache = ColumnCache(config.get('cache_budget'))
+    groups = {}
+    for ifile in set(selection) | set(plan):
+        filename = u.get_filename(config, ivol, ifile)
+        if files is not None and filename in files:
+            hdf_file = files[filename]
+        else:
+            hdf_file = stack.enter_context(h5py.File(filename, 'r'))
+        if ifile in plan:
+            group = plan[ifile]['group']
+        else:
+            group = selection[ifile]['group']
+        groups[ifile] = CachedGroup(u.open_hdf5_group(hdf_file, group),
+                                    ifile, cache,
+                                    index=read_index(config, ivol, ifile))
+    return groups
+
+
+def _write_data(writer, config, ivol, chunk_size=None, nworkers=1,
+                pipeline=False, checkpoint=None, files=None, verbose=False):
+    """
+    Read, select and derive the properties of the galaxies in a
+    subvolume and write them through an open writer
+
+    Parameters
+    ----------
+    writer : GneWriter
+        Open writer for the output file
+    config : dict
+        Configuration dictionary containing paths and file properties
+    ivol : integer
+        Number of subvol
+    chunk_size : integer
+        Number of rows per block, None to process all rows at once
+    nworkers : integer
+        Number of processes working on different blocks of rows
+    pipeline : bool
+        If True, reading and writing happen in background threads
+    checkpoint : tuple
+        Manifest of the file, first input row to be processed and
+        number of rows already written, to commit the progress after
+        each block of rows; None to write the file without checkpoints
+    files : dict
+        Input files already open (h5py.File), by file name
+    verbose : bool
+        Enable verbose output
+    """
+    plan = get_plan(config, verbose=verbose)
+
+    with ExitStack() as stack:
+        # Open the input files once for the whole subvolume
+        groups = open_inputs(stack, config, ivol, plan, files=files)
+
+        # Header values and magnitude correction
+        tomag = _set_header(writer, config, plan, groups)
+        nrows = _get_nrows(config, plan, groups)
+        writer.dtypes['gal_index'] = get_index_dtype(nrows)
+        config = narrow_dtypes(writer, config, plan, groups,
+                               chunk_size=chunk_size)
+
+        # Process the galaxies in blocks of rows
+        if nworkers < 2:
+            if chunk_size is None or chunk_size < 1:
+                chunk_size = max(nrows, 1)
+            if pipeline:
+                nsel = _write_pipeline(writer, config, plan, groups, nrows,
+                                       chunk_size, tomag=tomag,
+                                       checkpoint=checkpoint,
+                                       verbose=verbose)
             else:
-                calc_ratios = False
-        
-        if verbose: print(f'  - Reading {filename} (extra calcs:',
-                          f'{calc_Zdisc}, {calc_Zbst}, {calc_mag}, {calc_ratios})')
-        
-        # Read data in each file    
-        with h5py.File(filename, 'r') as hdf_file:
-            hf = u.open_hdf5_group(hdf_file, group)
-                
-            # Extract properties
-            for ii,prop in enumerate(datasets):
-                if prop=='redshift':
-                    zz = hf[prop]
-                    with h5py.File(outfile, 'a') as outf:
-                        outf['header'].attrs['redshift'] = zz
-                else:
-                    count_props += 1
-                    vals = None
-                    vals = hf[prop][:]
-                    if not nomask:
-                        vals = vals[mask]
-                    if vals is None: continue
-
-                    if calc_Zdisc and (prop==mcold_disc or prop==mcold_z_disc):
-                        if prop==mcold_disc:
-                            Zdisc[vals<=0.] = 0.
-                            Zdisc[vals>0.] /= vals[vals>0.]
-                        else:
-                            Zdisc *= vals
-                    elif calc_Zbst and (prop==mcold_burst or prop==mcold_z_burst):
-                        if prop==mcold_burst:
-                            Zbst[vals<=0.] = 0.
-                            Zbst[vals>0.] /= vals[vals>0.]
-                        else:
-                            Zbst *= vals
-                    
-                    if(prop!=mcold_z_disc and prop!=mcold_z_burst and prop not in L_ext_nom):
-                        with h5py.File(outfile, 'a') as outf:
-                            if 'mag' in prop:
-                                vals += tomag
-                                if verbose:
-                                    print(f'- Converting {prop} into an apparent mag')
-                            dd = outf['data'].create_dataset(prop, data=vals)
-                            dd.attrs['units'] = props['units'][ii]
-                    
-                    if calc_ratios and (prop in L_nom or prop in L_ext_nom):
-                        if prop in L_nom:
-                            il = L_nom.index(prop)
-                            ratios[il, vals <= 0.] = notnum
-                            ratios[il,vals>0.] /= vals[vals>0.]
-                        else:
-                            il = L_ext_nom.index(prop)
-                            ratios[il,:] *= vals
-
-        # Write out metallicities, if required
-        if calc_Zdisc:
-            with h5py.File(outfile, 'a') as outf:
-                dd = outf['data'].create_dataset('Zgas_disc', data=Zdisc)
-                dd.attrs['units'] = 'M_Z/M'
-        if calc_Zbst:
-            with h5py.File(outfile, 'a') as outf:
-                dd = outf['data'].create_dataset('Zgas_bst', data=Zbst)
-                dd.attrs['units'] = 'M_Z/M'
-        
-        # Write luminosity ratios, if required
-        if calc_ratios:
-            with h5py.File(outfile, 'a') as outf:
-                for il, nom in enumerate(ratio_nom):
-                    dd = outf['data'].create_dataset(nom, data=ratios[il,:])
-                    dd.attrs['units'] = 'L_ext/L (dimensionless)'
-                    
-    print(f' * Generated file: {outfile}')
-    return True
+                nsel = _write_blocks(writer, config, plan, groups, nrows,
+                                     chunk_size, tomag=tomag,
+                                     checkpoint=checkpoint,
+                                     verbose=verbose)
+
+    # Process blocks of rows in parallel, once the inputs are closed
+    if nworkers > 1:
+        if chunk_size is None or chunk_size < 1:
+            chunk_size = max(-(-nrows//nworkers), 1)
+        nsel = _write_ranges(writer, config, ivol, nrows, chunk_size,
+                             nworkers, tomag=tomag)
+
+    if verbose:
+        print(f' * {nsel} out of {nrows} galaxies selected')
+    return
+
+
+def _write_blocks(writer, config, plan, groups, nrows, chunk_size,
+                  tomag=None, checkpoint=None, verbose=False):
+    """
+    Process and write the blocks of rows one after another,
+    committing the progress after each one if checkpoint is given
+
+    Returns
+    -------
+    nsel : integer
+        Number of selected galaxies
+    """
+    manifest, first, nsel = (None, 0, 0) if checkpoint is None else checkpoint
+    for start in range(first, nrows, chunk_size):
+        stop = min(start + chunk_size, nrows)
+        block = process_block(config, plan, groups, start, stop,
+                              tomag=tomag, verbose=verbose)
+        if block is not None:
+            for name, (vals, units) in block.items():
+                writer.append(name, vals, units)
+            nsel += len(next(iter(block.values()))[0])
+        if manifest is not None:
+            writer.set_progress(manifest, stop, nsel)
+    return nsel
+
+
+def _write_pipeline(writer, config, plan, groups, nrows, chunk_size,
+                    tomag=None, checkpoint=None, verbose=False):
+    """
+    Process and write the blocks of rows in a pipeline: the datasets
+    of the next input file are read while the current ones are being
+    processed, and the results are written in the background.
+    If checkpoint is given, the writer commits the progress once all
+    the datasets of a block of rows have been written.
+
+    Returns
+    -------
+    nsel : integer
+        Number of selected galaxies
+    """
+    manifest, first, nsel = (None, 0, 0) if checkpoint is None else checkpoint
+    counts = [nsel]
+
+    def produce():
+        for start in range(first, nrows, chunk_size):
+            stop = min(start + chunk_size, nrows)
+            rows, block = read_selection(config, groups, start, stop,
+                                         plan=plan, tomag=tomag,
+                                         verbose=verbose)
+            if block is not None:
+                counts.append(stop - start if rows is None else len(rows))
+                yield None, block
+                for ifile, fplan in plan.items():
+                    raw = read_file_block(fplan, groups[ifile], start, stop,
+                                          rows=rows)
+                    yield fplan, raw
+            if manifest is not None:
+                yield 'commit', (stop, sum(counts))
+
+    def process(item):
+        fplan, raw = item
+        if fplan is None or fplan == 'commit':
+            return item
+        return fplan, compute_file_block(config, fplan, raw, tomag=tomag)
+
+    def consume(item):
+        tag, block = item
+        if tag == 'commit':
+            writer.set_progress(manifest, *block)
+            return
+        for name, (vals, units) in block.items():
+            writer.append(name, vals, units)
+
+    run_pipeline(produce, process, consume)
+    return sum(counts)
+
+
+def _select_range(config, ivol, start, stop, tomag):
+    """Rows within [start, stop) passing the selection"""
+    plan = get_plan(config)
+    with ExitStack() as stack:
+        groups = open_inputs(stack, config, ivol, plan)
+        rows, seldata, masks = select_block(config, groups, start, stop,
+                                            plan=plan, tomag=tomag)
+    return rows
+
+
+def _process_range(config, ivol, start, stop, rows, tomag):
+    """Output datasets for the given rows within [start, stop)"""
+    plan = get_plan(config)
+    with ExitStack() as stack:
+        groups = open_inputs(stack, config, ivol, plan)
+        block = process_block(config, plan, groups, start, stop,
+                              tomag=tomag, rows=rows)
+    return block
+
+
+def _write_ranges(writer, config, ivol, nrows, chunk_size, nworkers,
+                  tomag=None):
+    """
+    Process ranges of rows of a subvolume in a pool of processes
+    and write the results at their offsets in the output datasets
+
+    Returns
+    -------
+    nsel : integer
+        Number of selected galaxies
+    """
+    starts = list(range(0, nrows, chunk_size))
+    stops = [min(start + chunk_size, nrows) for start in starts]
+
+    with ProcessPoolExecutor(max_workers=nworkers) as pool:
+        # Select the galaxies in each range, to know the offsets
+        if config['selection'] is None:
+            allrows = [None]*len(starts)
+            counts = [stop - start for start, stop in zip(starts, stops)]
+        else:
+            allrows = list(pool.map(_select_range, repeat(config),
+                                    repeat(ivol), starts, stops,
+                                    repeat(tomag)))
+            counts = [0 if rows is None else len(rows) for rows in allrows]
+        offsets = np.cumsum([0] + counts)
+        nsel = int(offsets[-1])
+
+        # Derive the properties of each range and write them
+        futures = {}
+        for ir, (start, stop) in enumerate(zip(starts, stops)):
+            if counts[ir] > 0:
+                future = pool.submit(_process_range, config, ivol, start,
+                                     stop, allrows[ir], tomag)
+                futures[future] = ir
+        for future in as_completed(futures):
+            ir = futures[future]
+            block = future.result()
+            for name, (vals, units) in block.items():
+                writer.write_at(name, vals, units, offsets[ir], nsel)
+    return nsel
+
+
+def _set_header(writer, config, plan, groups):
+    """
+    Store the redshift and luminosity distance in the header and
+    get the correction from absolute to apparent magnitudes
+
+    Returns
+    -------
+    tomag : float
+        Band corrected distance modulus, None if no magnitudes are read
+    """
+    redshift = None
+    for ifile, fplan in plan.items():
+        if 'redshift' in fplan['datasets']:
+            redshift = groups[ifile]['redshift'][()]
+            writer.set_header('redshift', redshift)
+            break
+
+    tomag = None
+    if any(fplan['calc_mag'] for fplan in plan.values()):
+        cosmology = cosmo.Cosmology(omega0=config['omega0'],
+                                    omegab=config['omegab'],
+                                    lambda0=config['lambda0'],
+                                    h0=config['h0'],
+                                    universe="Flat",include_radiation=False)
+        redshift = max(redshift, 0.1) # To avoid no correction
+        tomag = cosmology.band_corrected_distance_modulus(redshift)
+        DL = cosmology.luminosity_distance(redshift)
+        writer.set_header('luminosity_distance_Mpch', DL)
+    return tomag
+
+
+def _get_nrows(config, plan, groups):
+    """Number of galaxies in the subvolume"""
+    selection = config['selection']
+    if selection is not None:
+        for ifile, props in selection.items():
+            for dataset in props['datasets']:
+                return groups[ifile][dataset].shape[0]
+    for ifile, fplan in plan.items():
+        for dataset in fplan['datasets']:
+            if groups[ifile][dataset].ndim > 0:
+                return groups[ifile][dataset].shape[0]
+    return 0
+
+
+def select_block(config, groups, start, stop, plan=None, tomag=None,
+                 verbose=False):
+    """
+    Select the galaxies within a block of rows. The selection can
+    use the derived quantities of the plan, which are computed only
+    for the rows passing the previous conditions.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    groups : dict
+        Open hdf5 group for each input file
+    start : integer
+        First row of the block
+    stop : integer
+        Row after the last one of the block
+    plan : dict
+        Datasets to be read and calculations per file, from get_plan,
+        needed for selections using derived quantities
+    tomag : float
+        Correction from absolute to apparent magnitudes
+    verbose : bool
+        Enable verbose output
+
+    Returns
+    -------
+    rows : numpy array of int
+        Rows passing the selection, None if there are none
+    seldata : dict
+        Rows and values of the selection datasets read from each file
+    masks : dict
+        Array of bool for each named sample, at the returned rows
+        (see get_sample_masks)
+    """
+    rows = None; seldata = {}
+    for ifile, props in config['selection'].items():
+        # Apply the conditions one at a time
+        selection = get_selection(props, config)
+        derived = get_selection_derived(config, plan, groups,
+                                        selection.datasets, tomag=tomag)
+        frows, fvals = apply_selection(groups[ifile], selection,
+                                       props['datasets'], start=start,
+                                       stop=stop, rows=rows,
+                                       derived=derived,
+                                       index=groups[ifile].index)
+        if frows is None:
+            return None, None, None
+        rows = frows
+        seldata[ifile] = (frows, fvals)
+
+    # Keep the galaxies in any of the named samples
+    masks = get_sample_masks(config, groups, start, stop, rows,
+                             plan=plan, tomag=tomag)
+    if masks:
+        keep = np.logical_or.reduce(list(masks.values()))
+        if not keep.any():
+            return None, None, None
+        rows = rows[keep]
+        masks = {name: mask[keep] for name, mask in masks.items()}
+    return rows, seldata, masks
+
+
+def get_sample_masks(config, groups, start, stop, rows, plan=None,
+                     tomag=None):
+    """
+    Evaluate the named samples of the selection at the given rows,
+    reading each dataset, or computing each derived quantity, used
+    by them only once for all the samples
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    groups : dict
+        Open hdf5 group for each input file
+    start : integer
+        First row of the block
+    stop : integer
+        Row after the last one of the block
+    rows : numpy array of int
+        Rows at which the samples are evaluated
+    plan : dict
+        Datasets to be read and calculations per file, from get_plan
+    tomag : float
+        Correction from absolute to apparent magnitudes
+
+    Returns
+    -------
+    masks : dict
+        Array of bool for each sample, True for the rows in it
+    """
+    samples = get_samples(config)
+    masks = {name: np.ones(len(rows), dtype=bool) for name in samples}
+    def read(group, name):
+        return u.read_column(group, name, rows, start, stop)
+
+    for ifile in config['selection']:
+        fsamples = {name: fsel[ifile] for name, fsel in samples.items()
+                    if ifile in fsel}
+        if not fsamples:
+            continue
+        names = []
+        for selection in fsamples.values():
+            names += [name for name in selection.datasets if name not in names]
+        derived = get_selection_derived(config, plan, groups, names,
+                                        tomag=tomag)
+        for selection in fsamples.values():
+            selection.check([name for name in selection.names
+                             if name in derived or name in groups[ifile]])
+
+        values = {}
+        for name in names:
+            if name in derived:
+                values[name] = derived[name](read)
+            else:
+                values[name] = read(groups[ifile], name)
+        for name, selection in fsamples.items():
+            masks[name] &= selection.evaluate(values, len(rows))
+    return masks
+
+
+def get_selection_derived(config, plan, groups, names, tomag=None):
+    """
+    Functions computing the derived quantities used by a selection,
+    each one only from the datasets it needs
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    plan : dict
+        Datasets to be read and calculations per file, from get_plan
+    groups : dict
+        Open hdf5 group for each input file
+    names : list of str
+        Names used by the selection
+    tomag : float
+        Correction from absolute to apparent magnitudes
+
+    Returns
+    -------
+    derived : dict
+        Function of each derived quantity, see selection.apply_selection
+    """
+    derived = {}
+    if plan is None:
+        return derived
+    dtype = config.get('dtypes', {}).get('derived', float)
+    for ifile, fplan in plan.items():
+        engine = fplan['engine']
+        for name in names:
+            if name in engine.columns and name not in derived:
+                derived[name] = partial(_compute_derived, fplan,
+                                        engine.subset([name]), groups[ifile],
+                                        name, dtype, tomag)
+    return derived
+
+
+def _compute_derived(fplan, engine, hf, name, dtype, tomag, read):
+    """Derived quantity, from the datasets given by read(hf, dataset)"""
+    raw = {prop: cast_dtype(read(hf, prop), fplan['dtypes'].get(prop))
+           for prop in engine.inputs}
+    return engine.evaluate(raw, dtype=dtype, params={'tomag': tomag})[name]
+
+
+def read_selection(config, groups, start, stop, rows=None, plan=None,
+                   tomag=None, verbose=False):
+    """
+    Select the galaxies within a block of rows and read the
+    datasets used for the selection
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    groups : dict
+        Open hdf5 group for each input file
+    start : integer
+        First row of the block
+    stop : integer
+        Row after the last one of the block
+    rows : numpy array of int
+        Rows already known to pass the selection, if given,
+        the selection is not evaluated again
+    plan : dict
+        Datasets to be read and calculations per file, from get_plan
+    tomag : float
+        Correction from absolute to apparent magnitudes
+    verbose : bool
+        Enable verbose output
+
+    Returns
+    -------
+    rows : numpy array of int
+        Selected rows, None if there is no selection
+    block : dict
+        Values and units of gal_index, the selection datasets and
+        the mask of each named sample (sample_<name>), None if no
+        galaxy within the block passes the selection
+    """
+    block = {}
+    selection = config['selection']
+    if selection is None:
+        return None, block
+
+    if rows is None:
+        rows, seldata, masks = select_block(config, groups, start, stop,
+                                            plan=plan, tomag=tomag,
+                                            verbose=verbose)
+        if rows is None:
+            return None, None
+    else:
+        seldata = {}
+        for ifile, props in selection.items():
+            seldata[ifile] = (rows, [u.read_column(groups[ifile], dataset,
+                                                   rows, start, stop)
+                                     for dataset in props['datasets']])
+        masks = get_sample_masks(config, groups, start, stop, rows,
+                                 plan=plan, tomag=tomag)
+
+    # Galaxy indexes in the original dataset
+    block['gal_index'] = (rows, 'Index in original file')
+
+    # Store the properties used for the selection
+    for ifile, props in selection.items():
+        frows, fvals = seldata[ifile]
+        keep = None
+        if len(frows) != len(rows):
+            keep = np.isin(frows, rows, assume_unique=True)
+        for ii, dataset in enumerate(props['datasets']):
+            vals = fvals[ii] if keep is None else fvals[ii][keep]
+            block[dataset] = (vals, props['units'][ii])
+
+    # Galaxies within each named sample
+    for name, mask in masks.items():
+        block[f'sample_{name}'] = (mask, f'True if in sample {name}')
+    return rows, block
+
+
+def read_file_block(fplan, hf, start, stop, rows=None):
+    """
+    Read the datasets of one input file for a block of rows
+
+    Parameters
+    ----------
+    fplan : dict
+        Datasets to be read and calculations for the file
+    hf : h5py.Group or CachedGroup
+        Open hdf5 group of the file
+    start : integer
+        First row of the block
+    stop : integer
+        Row after the last one of the block
+    rows : numpy array of int
+        Selected rows, None to read all the rows in the block
+
+    Returns
+    -------
+    raw : dict
+        Values of each dataset, except the redshift
+    """
+    raw = {}
+    for prop in fplan['datasets']:
+        if prop=='redshift':
+            continue
+        vals = u.read_column(hf, prop, rows, start, stop)
+        raw[prop] = cast_dtype(vals, fplan['dtypes'].get(prop))
+    return raw
+
+
+def compute_file_block(config, fplan, raw, tomag=None):
+    """
+    Derive metallicities, apparent magnitudes and luminosity ratios
+    from the datasets read from one input file
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    fplan : dict
+        Datasets to be read and calculations for the file
+    raw : dict
+        Values of each dataset, from read_file_block. The datasets
+        that are not written are removed once they have been used.
+    tomag : float
+        Correction from absolute to apparent magnitudes
+
+    Returns
+    -------
+    block : dict
+        Values and units of each output dataset
+    """
+    dtype = config.get('dtypes', {}).get('derived', float)
+    derived = fplan['engine'].evaluate(raw, dtype=dtype,
+                                       params={'tomag': tomag},
+                                       keep=fplan['written'])
+
+    # Datasets read, with the magnitudes converted to apparent ones
+    block = {}
+    for ii, prop in enumerate(fplan['datasets']):
+        if prop in derived:
+            block[prop] = (derived[prop], fplan['units'][ii])
+        elif prop in raw and prop in fplan['written']:
+            block[prop] = (raw[prop], fplan['units'][ii])
+
+    # Metallicities and luminosity ratios
+    for name, vals in derived.items():
+        if name not in block:
+            block[name] = (vals, fplan['engine'].columns[name].units)
+    return block
+
+
+def process_block(config, plan, groups, start, stop, tomag=None,
+                  rows=None, verbose=False):
+    """
+    Select the galaxies within a block of rows and derive their
+    properties
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    plan : dict
+        Datasets to be read and calculations per file, from get_plan
+    groups : dict
+        Open hdf5 group for each input file
+    start : integer
+        First row of the block
+    stop : integer
+        Row after the last one of the block
+    tomag : float
+        Correction from absolute to apparent magnitudes
+    rows : numpy array of int
+        Rows already known to pass the selection, if given,
+        the selection is not evaluated again
+    verbose : bool
+        Enable verbose output
+
+    Returns
+    -------
+    block : dict
+        Values and units of each output dataset, None if no galaxy
+        within the block passes the selection
+    """
+    rows, block = read_selection(config, groups, start, stop, rows=rows,
+                                 plan=plan, tomag=tomag, verbose=verbose)
+    if block is None:
+        return None
+
+    for ifile, fplan in plan.items():
+        raw = read_file_block(fplan, groups[ifile], start, stop, rows=rows)
+        block.update(compute_file_block(config, fplan, raw, tomag=tomag))
+    return block
@@ -0,0 +1,248 @@
+"""
+Sorted secondary index of selection columns, kept in a sidecar
+file per subvolume, so that range selections on them are resolved
+with two binary searches instead of a scan of the whole column
+"""
+import os
+import json
+import h5py
+import numpy as np
+
+import src.utils as u
+from src.writer import get_index_dtype
+
+def get_index_file(config, ivol):
+    """Sidecar file with the sorted index of a subvolume"""
+    return config['outroot'] + str(ivol) + '/gne_index.hdf5'
+
+
+def _get_stamp(filename):
+    """Size and modification time of a file, as a string"""
+    stat = os.stat(filename)
+    return json.dumps([stat.st_size, stat.st_mtime_ns])
+
+
+def _searchsorted(values, value, side):
+    """
+    np.searchsorted on a sorted array or on a sorted dataset of a file,
+    reading only the values needed by the binary search. NaN values
+    are sorted last, as comparisons with them are False.
+    """
+    if isinstance(values, np.ndarray):
+        return np.searchsorted(values, value, side=side)
+    low, high = 0, len(values)
+    while low < high:
+        mid = (low + high)//2
+        val = values[mid]
+        if val < value or (side == 'right' and val == value):
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+
+class SortedIndex:
+    """
+    Sorted values of a column with the permutation sorting it.
+
+    The rows passing a range are found once and kept, sorted, so
+    that each block of rows is cut out of them with binary searches.
+    The index of a file is read only at the values needed by the
+    binary searches and at the rows passing the ranges.
+
+    Parameters
+    ----------
+    values : numpy array or str
+        Values of the column, sorted, with NaN at the end,
+        or name of the dataset with them in filename
+    order : numpy array of int or str
+        Rows of the column in sorted order, np.argsort(column),
+        or name of the dataset with them in filename
+    filename : str
+        File with the datasets, None if values and order are arrays
+
+    Examples
+    --------
+    >>> index = SortedIndex.from_column(mhhalo)
+    >>> rows = index.range_rows(low=20*mp)
+    """
+    def __init__(self, values, order, filename=None):
+        self.values = values
+        self.order = order
+        self.filename = filename
+        self.rows = {}
+
+    @classmethod
+    def from_column(cls, column):
+        """Index of the values of a column"""
+        order = np.argsort(column, kind='stable')
+        order = order.astype(get_index_dtype(len(column)))
+        return cls(column[order], order)
+
+    def _passing_rows(self, values, order, low, high, include_low,
+                      include_high):
+        """Sorted rows with values within the limits"""
+        # Python numbers are compared with the type of the values,
+        # as numpy does when comparing an array with a number
+        floating = np.issubdtype(values.dtype, np.floating)
+        if floating and isinstance(low, (int, float)):
+            low = values.dtype.type(low)
+        if floating and isinstance(high, (int, float)):
+            high = values.dtype.type(high)
+
+        first = 0
+        if low is not None:
+            first = _searchsorted(values, low,
+                                  'left' if include_low else 'right')
+        if high is None:
+            # NaN values are sorted last and never pass the limits
+            high, include_high = np.inf, True
+        last = _searchsorted(values, high,
+                             'right' if include_high else 'left')
+        rows = order[first:max(first, last)]
+        if len(rows) > len(values)//16:
+            # Faster than sorting many rows
+            mask = np.zeros(len(values), dtype=bool)
+            mask[rows] = True
+            return np.flatnonzero(mask).astype(rows.dtype)
+        return np.sort(rows)
+
+    def range_rows(self, low=None, high=None, include_low=True,
+                   include_high=True, start=0, stop=None):
+        """
+        Rows with values within the given limits
+
+        Parameters
+        ----------
+        low : float
+            Lower limit, None for no limit
+        high : float
+            Upper limit, None for no limit
+        include_low : bool
+            True if values equal to the lower limit are included
+        include_high : bool
+            True if values equal to the upper limit are included
+        start : int
+            First row to be considered
+        stop : int
+            Row after the last one to be considered, None for all
+
+        Returns
+        -------
+        rows : numpy array of int
+            Sorted rows passing the limits
+        """
+        key = (low, high, include_low, include_high)
+        if key not in self.rows:
+            if self.filename is None:
+                rows = self._passing_rows(self.values, self.order, *key)
+            else:
+                with h5py.File(self.filename, 'r') as hf:
+                    rows = self._passing_rows(hf[self.values],
+                                              hf[self.order], *key)
+            self.rows[key] = rows
+        rows = self.rows[key]
+        if start > 0 or stop is not None:
+            # Limits with the type of the rows, as np.searchsorted
+            # would convert all the rows to compare them with an int
+            top = np.iinfo(rows.dtype).max
+            lo = len(rows) if start > top else np.searchsorted(
+                rows, rows.dtype.type(max(start, 0)))
+            hi = len(rows) if stop is None or stop > top else np.searchsorted(
+                rows, rows.dtype.type(max(stop, 0)))
+            rows = rows[lo:hi]
+        return rows
+
+
+def build_index(config, ivol, columns=None, verbose=False):
+    """
+    Write the sorted index of selection columns of a subvolume,
+    recording the input files it has been built from
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    ivol : integer
+        Number of subvol
+    columns : dict
+        Datasets to be indexed in each input file of the selection,
+        as {ifile: [dataset]}, by default config['index'] or, if
+        not given, the datasets of the selection of each file
+    verbose : bool
+        Enable verbose output
+
+    Returns
+    -------
+    bool
+        True if the index has been successfully written
+    """
+    if columns is None:
+        columns = config.get('index')
+    if columns is None:
+        if config['selection'] is None:
+            return False
+        columns = {ifile: props['datasets']
+                   for ifile, props in config['selection'].items()}
+
+    outfile = get_index_file(config, ivol)
+    os.makedirs(os.path.dirname(outfile), exist_ok=True)
+    with h5py.File(outfile, 'a') as hf:
+        for ifile, datasets in columns.items():
+            props = config['selection'][ifile]
+            filename = u.get_filename(config, ivol, ifile)
+            with h5py.File(filename, 'r') as infile:
+                group = u.open_hdf5_group(infile, props['group'])
+                for dataset in datasets:
+                    index = SortedIndex.from_column(group[dataset][:])
+                    name = f'{ifile}/{dataset}'
+                    if name in hf:
+                        del hf[name]
+                    igrp = hf.create_group(name)
+                    igrp.create_dataset('values', data=index.values)
+                    igrp.create_dataset('order', data=index.order)
+                    igrp.attrs['group'] = props['group']
+                    igrp.attrs['input'] = _get_stamp(filename)
+                    if verbose:
+                        print(f' * Indexed {dataset} of {filename}')
+    return True
+
+
+def read_index(config, ivol, ifile):
+    """
+    Sorted indexes of the datasets of an input file, only those
+    built from the current version of the file
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    ivol : integer
+        Number of subvol
+    ifile : str
+        Name of the input file
+
+    Returns
+    -------
+    index : dict
+        SortedIndex of each dataset, empty if there is no fresh index,
+        which reads the sidecar file only when a range is resolved
+    """
+    index = {}
+    outfile = get_index_file(config, ivol)
+    if not os.path.exists(outfile):
+        return index
+    filename = u.get_filename(config, ivol, ifile)
+    if config['selection'] is None or ifile not in config['selection']:
+        return index
+    group = config['selection'][ifile]['group']
+    stamp = _get_stamp(filename)
+    with h5py.File(outfile, 'r') as hf:
+        if ifile not in hf:
+            return index
+        for dataset, igrp in hf[ifile].items():
+            if igrp.attrs['group'] != group or igrp.attrs['input'] != stamp:
+                continue
+            index[dataset] = SortedIndex(igrp['values'].name,
+                                         igrp['order'].name, outfile)
+    return index
@@ -0,0 +1,208 @@
+"""
+Manifests of the generated files, used to skip subvolumes
+whose inputs and configuration have not changed
+"""
+import os
+import json
+import hashlib
+import h5py
+
+import src.utils as u
+from src.selection import get_selection, get_samples, get_constants
+
+# Configuration entries determining the content of the output files
+config_keys = ['selection', 'file_props', 'lines', 'line_prefix',
+               'line_suffix_ext', 'mcold_disc', 'mcold_z_disc',
+               'mcold_burst', 'mcold_z_burst',
+               'h0', 'omega0', 'omegab', 'lambda0', 'fnl', 'ln_As',
+               'boxside', 'mp', 'snap', 'storage', 'dtypes']
+
+# Configuration entries determining the selected galaxies,
+# together with the constants used in the selection expressions
+selection_keys = ['selection', 'boxside', 'mp', 'snap',
+                  'h0', 'omega0', 'omegab', 'lambda0']
+
+def get_config_hash(config):
+    """
+    Hash of the configuration entries determining the output
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+
+    Returns
+    -------
+    hash : str
+        Hexadecimal SHA-256 digest
+    """
+    relevant = {key: config.get(key) for key in config_keys}
+    text = json.dumps(relevant, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def get_selection_hash(config):
+    """
+    Hash of the configuration entries determining the selection
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+
+    Returns
+    -------
+    hash : str
+        Hexadecimal SHA-256 digest
+    """
+    relevant = {key: config.get(key) for key in selection_keys}
+    if config.get('selection') is not None:
+        names = set()
+        for props in config['selection'].values():
+            names.update(get_selection(props, config).names)
+        for sample in get_samples(config).values():
+            for selection in sample.values():
+                names.update(selection.names)
+        constants = get_constants(config)
+        relevant['constants'] = {name: constants[name]
+                                 for name in names if name in constants}
+    text = json.dumps(relevant, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def get_manifest(config, ivol):
+    """
+    Manifest of a subvolume: path, size and modification time of
+    each input file, the hash of the relevant configuration and
+    that of the part of it determining the selection
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    ivol : integer
+        Number of subvol
+
+    Returns
+    -------
+    manifest : dict
+        Manifest entries, as strings
+    """
+    allfiles = set(config['file_props'])
+    if config['selection'] is not None:
+        allfiles |= set(config['selection'])
+
+    inputs = {}
+    for ifile in sorted(allfiles):
+        filename = u.get_filename(config, ivol, ifile)
+        stat = os.stat(filename)
+        inputs[filename] = [stat.st_size, stat.st_mtime_ns]
+    return {'inputs': json.dumps(inputs, sort_keys=True),
+            'config_hash': get_config_hash(config),
+            'selection_hash': get_selection_hash(config)}
+
+
+def read_manifest(outfile):
+    """Manifest stored in an output file, None if there is none"""
+    try:
+        with h5py.File(outfile, 'r') as hf:
+            if 'manifest' not in hf:
+                return None
+            return {key: str(val) for key, val in hf['manifest'].attrs.items()}
+    except OSError:
+        return None
+
+
+def same_inputs(stored, manifest):
+    """
+    Check that the input files in a stored manifest have not changed,
+    allowing the current manifest to include further files
+
+    Parameters
+    ----------
+    stored : dict
+        Manifest stored in an output file
+    manifest : dict
+        Current manifest
+
+    Returns
+    -------
+    bool
+    """
+    stored_inputs = json.loads(stored['inputs'])
+    inputs = json.loads(manifest['inputs'])
+    return all(inputs.get(filename) == vals
+               for filename, vals in stored_inputs.items())
+
+
+def is_up_to_date(config, ivol, outfile=None):
+    """
+    Check if the output file of a subvolume was generated from
+    the current input files and configuration
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    ivol : integer
+        Number of subvol
+    outfile : str
+        Output file, by default the gne_input.hdf5 of the subvolume
+
+    Returns
+    -------
+    bool
+        True if the stored manifest matches the current one
+    """
+    if outfile is None:
+        outfile = config['outroot'] + str(ivol) + '/gne_input.hdf5'
+    stored = read_manifest(outfile)
+    if stored is None:
+        return False
+    try:
+        manifest = get_manifest(config, ivol)
+    except OSError:
+        return False
+    return stored == manifest
+
+
+def get_checkpoint(outfile, manifest):
+    """
+    Point from which the generation of a partially written file can
+    be resumed, after checking that its progress record corresponds
+    to the current inputs and configuration and that the committed
+    rows are present in all its datasets
+
+    Parameters
+    ----------
+    outfile : str
+        Output file
+    manifest : dict
+        Current manifest, see get_manifest
+
+    Returns
+    -------
+    next_row : int
+        First input row to be processed, 0 to start from scratch
+    nsel : int
+        Number of committed rows in the output datasets
+    """
+    try:
+        with h5py.File(outfile, 'r') as hf:
+            if 'progress' not in hf or 'manifest' in hf:
+                return 0, 0
+            progress = hf['progress'].attrs
+            for key, value in manifest.items():
+                if str(progress[key]) != value:
+                    return 0, 0
+            nsel = int(progress['nsel'])
+            datasets = json.loads(progress['datasets'])
+            if sorted(hf['data']) != datasets:
+                return 0, 0
+            for name in datasets:
+                dd = hf['data'][name]
+                if dd.maxshape[0] is not None or dd.shape[0] < nsel:
+                    return 0, 0
+            return int(progress['next_row']), nsel
+    except (OSError, KeyError, ValueError):
+        return 0, 0
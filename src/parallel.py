@@ -0,0 +1,110 @@
+"""
+Parallel execution of the tasks for different subvolumes
+"""
+import os
+import io
+import traceback
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import src.utils as u
+
+def get_nproc(nproc=None):
+    """
+    Number of worker processes to be used
+
+    Parameters
+    ----------
+    nproc : int
+        Number of workers, if None, SLURM_CPUS_PER_TASK is used
+        when defined, and 1 otherwise
+
+    Returns
+    -------
+    nproc : int
+    """
+    if nproc is None:
+        nproc = os.environ.get('SLURM_CPUS_PER_TASK', 1)
+    try:
+        nproc = int(nproc)
+    except ValueError:
+        nproc = 1
+    return max(nproc, 1)
+
+
+def sort_subvols(config, subvols):
+    """
+    Sort subvolumes by the size of their input files,
+    largest first
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary containing paths and file properties
+    subvols : list of integers
+        List of subvolumes
+
+    Returns
+    -------
+    sorted_subvols : list of integers
+    """
+    sizes = {ivol: u.get_input_size(config, ivol) for ivol in subvols}
+    return sorted(subvols, key=lambda ivol: -sizes[ivol])
+
+
+def _run_captured(func, args, kwargs):
+    """Run a task capturing its output"""
+    buf = io.StringIO()
+    with redirect_stdout(buf):
+        try:
+            success = func(*args, **kwargs)
+        except Exception:
+            traceback.print_exc(file=buf)
+            success = False
+    return bool(success), buf.getvalue()
+
+
+def run_subvols(func, tasks, nproc=1):
+    """
+    Run a function for each subvolume, in a pool of processes
+    if nproc>1. The output of each task is printed as one block
+    once the task has finished.
+
+    Parameters
+    ----------
+    func : function
+        Function returning True if it has been successful
+    tasks : dict
+        Arguments for func, as (args, kwargs), for each subvolume,
+        in the order they should be submitted
+    nproc : int
+        Number of worker processes
+
+    Returns
+    -------
+    results : dict
+        True or False for each subvolume
+    """
+    results = {}
+    if nproc < 2 or len(tasks) < 2:
+        for ivol, (args, kwargs) in tasks.items():
+            try:
+                results[ivol] = bool(func(*args, **kwargs))
+            except Exception:
+                traceback.print_exc()
+                results[ivol] = False
+        return results
+
+    with ProcessPoolExecutor(max_workers=min(nproc, len(tasks))) as pool:
+        futures = {}
+        for ivol, (args, kwargs) in tasks.items():
+            futures[pool.submit(_run_captured, func, args, kwargs)] = ivol
+        for future in as_completed(futures):
+            ivol = futures[future]
+            try:
+                success, log = future.result()
+            except Exception as err:
+                success, log = False, f'ERROR in ivol{ivol}: {err}\n'
+            results[ivol] = success
+            print(log, end='', flush=True)
+    return results
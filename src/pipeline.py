@@ -0,0 +1,112 @@
+"""
+Pipeline overlapping reading, computing and writing
+"""
+import threading
+import queue
+
+_done = object()
+
+class _Stage(threading.Thread):
+    """Background thread running one stage of the pipeline"""
+    def __init__(self, target, stop):
+        super().__init__(daemon=True)
+        self.target = target
+        self.stop = stop
+        self.error = None
+
+    def run(self):
+        try:
+            self.target()
+        except BaseException as err:
+            self.error = err
+            self.stop.set()
+
+
+def _put(q, item, stop):
+    """Put an item in a bounded queue, unless the pipeline is stopped"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    """Get an item from a queue, or _done if the pipeline is stopped"""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _done
+
+
+def run_pipeline(produce, process, consume, maxsize=2):
+    """
+    Run a read/compute/write pipeline: produce() is iterated in a
+    background prefetch thread, process() is applied to each item
+    in the calling thread and consume() is called on each result
+    in a background writer thread. Stages are connected by bounded
+    queues, so that at most maxsize items wait between stages.
+
+    Parameters
+    ----------
+    produce : function
+        Function returning an iterable with the items to be processed
+    process : function
+        Function applied to each item, returning a result or None
+        if there is nothing to be consumed
+    consume : function
+        Function applied to each result, in order
+    maxsize : int
+        Maximum number of items waiting between two stages
+
+    Returns
+    -------
+    nitems : int
+        Number of processed items
+    """
+    stop = threading.Event()
+    inq = queue.Queue(maxsize=maxsize)
+    outq = queue.Queue(maxsize=maxsize)
+
+    def prefetch():
+        for item in produce():
+            if not _put(inq, item, stop):
+                return
+        _put(inq, _done, stop)
+
+    def drain():
+        while True:
+            result = _get(outq, stop)
+            if result is _done:
+                return
+            consume(result)
+
+    reader = _Stage(prefetch, stop)
+    writer = _Stage(drain, stop)
+    reader.start(); writer.start()
+
+    nitems = 0
+    try:
+        while True:
+            item = _get(inq, stop)
+            if item is _done:
+                break
+            result = process(item)
+            nitems += 1
+            if result is not None:
+                if not _put(outq, result, stop):
+                    break
+        _put(outq, _done, stop)
+        writer.join()
+    finally:
+        stop.set()
+        reader.join(); writer.join()
+
+    for stage in (reader, writer):
+        if stage.error is not None:
+            raise stage.error
+    return nitems
@@ -1,11 +1,17 @@
 from src.config import get_config
 from src.validate import validate_hdf5_file
-from src.generate_input import generate_input_file
+from src.generate_input import generate_input_file, add_columns
+from src.generate_input import generate_snapshots
 from src.generate_test_files import generate_test_files
+from src.parallel import get_nproc, sort_subvols, run_subvols
+from src.manifest import is_up_to_date
+from src.index import build_index
 
 def prep_input(sim,snap,subvols,laptop=False,percentage=10,subfiles=2,
                validate_files=True,generate_files=False,
-               generate_testing_files=False,verbose=False):
+               generate_testing_files=False,chunk_size=None,nproc=None,
+               nworkers=1,pipeline=False,overwrite=False,update_files=False,
+               index_files=False,verbose=False):
     '''
     Validate input files and generate input for 
     generate_nebular_emission from hdf5 files 
@@ -30,6 +36,32 @@ def prep_input(sim,snap,subvols,laptop=False,percentage=10,subfiles=2,
         True to generate input for generate_nebular_emission
     generate_testing_files : bool
         True to generate reduced input for testing
+    chunk_size : int
+        Number of rows per block when generating files,
+        None to read each dataset in full
+    nproc : int
+        Number of subvolumes to be processed in parallel,
+        by default SLURM_CPUS_PER_TASK (or 1 if not defined)
+    nworkers : int
+        Number of processes working on blocks of rows within
+        each subvolume, for oversized subvolumes
+    pipeline : bool
+        True to overlap reading, computing and writing
+        with background threads
+    overwrite : bool
+        True to regenerate all files, otherwise subvolumes whose
+        output manifest matches the current input files and
+        configuration are skipped
+    update_files : bool
+        True to only add to the existing files the datasets in
+        config['file_props'] that they do not contain yet (see
+        generate_input.add_columns), instead of generating them
+        again, assuming that the selection has not changed
+    index_files : bool
+        True to write, before generating the files, the sorted index
+        of the selection datasets of each subvolume (config['index']
+        or all of them), with which range selections are resolved
+        without scanning the datasets
     verbose : bool
         If True, print further messages
     ''' 
@@ -40,21 +72,51 @@ def prep_input(sim,snap,subvols,laptop=False,percentage=10,subfiles=2,
     # Get the configuration
     config = get_config(sim,snap,subvols,laptop=laptop,verbose=verbose)
     
+    # Largest subvolumes first, so that they do not delay the end
+    nproc = get_nproc(nproc)
+    ordered = subvols
+    if nproc > 1:
+        ordered = sort_subvols(config, subvols)
+
     # Validate that files have the expected structure
     if validate_files:
-        count_failures = 0
-        for ivol in subvols:
-            success = validate_hdf5_file(config, snap, ivol, verbose=verbose)
-            if not success: count_failures += 1
-        if count_failures<1: print(f'SUCCESS: All {len(subvols)} subvolumes have valid hdf5 files.')
+        tasks = {ivol: ((config, snap, ivol), {'verbose': verbose})
+                 for ivol in ordered}
+        results = run_subvols(validate_hdf5_file, tasks, nproc=nproc)
+        failed = [ivol for ivol in subvols if not results[ivol]]
+        if len(failed)<1: print(f'SUCCESS: All {len(subvols)} subvolumes have valid hdf5 files.')
+        else: print(f'FAILED: {len(failed)} subvolumes have invalid hdf5 files: {failed}')
             
+    # Sorted index of the selection datasets
+    if index_files:
+        tasks = {ivol: ((config, ivol), {'verbose': verbose})
+                 for ivol in ordered}
+        results = run_subvols(build_index, tasks, nproc=nproc)
+        failed = [ivol for ivol in subvols if not results[ivol]]
+        if len(failed)<1: print(f'SUCCESS: All {len(subvols)} subvolumes have been indexed.')
+        else: print(f'FAILED: {len(failed)} subvolumes not indexed: {failed}')
+
     # Generate input data for generate_nebular_emission
     if generate_files:
-        count_failures = 0
-        for ivol in subvols:
-            success = generate_input_file(config, ivol, verbose=verbose)
-            if not success: count_failures += 1
-        if count_failures<1: print(f'SUCCESS: All {len(subvols)} hdf5 files have been generated.')
+        done = []
+        if not overwrite:
+            done = [ivol for ivol in ordered if is_up_to_date(config, ivol)]
+            if len(done)>0:
+                print(f'Skipping {len(done)} up-to-date subvolumes: {done}')
+        if update_files:
+            func = add_columns
+            kwargs = {'chunk_size': chunk_size, 'verbose': verbose}
+        else:
+            func = generate_input_file
+            kwargs = {'chunk_size': chunk_size, 'nworkers': nworkers,
+                      'pipeline': pipeline, 'verbose': verbose}
+        tasks = {ivol: ((config, ivol), kwargs)
+                 for ivol in ordered if ivol not in done}
+        results = run_subvols(func, tasks, nproc=nproc)
+        results.update({ivol: True for ivol in done})
+        failed = [ivol for ivol in subvols if not results[ivol]]
+        if len(failed)<1: print(f'SUCCESS: All {len(subvols)} hdf5 files have been generated.')
+        else: print(f'FAILED: {len(failed)} hdf5 files not generated: {failed}')
     
     # Random subsampling of the input files
     if generate_testing_files:
@@ -63,3 +125,61 @@ def prep_input(sim,snap,subvols,laptop=False,percentage=10,subfiles=2,
         if success: print(f'SUCCESS: All {subfiles*2} test files have been generated.')
 
     return
+
+
+def prep_input_snaps(sim,snaps,subvols,laptop=False,chunk_size=None,
+                     nproc=None,nworkers=1,pipeline=False,overwrite=False,
+                     verbose=False):
+    '''
+    Generate input for generate_nebular_emission for several snapshots
+    in a single pass over each subvolume, so that the input files
+    shared by the snapshots are opened once
+
+    Parameters
+    ----------
+    sim : str
+        Simulation type
+    snaps : list of integers
+        Snapshot numbers
+    subvols : list of integers
+        List of subvolumes to be considered
+    laptop : bool
+        If True, use local test configuration
+    chunk_size : int
+        Number of rows per block when generating files,
+        None to read each dataset in full
+    nproc : int
+        Number of subvolumes to be processed in parallel,
+        by default SLURM_CPUS_PER_TASK (or 1 if not defined)
+    nworkers : int
+        Number of processes working on blocks of rows within
+        each subvolume, for oversized subvolumes
+    pipeline : bool
+        True to overlap reading, computing and writing
+        with background threads
+    overwrite : bool
+        True to regenerate all files, otherwise snapshots whose
+        output manifest is up to date are skipped
+    verbose : bool
+        If True, print further messages
+    '''
+    # The snapshot directories are scanned once for all the configurations
+    configs = {snap: get_config(sim,snap,subvols,laptop=laptop,verbose=verbose)
+               for snap in snaps}
+
+    nproc = get_nproc(nproc)
+    ordered = subvols
+    if nproc > 1:
+        ordered = sort_subvols(configs[snaps[0]], subvols)
+
+    tasks = {ivol: ((configs, ivol), {'chunk_size': chunk_size,
+                                      'nworkers': nworkers,
+                                      'pipeline': pipeline,
+                                      'overwrite': overwrite,
+                                      'verbose': verbose})
+             for ivol in ordered}
+    results = run_subvols(generate_snapshots, tasks, nproc=nproc)
+    failed = [ivol for ivol in subvols if not results[ivol]]
+    if len(failed)<1: print(f'SUCCESS: All {len(subvols)} subvolumes have been generated for snapshots {snaps}.')
+    else: print(f'FAILED: {len(failed)} subvolumes not fully generated: {failed}')
+    return
@@ -0,0 +1,711 @@
+"""
+Selection of galaxies with expressions such as
+    mhhalo >= 20*mp & (mstars_disk + mstars_bulge) > 1e9
+"""
+import re
+from functools import lru_cache
+import numpy as np
+
+import src.utils as u
+
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+# Functions allowed within expressions
+functions = {'abs': np.abs, 'sqrt': np.sqrt, 'exp': np.exp,
+             'log': np.log, 'log10': np.log10}
+
+comparisons = {'<': np.less, '<=': np.less_equal, '>': np.greater,
+               '>=': np.greater_equal, '==': np.equal, '!=': np.not_equal}
+arithmetic = {'+': np.add, '-': np.subtract, '*': np.multiply,
+              '/': np.divide, '**': np.power}
+
+# Number of contiguous runs of rows read to estimate the selectivity
+# of the conditions (a strided read would decompress every chunk)
+nruns = 10
+
+_token = re.compile(r'''\s*(?:
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?) |
+    (?P<name>[A-Za-z_][A-Za-z0-9_]*) |
+    `(?P<quoted>[^`]+)` |
+    (?P<op>\*\*|<=|>=|==|!=|[-+*/<>()&|~])
+    )''', re.VERBOSE)
+
+def _tokenize(expression):
+    """Split an expression into (kind, value) tokens"""
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = _token.match(expression, pos)
+        if match is None:
+            raise ValueError(f'Invalid selection at "{expression[pos:]}"')
+        pos = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'quoted':
+            kind = 'name'
+        elif kind == 'name' and value in ('and', 'or', 'not'):
+            kind, value = 'op', {'and': '&', 'or': '|', 'not': '~'}[value]
+        tokens.append((kind, value))
+    return tokens
+
+
+class _Parser:
+    """
+    Recursive descent parser of selection expressions. Contrary to
+    python, &, | and ~ have a lower precedence than comparisons.
+    Nodes are tuples: ('num', value), ('name', name),
+    ('call', function, arg), ('neg', arg), ('bin', op, left, right),
+    ('cmp', ops, operands), ('and', args), ('or', args), ('not', arg)
+    """
+    def __init__(self, expression):
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def take(self, value=None):
+        kind, tok = self.peek()
+        if kind is None or (value is not None and tok != value):
+            raise ValueError(f'Expected {value or "more"} in selection')
+        self.pos += 1
+        return kind, tok
+
+    def parse(self):
+        node = self.parse_or()
+        if self.pos < len(self.tokens):
+            raise ValueError(f'Unexpected "{self.peek()[1]}" in selection')
+        return node
+
+    def parse_or(self):
+        args = [self.parse_and()]
+        while self.peek() == ('op', '|'):
+            self.take()
+            args.append(self.parse_and())
+        return args[0] if len(args) == 1 else ('or', args)
+
+    def parse_and(self):
+        args = [self.parse_not()]
+        while self.peek() == ('op', '&'):
+            self.take()
+            args.append(self.parse_not())
+        return args[0] if len(args) == 1 else ('and', args)
+
+    def parse_not(self):
+        if self.peek() == ('op', '~'):
+            self.take()
+            return ('not', self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        operands = [self.parse_sum()]
+        ops = []
+        while self.peek()[0] == 'op' and self.peek()[1] in comparisons:
+            ops.append(self.take()[1])
+            operands.append(self.parse_sum())
+        if not ops:
+            return operands[0]
+        return ('cmp', ops, operands)
+
+    def parse_sum(self):
+        node = self.parse_term()
+        while self.peek()[0] == 'op' and self.peek()[1] in '+-':
+            op = self.take()[1]
+            node = ('bin', op, node, self.parse_term())
+        return node
+
+    def parse_term(self):
+        node = self.parse_factor()
+        while self.peek() in (('op', '*'), ('op', '/')):
+            op = self.take()[1]
+            node = ('bin', op, node, self.parse_factor())
+        return node
+
+    def parse_factor(self):
+        if self.peek() in (('op', '-'), ('op', '+')):
+            op = self.take()[1]
+            arg = self.parse_factor()
+            return ('neg', arg) if op == '-' else arg
+        node = self.parse_atom()
+        if self.peek() == ('op', '**'):
+            self.take()
+            node = ('bin', '**', node, self.parse_factor())
+        return node
+
+    def parse_atom(self):
+        kind, tok = self.take()
+        if kind == 'number':
+            # Integers are kept exact, e.g. for limits on 64 bit ids
+            if tok.isdigit():
+                return ('num', int(tok))
+            return ('num', float(tok))
+        if kind == 'name':
+            if self.peek() == ('op', '(') and tok in functions:
+                self.take('(')
+                arg = self.parse_or()
+                self.take(')')
+                return ('call', tok, arg)
+            return ('name', tok)
+        if tok == '(':
+            node = self.parse_or()
+            self.take(')')
+            return node
+        raise ValueError(f'Unexpected "{tok}" in selection')
+
+
+def _get_names(node, names):
+    """Add to a list the names used within a node, in order"""
+    kind = node[0]
+    if kind == 'name':
+        if node[1] not in names:
+            names.append(node[1])
+    elif kind in ('call', 'neg', 'not'):
+        _get_names(node[-1], names)
+    elif kind == 'bin':
+        _get_names(node[2], names); _get_names(node[3], names)
+    elif kind == 'cmp':
+        for arg in node[2]:
+            _get_names(arg, names)
+    elif kind in ('and', 'or'):
+        for arg in node[1]:
+            _get_names(arg, names)
+    return names
+
+
+def _as_float(value):
+    """Python integers as floats, as numbers used in arithmetic"""
+    if isinstance(value, int) and not isinstance(value, (bool, np.integer)):
+        return float(value)
+    return value
+
+
+def _as_scalar(result, *args):
+    """
+    Result of an operation on python numbers as a python number, so
+    that constants are weakly typed, as in numpy: a float32 dataset
+    compared with 20*mp is compared in float32, as with 2e9
+    """
+    if isinstance(result, np.generic) and all(
+            isinstance(arg, (int, float)) for arg in args):
+        return result.item()
+    return result
+
+
+def _evaluate(node, env):
+    """Evaluate a node with numpy, given the values of the names"""
+    kind = node[0]
+    if kind == 'num':
+        return node[1]
+    if kind == 'name':
+        return env[node[1]]
+    if kind == 'call':
+        arg = _as_float(_evaluate(node[2], env))
+        return _as_scalar(functions[node[1]](arg), arg)
+    if kind == 'neg':
+        arg = _evaluate(node[1], env)
+        if isinstance(arg, (int, float)):
+            return -arg
+        return np.negative(arg)
+    if kind == 'bin':
+        left = _as_float(_evaluate(node[2], env))
+        right = _as_float(_evaluate(node[3], env))
+        return _as_scalar(arithmetic[node[1]](left, right), left, right)
+    if kind == 'cmp':
+        operands = [_evaluate(arg, env) for arg in node[2]]
+        result = None
+        for op, left, right in zip(node[1], operands[:-1], operands[1:]):
+            cut = comparisons[op](left, right)
+            result = cut if result is None else np.logical_and(result, cut)
+        return result
+    if kind in ('and', 'or'):
+        combine = np.logical_and if kind == 'and' else np.logical_or
+        result = _evaluate(node[1][0], env)
+        for arg in node[1][1:]:
+            result = combine(result, _evaluate(arg, env))
+        return result
+    if kind == 'not':
+        return np.logical_not(_evaluate(node[1], env))
+    raise ValueError(f'Unknown node {kind}')
+
+
+def _cast_constant(value, dtype):
+    """
+    Constant with the type numpy gives it when combined with values
+    of a dtype, e.g. float32 for a python float and float32 values
+    """
+    try:
+        return np.result_type(dtype, value).type(value)
+    except OverflowError:
+        return value
+
+
+class _NumexprSource:
+    """
+    Source of an expression for numexpr, with the datasets and the
+    constants as variables. numexpr promotes float32 values combined
+    with python floats to float64, so each constant is passed with the
+    type numpy would give it next to the values it is combined with.
+    """
+    def __init__(self, env, datasets):
+        self.env = env
+        self.datasets = datasets
+        self.local = {}
+
+    def variable(self, value):
+        name = f'v{len(self.local)}'
+        self.local[name] = value
+        return name
+
+    def constant(self, value, dtype):
+        """Variable with a constant, cast for values of a dtype"""
+        return self.variable(_cast_constant(value, dtype))
+
+    def operand(self, node):
+        """
+        Source and dtype of an operand using datasets, or None
+        and the value of a constant operand
+        """
+        if any(name in self.datasets for name in _get_names(node, [])):
+            return self.source(node)
+        return None, _evaluate(node, self.env)
+
+    def pair(self, left, right):
+        """Sources of two operands, with constants cast as in numpy"""
+        (lsrc, lval), (rsrc, rval) = left, right
+        if lsrc is None:
+            lsrc = self.constant(lval, rval)
+        if rsrc is None:
+            rsrc = self.constant(rval, lval)
+        return lsrc, rsrc
+
+    def source(self, node):
+        """Source of a node with datasets and the dtype of its values"""
+        kind = node[0]
+        if kind == 'name':
+            values = np.asarray(self.env[node[1]])
+            return self.variable(values), values.dtype
+        if kind == 'call':
+            src, dtype = self.source(node[2])
+            if not np.issubdtype(dtype, np.floating):
+                dtype = np.dtype(float)
+            return f'{node[1]}({src})', dtype
+        if kind == 'neg':
+            src, dtype = self.source(node[1])
+            return f'(-{src})', dtype
+        if kind == 'bin':
+            left, right = [(src, val if src is not None else _as_float(val))
+                           for src, val in (self.operand(node[2]),
+                                            self.operand(node[3]))]
+            # Python numbers are weakly typed in np.result_type
+            dtype = np.result_type(left[1], right[1])
+            if node[1] == '/' and not np.issubdtype(dtype, np.floating):
+                dtype = np.dtype(float)
+            lsrc, rsrc = self.pair(left, right)
+            return f'({lsrc} {node[1]} {rsrc})', dtype
+        if kind == 'cmp':
+            operands = [self.operand(arg) for arg in node[2]]
+            cuts = []
+            for op, left, right in zip(node[1], operands[:-1], operands[1:]):
+                if left[0] is None and right[0] is None:
+                    cuts.append(repr(bool(comparisons[op](left[1], right[1]))))
+                else:
+                    lsrc, rsrc = self.pair(left, right)
+                    cuts.append(f'({lsrc} {op} {rsrc})')
+            return '(' + ' & '.join(cuts) + ')', np.dtype(bool)
+        if kind in ('and', 'or', 'not'):
+            args = node[1] if kind in ('and', 'or') else [node[1]]
+            sources = []
+            for arg in args:
+                src, val = self.operand(arg)
+                sources.append(repr(bool(val)) if src is None else src)
+            if kind == 'not':
+                return f'(~{sources[0]})', np.dtype(bool)
+            op = ' & ' if kind == 'and' else ' | '
+            return '(' + op.join(sources) + ')', np.dtype(bool)
+        raise ValueError(f'Unknown node {kind}')
+
+
+class Selection:
+    """
+    Selection expression, parsed once and evaluated in a single
+    vectorized pass (with numexpr, if available).
+
+    Expressions combine datasets, numbers and constants (e.g. the
+    particle mass mp from the configuration) with arithmetic
+    operators (+ - * / **), comparisons (< <= > >= == !=, which can
+    be chained), the functions abs, sqrt, exp, log and log10, and
+    the logical operators & (and), | (or) and ~ (not). The logical
+    operators have a lower precedence than comparisons. Names of
+    datasets with other characters are written within backquotes.
+
+    Parameters
+    ----------
+    expression : str
+        Selection expression, empty or None to select everything
+    constants : dict
+        Values of the names that are not datasets, which cannot
+        also be the name of an available dataset
+
+    Attributes
+    ----------
+    names : list of str
+        Names used by the expression
+    datasets : list of str
+        Datasets used by the expression, the names that are not constants
+    terms : list of Selection
+        Conditions combined with & at the top level, which can be
+        applied one after another
+
+    Examples
+    --------
+    >>> sel = Selection('mhhalo >= 20*mp & 0 <= xgal < 125', {'mp': 1e8})
+    >>> mask = sel.evaluate({'mhhalo': mhhalo, 'xgal': xgal})
+    """
+    def __init__(self, expression, constants=None, node=None):
+        self.expression = '' if expression is None else expression
+        self.constants = {} if constants is None else dict(constants)
+        if node is None and self.expression.strip():
+            node = _Parser(self.expression).parse()
+        self.node = node
+
+        self.names = [] if node is None else _get_names(node, [])
+        self.datasets = [name for name in self.names
+                         if name not in self.constants]
+        if node is not None and node[0] == 'and':
+            self.terms = [Selection(self.expression, self.constants, node=arg)
+                          for arg in node[1]]
+        elif node is not None:
+            self.terms = [self]
+        else:
+            self.terms = []
+
+    def check(self, available):
+        """
+        Check that the datasets used by the expression are available,
+        and that none of its constants is also an available dataset,
+        which it would hide
+
+        Parameters
+        ----------
+        available : list or h5py.Group
+            Names of the available datasets
+        """
+        missing = [name for name in self.datasets if name not in available]
+        if missing:
+            raise ValueError(f'Selection "{self.expression}" uses '
+                             f'unknown datasets or constants: {missing}')
+        shadowed = [name for name in self.names
+                    if name in self.constants and name in available]
+        if shadowed:
+            raise ValueError(f'Selection "{self.expression}" uses names '
+                             'that are both datasets and constants of the '
+                             f'configuration: {shadowed}')
+
+    def get_range(self):
+        """
+        Limits of the expression if it is a range on a single
+        dataset, such as 'low <= mhhalo < high' or 'mhhalo > 20*mp'
+
+        Returns
+        -------
+        limits : tuple
+            (dataset, low, high, include_low, include_high), with None
+            for a missing limit, or None if the expression is not a range
+        """
+        if self.node is None or self.node[0] != 'cmp' or len(self.datasets) != 1:
+            return None
+        name = self.datasets[0]
+        ops, operands = self.node[1], self.node[2]
+        if [arg for arg in operands if arg == ('name', name)] != [('name', name)]:
+            return None
+        limits = {}
+        for op, left, right in zip(ops, operands[:-1], operands[1:]):
+            if left == ('name', name):
+                other = right
+            elif right == ('name', name):
+                other = left
+                op = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}.get(op, op)
+            else:
+                return None
+            if op not in ('<', '<=', '>', '>=', '=='):
+                return None
+            value = _evaluate(other, self.constants)
+            if op in ('>', '>=', '=='):
+                if 'low' in limits:
+                    return None
+                limits['low'] = (value, op != '>')
+            if op in ('<', '<=', '=='):
+                if 'high' in limits:
+                    return None
+                limits['high'] = (value, op != '<')
+        low, include_low = limits.get('low', (None, True))
+        high, include_high = limits.get('high', (None, True))
+        return name, low, high, include_low, include_high
+
+    def evaluate(self, values, nrows=None):
+        """
+        Evaluate the expression
+
+        Parameters
+        ----------
+        values : dict
+            Values of the datasets
+        nrows : int
+            Number of rows, by default the length of the values
+
+        Returns
+        -------
+        mask : numpy array of bool
+        """
+        if nrows is None:
+            nrows = len(values[self.datasets[0]]) if self.datasets else 1
+        if self.node is None:
+            return np.ones(nrows, dtype=bool)
+
+        env = dict(self.constants)
+        env.update({name: values[name] for name in self.datasets})
+        if ne is not None and self.datasets:
+            numexpr = _NumexprSource(env, self.datasets)
+            source = numexpr.source(self.node)[0]
+            mask = ne.evaluate(source, local_dict=numexpr.local)
+        else:
+            mask = _evaluate(self.node, env)
+        return np.broadcast_to(np.asarray(mask, dtype=bool), (nrows,))
+
+
+def _to_literal(value):
+    """Number written exactly, keeping integers as such"""
+    if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+        return str(int(value))
+    return repr(float(value))
+
+
+def limits_to_expression(datasets, low_lim, high_lim):
+    """
+    Expression equivalent to lower and upper limits on datasets
+
+    Parameters
+    ----------
+    datasets : list (N)
+       Names of the datasets
+    low_lim : list (N)
+       Lower limit for each dataset, None for no limit
+    high_lim : list (N)
+       Upper limit for each dataset, None for no limit
+
+    Returns
+    -------
+    expression : str
+    """
+    cuts = []
+    for name, low, high in zip(datasets, low_lim, high_lim):
+        if low is not None and high is not None:
+            cuts.append(f'{_to_literal(low)} <= `{name}` <= {_to_literal(high)}')
+        elif low is not None:
+            cuts.append(f'`{name}` >= {_to_literal(low)}')
+        elif high is not None:
+            cuts.append(f'`{name}` <= {_to_literal(high)}')
+    return ' & '.join(cuts)
+
+
+def get_constants(config):
+    """
+    Numerical values in the configuration, usable in expressions.
+    An expression using one of them as a constant cannot be applied
+    to a group with a dataset of the same name (Selection.check).
+    """
+    return {key: val for key, val in config.items()
+            if isinstance(val, (int, float)) and not isinstance(val, bool)}
+
+
+@lru_cache(maxsize=64)
+def _compile(expression, constants):
+    return Selection(expression, dict(constants))
+
+
+def get_selection(props, config):
+    """
+    Selection for one input file, given either as an expression
+    (key 'expression') or as lower and upper limits on the datasets
+    (keys 'low_limits' and 'high_limits'), everything if none is given
+
+    Parameters
+    ----------
+    props : dict
+        Selection properties of the file
+    config : dict
+        Configuration dictionary, with the constants for expressions
+
+    Returns
+    -------
+    selection : Selection
+    """
+    if 'expression' in props:
+        expression = props['expression']
+    elif 'low_limits' not in props and 'high_limits' not in props:
+        expression = ''
+    else:
+        expression = limits_to_expression(props['datasets'],
+                                          props['low_limits'],
+                                          props['high_limits'])
+    constants = tuple(sorted(get_constants(config).items()))
+    return _compile(expression, constants)
+
+
+def get_samples(config):
+    """
+    Named samples of the selection. The selection of each input
+    file can define samples with the key 'samples', as
+    {name: expression}, in addition to the common selection.
+    Conditions of a sample in different files are combined with &.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary
+
+    Returns
+    -------
+    samples : dict
+        Selection of each sample in each file, as {name: {ifile: Selection}}
+    """
+    samples = {}
+    if config['selection'] is None:
+        return samples
+    constants = tuple(sorted(get_constants(config).items()))
+    for ifile, props in config['selection'].items():
+        for name, expression in props.get('samples', {}).items():
+            samples.setdefault(name, {})[ifile] = _compile(expression,
+                                                           constants)
+    return samples
+
+
+def apply_selection(hf, selection, datasets, start=0, stop=None, rows=None,
+                    nsample=1000, derived=None, index=None):
+    """
+    Apply a selection to the rows of a group, one top level condition
+    at a time, starting with the most selective one, and reading
+    each dataset only at the rows that pass the previous conditions.
+
+    The selection can use derived quantities, which are computed
+    only at the candidate rows of the conditions using them, from
+    the minimal set of datasets they need. A derived quantity takes
+    precedence over a dataset with the same name.
+
+    Conditions that are ranges on datasets with a sorted index are
+    resolved with the index first, without reading the datasets.
+
+    Parameters
+    ----------
+    hf : h5py.Group or CachedGroup
+       Group containing the datasets
+    selection : Selection
+       Selection to be applied
+    datasets : list (N)
+       Datasets whose values are returned
+    start : int
+       First row to be considered
+    stop : int
+       Row after the last one to be considered,
+       by default the length of the datasets
+    rows : numpy array of int
+       Sorted candidate rows within [start, stop), None for all
+    nsample : int
+       Number of rows used to estimate the selectivity of each condition,
+       read as a few contiguous runs spread over the range
+    derived : dict
+       Function computing each derived quantity, called as
+       compute(read), where read(group, name) gives the values of
+       a dataset of an open group at the rows being considered
+    index : dict
+       Sorted index (index.SortedIndex) of some datasets of the group
+
+    Returns
+    -------
+    rows : numpy array of int
+       Rows passing the selection, None if no row passes it
+    vals : list (N)
+       Values of each dataset, with its own dtype, at those rows
+    """
+    derived = {} if derived is None else derived
+    selection.check([name for name in selection.names
+                     if name in derived or name in hf])
+    if stop is None:
+        names = [name for name in list(datasets) + selection.datasets
+                 if name not in derived]
+        stop = hf[names[0]].shape[0]
+    all_rows = rows is None
+    if all_rows:
+        rows = np.arange(start, stop)
+
+    def get(name, read):
+        if name in derived:
+            return derived[name](read)
+        return read(hf, name)
+
+    # Conditions resolved with the sorted index of their dataset
+    terms = list(selection.terms)
+    if index:
+        for term in selection.terms:
+            limits = term.get_range()
+            if limits is None or limits[0] in derived or limits[0] not in index:
+                continue
+            irows = index[limits[0]].range_rows(*limits[1:], start=start,
+                                                stop=stop)
+            if all_rows:
+                rows = irows.astype(rows.dtype)
+                all_rows = False
+            else:
+                rows = np.intersect1d(rows, irows, assume_unique=True)
+            terms.remove(term)
+
+    # Order the conditions by the fraction of sampled rows passing them
+    if len(rows) > nsample and len(terms) > 1:
+        spacing = max((stop - start)//nruns, 1)
+        length = min(-(-nsample//nruns), spacing)
+        runs = [(low, low + length) for low in
+                range(start, min(start + nruns*spacing, stop), spacing)]
+        sample = {}
+        def read_sample(group, name):
+            dset = group[name]
+            return np.concatenate([dset[low:high] for low, high in runs])
+        for name in selection.datasets:
+            sample[name] = get(name, read_sample)
+        nrows = len(runs)*length
+        fraction = {}
+        for term in terms:
+            fraction[term] = np.count_nonzero(term.evaluate(sample, nrows))/nrows
+        terms.sort(key=lambda term: fraction[term])
+
+    # Values read so far, with the rows they correspond to
+    read = {}
+    def read_rows(group, name):
+        return u.read_column(group, name, rows, start, stop)
+    def get_values(name):
+        if name in read:
+            vrows, data = read[name]
+            if len(vrows) != len(rows):
+                data = data[np.isin(vrows, rows, assume_unique=True)]
+        else:
+            data = get(name, read_rows)
+        read[name] = (rows, data)
+        return data
+
+    # Apply the conditions, reading only the candidate rows
+    for term in terms:
+        if len(rows) < 1:
+            return None, None
+        values = {name: get_values(name) for name in term.datasets}
+        cut = term.evaluate(values, len(rows))
+        rows = rows[cut]
+        for name in term.datasets:
+            read[name] = (rows, values[name][cut])
+    if len(rows) < 1:
+        return None, None
+    return rows, [get_values(name) for name in datasets]
@@ -3,6 +3,13 @@ from glob import glob
 import h5py
 import numpy as np
 
+# Estimated cost, in bytes, of an extra hyperslab read
+range_cost = 32768
+
+# Snapshots found for each (root, subvols, dir_base), so that the
+# directories are scanned once when processing several snapshots
+zz_found = {}
+
 
 def get_path(root, ivol, ending=None):
     """
@@ -86,10 +93,61 @@ def combined_mask(alldata,low_lim,high_lim,verbose=True):
     return mask
 
 
+def get_filename(config, ivol, ifile):
+    """
+    Get the full path to an input file, taking into account
+    that the file in config['except_file'] is a directory above.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary
+    ivol : int
+        Volume index number
+    ifile : str
+        Name of the input file
+
+    Returns
+    -------
+    filename : str
+    """
+    except_file = config.get('except_file')
+    if except_file is not None and ifile == except_file:
+        return get_path(config['root'],ivol) + ifile
+    return get_path(config['root'],ivol,ending=config.get('ending')) + ifile
+
+
+def get_input_size(config, ivol):
+    """
+    Total size in bytes of the input files of a subvolume
+
+    Parameters
+    ----------
+    config : dict
+        Configuration dictionary
+    ivol : int
+        Volume index number
+
+    Returns
+    -------
+    size : int
+    """
+    allfiles = set(config['file_props'])
+    if config['selection'] is not None:
+        allfiles |= set(config['selection'])
+    size = 0
+    for ifile in allfiles:
+        filename = get_filename(config, ivol, ifile)
+        if os.path.exists(filename):
+            size += os.path.getsize(filename)
+    return size
+
+
 def get_zz_subvols(root, subvols, dir_base='iz',verbose=False):
     """
     Check which subvolume directories exist and 
     verify they all have the same redshift subdirectories.
+    The result is kept in zz_found for later calls.
 
     Parameters
     ----------
@@ -105,6 +163,10 @@ def get_zz_subvols(root, subvols, dir_base='iz',verbose=False):
     zz : list of int
         Sorted list of redshift indices (descending order)
     """
+    key = (root, tuple(subvols), dir_base)
+    if key in zz_found:
+        return zz_found[key]
+
     zz_reference = None
     first_vol_dir = None
 
@@ -146,6 +208,7 @@ def get_zz_subvols(root, subvols, dir_base='iz',verbose=False):
     if zz_reference is None:
         print(f'STOP: No valid directories found in {root} for subvols {subvols}')
         sys.exit(1)
+    zz_found[key] = zz_reference
     return zz_reference
 
 
@@ -191,6 +254,130 @@ def get_group_name(root, snap, subvols, group_base='Output',
     return group_name
 
 #---------------hdf5 files-----------------------------------------
+def get_row_ranges(rows, gap=1, align=None):
+    """
+    Merge sorted row indexes into contiguous ranges
+
+    Parameters
+    ----------
+    rows : numpy array of int
+        Sorted and unique row indexes
+    gap : int
+        Rows separated by less than this number are merged
+        into the same range
+    align : int
+        If given, the ranges are extended to multiples of this
+        number of rows (e.g. the chunk size of a dataset)
+
+    Returns
+    -------
+    ranges : numpy array (N,2)
+        First row and row after the last of each range
+    """
+    rows = np.asarray(rows)
+    if len(rows) < 1:
+        return np.zeros((0,2), dtype=np.int64)
+
+    starts = rows.astype(np.int64)
+    stops = starts + 1
+    if align is not None and align > 1:
+        starts = (starts//align)*align
+        stops = (stops + align - 1)//align*align
+
+    # Start a new range where the gap with the previous one is large
+    new = np.ones(len(rows), dtype=bool)
+    new[1:] = starts[1:] - stops[:-1] >= gap
+    ibreak = np.where(new)[0]
+    iend = np.append(ibreak[1:], len(rows)) - 1
+    ranges = np.column_stack((starts[ibreak], stops[iend]))
+    return ranges
+
+
+def read_rows(dset, rows, start=0, stop=None):
+    """
+    Read the given rows of a dataset, choosing between reading
+    the whole range [start, stop) and reading only the (chunk
+    aligned) ranges containing the selected rows
+
+    Parameters
+    ----------
+    dset : h5py.Dataset
+        Dataset to be read
+    rows : numpy array of int
+        Sorted and unique indexes of the rows to be read
+    start : int
+        First row of the range the rows belong to
+    stop : int
+        Row after the last one of the range, by default the
+        length of the dataset
+
+    Returns
+    -------
+    vals : numpy array
+        Values of the dataset at the given rows
+    """
+    if stop is None:
+        stop = dset.shape[0]
+    rows = np.asarray(rows)
+    nsel = len(rows)
+    if nsel == stop - start:
+        return dset[start:stop]
+    if nsel < 1:
+        return np.zeros((0,) + dset.shape[1:], dtype=dset.dtype)
+
+    # Compare the cost of a full read with that of a sparse one
+    itemsize = dset.dtype.itemsize*int(np.prod(dset.shape[1:]))
+    if dset.chunks is not None:
+        ranges = get_row_ranges(rows, align=dset.chunks[0])
+        ranges[:,0] = np.maximum(ranges[:,0], start)
+        ranges[:,1] = np.minimum(ranges[:,1], stop)
+    else:
+        gap = max(range_cost//itemsize, 1)
+        ranges = get_row_ranges(rows, gap=gap)
+    nread = np.sum(ranges[:,1] - ranges[:,0])
+    sparse_cost = len(ranges)*range_cost + nread*itemsize
+    if sparse_cost >= (stop - start)*itemsize:
+        return dset[start:stop][rows - start]
+
+    # Read only the ranges with selected rows
+    vals = np.empty((nsel,) + dset.shape[1:], dtype=dset.dtype)
+    ilow = np.searchsorted(rows, ranges[:,0])
+    ihigh = np.searchsorted(rows, ranges[:,1])
+    for (low, high), il, ih in zip(ranges, ilow, ihigh):
+        vals[il:ih] = dset[low:high][rows[il:ih] - low]
+    return vals
+
+
+def read_column(hf, name, rows=None, start=0, stop=None):
+    """
+    Read the given rows of a dataset within a group, through
+    the cache of the group if it has one (see src.cache.CachedGroup)
+
+    Parameters
+    ----------
+    hf : h5py.Group or CachedGroup
+        Group containing the dataset
+    name : str
+        Name of the dataset
+    rows : numpy array of int
+        Sorted and unique rows, None for all the rows in the range
+    start : int
+        First row of the range
+    stop : int
+        Row after the last one of the range, by default the
+        length of the dataset
+
+    Returns
+    -------
+    vals : numpy array
+    """
+    if hasattr(hf, 'read_column'):
+        return hf.read_column(name, rows=rows, start=start, stop=stop)
+    if rows is None:
+        return hf[name][start:stop]
+    return read_rows(hf[name], rows, start, stop)
+
+
 def open_hdf5_group(hdf_file, group):
     """
     Get the appropriate group or root from an HDF5 file
@@ -0,0 +1,457 @@
+"""
+Writer for the input files of generate_nebular_emission
+"""
+import json
+import h5py
+import numpy as np
+
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+# Compressors available through h5py without plugins
+native_compressors = ['gzip', 'lzf']
+# Compressors requiring the hdf5plugin package
+plugin_compressors = ['blosc', 'zstd', 'lz4', 'bitshuffle']
+# Size in bytes of the chunks of extendable datasets, unless set
+resizable_chunk_bytes = 2**20
+
+def get_storage_kwargs(storage, nrows=None, resizable=False):
+    """
+    Translate storage options into h5py.create_dataset arguments
+
+    Parameters
+    ----------
+    storage : dict
+        Storage options, with any of the keys:
+        'compression' : None, 'gzip', 'lzf' or, if hdf5plugin is
+                        installed, 'blosc', 'zstd', 'lz4', 'bitshuffle'
+        'compression_opts' : compression level (gzip, zstd, blosc)
+        'shuffle' : True to apply the shuffle filter
+        'chunks' : number of rows per chunk, or True for automatic
+    nrows : int
+        Number of rows of the dataset, used to limit the chunk size
+    resizable : bool
+        True if the dataset is going to be extended
+
+    Returns
+    -------
+    kwargs : dict
+    """
+    kwargs = {}
+    if not storage or (nrows == 0 and not resizable):
+        return kwargs
+
+    compression = storage.get('compression')
+    level = storage.get('compression_opts')
+    if compression in plugin_compressors and hdf5plugin is None:
+        print(f'WARNING: hdf5plugin not available for {compression},'
+              ' using gzip instead')
+        compression = 'gzip'; level = None
+    if compression in native_compressors:
+        kwargs['compression'] = compression
+        if level is not None and compression == 'gzip':
+            kwargs['compression_opts'] = level
+    elif compression == 'blosc':
+        kwargs.update(hdf5plugin.Blosc(cname='zstd', clevel=level or 5,
+                                       shuffle=hdf5plugin.Blosc.SHUFFLE))
+    elif compression == 'zstd':
+        kwargs.update(hdf5plugin.Zstd(clevel=level or 3))
+    elif compression == 'lz4':
+        kwargs.update(hdf5plugin.LZ4())
+    elif compression == 'bitshuffle':
+        kwargs.update(hdf5plugin.Bitshuffle(cname='lz4'))
+    elif compression is not None:
+        print(f'WARNING: unknown compression {compression}, ignored')
+
+    if storage.get('shuffle'):
+        kwargs['shuffle'] = True
+
+    chunks = storage.get('chunks')
+    if chunks is True:
+        kwargs['chunks'] = True
+    elif chunks is not None:
+        chunks = int(chunks)
+        if nrows is not None and not resizable:
+            chunks = min(chunks, nrows)
+        kwargs['chunks'] = (max(chunks, 1),)
+    return kwargs
+
+def round_mantissa(vals, nbits):
+    """
+    Round floats to a given number of mantissa bits, so that
+    the trailing bits are zero and compress well
+
+    Parameters
+    ----------
+    vals : numpy array of floats
+        Values to be rounded
+    nbits : int
+        Number of explicit mantissa bits to be kept
+
+    Returns
+    -------
+    rounded : numpy array
+    """
+    vals = np.asarray(vals)
+    nmant = np.finfo(vals.dtype).nmant
+    if nbits >= nmant:
+        return vals.copy()
+    utype = np.dtype(f'u{vals.dtype.itemsize}')
+    drop = nmant - max(nbits, 0)
+    half = utype.type(1) << utype.type(drop - 1)
+    keep = ~((utype.type(1) << utype.type(drop)) - utype.type(1))
+    bits = vals.view(utype)
+    rounded = ((bits + half) & keep).view(vals.dtype)
+    # Infinities and NaNs are kept as they are
+    return np.where(np.isfinite(vals), rounded, vals)
+
+
+def get_max_rel_error(orig, new):
+    """Maximum relative difference between non-zero original values
+    and the ones to be stored"""
+    ok = (orig != 0) & np.isfinite(orig)
+    if not np.any(ok):
+        return 0.
+    diff = np.abs(new[ok].astype(np.float64) - orig[ok])
+    return float(np.max(diff/np.abs(orig[ok])))
+
+
+def apply_precision(vals, policy):
+    """
+    Reduce the precision of float values following a policy
+
+    Parameters
+    ----------
+    vals : numpy array
+        Values to be stored
+    policy : str
+        None for lossless storage,
+        'float32' to store floats with single precision,
+        'bits:N' to round the mantissa to N bits,
+        'scaleoffset:N' to apply the HDF5 scale-offset filter
+        keeping N decimal digits
+
+    Returns
+    -------
+    vals : numpy array
+        Values to be stored
+    kwargs : dict
+        Extra arguments for h5py.create_dataset
+    max_rel_error : float
+        Maximum relative error, None if the values are not modified
+    """
+    if policy is None or not np.issubdtype(vals.dtype, np.floating):
+        return vals, {}, None
+
+    kwargs = {}
+    name, _, value = policy.partition(':')
+    if name == 'float32':
+        new = vals.astype(np.float32)
+    elif name == 'bits':
+        new = round_mantissa(vals, int(value))
+    elif name == 'scaleoffset':
+        # Values rounded to the digits kept by the filter, which then
+        # stores them without further loss, so that the error is that
+        # of the stored values (the filter alone truncates them within
+        # each chunk, with up to twice the error)
+        ndigits = int(value)
+        kwargs['scaleoffset'] = ndigits
+        new = np.round(vals*10.**ndigits)/10.**ndigits
+    else:
+        print(f'WARNING: unknown precision {policy}, ignored')
+        return vals, {}, None
+    err = get_max_rel_error(vals, new)
+    return new, kwargs, err
+
+
+def get_index_dtype(nrows):
+    """Smallest unsigned integer type able to store indexes up to nrows"""
+    for dtype in [np.uint8, np.uint16, np.uint32]:
+        if nrows <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+def get_int_dtype(vmin, vmax):
+    """Smallest integer type able to store values within [vmin, vmax]"""
+    if vmin >= 0:
+        dtypes = [np.uint8, np.uint16, np.uint32, np.uint64]
+    else:
+        dtypes = [np.int8, np.int16, np.int32, np.int64]
+    for dtype in dtypes[:-1]:
+        info = np.iinfo(dtype)
+        if info.min <= vmin and vmax <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(dtypes[-1])
+
+
+def cast_dtype(vals, dtype):
+    """
+    Cast values to a given type, checking that integers fit in it
+
+    Parameters
+    ----------
+    vals : numpy array
+        Values to be stored
+    dtype : str or numpy dtype
+        Type of the stored values, None to keep the original one
+
+    Returns
+    -------
+    vals : numpy array
+    """
+    if dtype is None:
+        return vals
+    dtype = np.dtype(dtype)
+    if vals.dtype == dtype:
+        return vals
+    if np.issubdtype(dtype, np.integer) and vals.size > 0:
+        info = np.iinfo(dtype)
+        if vals.min() < info.min or vals.max() > info.max:
+            raise ValueError(f'Values out of the range of {dtype}: '
+                             f'[{vals.min()}, {vals.max()}]')
+    return vals.astype(dtype)
+
+
+class GneWriter:
+    """
+    Single-session writer for gne_input.hdf5 files.
+
+    The output file is opened once, all datasets are written through
+    the same handle and the header attributes are buffered and
+    flushed when the file is closed.
+
+    Parameters
+    ----------
+    outfile : str
+        Name of the output file
+    mode : str
+        Mode to open the file, 'w' (default) or 'a'
+    resizable : bool
+        If True, datasets are created extendable so that they can
+        be filled in row blocks with append()
+    storage : dict
+        Default storage options (compression, shuffle, chunks)
+        for the datasets, see get_storage_kwargs
+    columns : dict
+        Storage options for particular datasets, overriding
+        the default ones
+    precision : dict
+        Precision policy for particular datasets, see apply_precision.
+        The achieved maximum relative error is stored in the
+        attribute 'max_rel_error' of the dataset.
+    dtypes : dict
+        Type of particular datasets, see cast_dtype
+    chunk_rows : int
+        Maximum number of rows per chunk of the extendable datasets
+        without chunks set in their storage options, which otherwise
+        take chunks of resizable_chunk_bytes
+
+    Examples
+    --------
+    >>> with GneWriter('gne_input.hdf5') as writer:
+    ...     writer.set_header('h0', 0.7)
+    ...     writer.write('mhhalo', vals, 'Msun/h')
+    """
+    # Number of times an output file has been opened (for benchmarks)
+    nopens = 0
+
+    def __init__(self, outfile, mode='w', resizable=False, storage=None,
+                 columns=None, precision=None, dtypes=None, chunk_rows=None):
+        self.outfile = outfile
+        self.mode = mode
+        self.resizable = resizable
+        self.storage = storage
+        self.columns = columns if columns is not None else {}
+        self.precision = precision if precision is not None else {}
+        self.dtypes = dtypes if dtypes is not None else {}
+        self.chunk_rows = chunk_rows
+        self.hf = None
+        self.header = {}
+
+    def open(self):
+        """Open the output file and generate the header and data group"""
+        self.hf = h5py.File(self.outfile, self.mode)
+        GneWriter.nopens += 1
+        if 'header' not in self.hf:
+            self.hf.create_dataset('header', (), dtype='f4')
+        if 'data' not in self.hf:
+            self.hf.create_group('data')
+        return self
+
+    def set_header(self, key, value):
+        """Buffer an attribute to be stored in the header"""
+        self.header[key] = value
+
+    def set_manifest(self, manifest):
+        """
+        Store the manifest of the file, see src.manifest.get_manifest.
+        This should be called once all the data have been written,
+        so that incomplete files do not have a manifest, and it
+        removes the progress record.
+        """
+        if 'manifest' in self.hf:
+            del self.hf['manifest']
+        if 'progress' in self.hf:
+            del self.hf['progress']
+        group = self.hf.create_group('manifest')
+        for key, value in manifest.items():
+            group.attrs[key] = value
+
+    def set_progress(self, manifest, next_row, nsel):
+        """
+        Commit the progress of a file being written in blocks of rows:
+        the data are flushed to disk and a progress record is stored,
+        from which an interrupted run can be resumed
+
+        Parameters
+        ----------
+        manifest : dict
+            Manifest of the inputs, see src.manifest.get_manifest
+        next_row : int
+            First input row not processed yet
+        nsel : int
+            Number of rows written in the output datasets
+        """
+        self.hf.flush()
+        if 'progress' not in self.hf:
+            self.hf.create_group('progress')
+        attrs = self.hf['progress'].attrs
+        for key, value in manifest.items():
+            attrs[key] = value
+        attrs['datasets'] = json.dumps(sorted(self.hf['data']))
+        attrs['nsel'] = nsel
+        attrs['next_row'] = next_row
+        self.hf.flush()
+
+    def truncate(self, nsel):
+        """Resize all datasets to nsel rows, discarding uncommitted ones"""
+        for dd in self.hf['data'].values():
+            if dd.shape[0] > nsel:
+                dd.resize(nsel, axis=0)
+
+    def write(self, name, vals, units):
+        """
+        Write a dataset within the data group
+
+        Parameters
+        ----------
+        name : str
+            Name of the dataset
+        vals : numpy array
+            Values to be stored
+        units : str
+            Units, stored as an attribute of the dataset
+        """
+        vals = cast_dtype(vals, self.dtypes.get(name))
+        vals, pkwargs, err = apply_precision(vals, self.precision.get(name))
+        kwargs = self._get_kwargs(name, len(vals), vals.dtype)
+        if 'scaleoffset' in pkwargs and len(vals) > 0:
+            kwargs.update(pkwargs)
+        if self.resizable:
+            dd = self.hf['data'].create_dataset(name, data=vals,
+                                                maxshape=(None,), **kwargs)
+        else:
+            dd = self.hf['data'].create_dataset(name, data=vals, **kwargs)
+        dd.attrs['units'] = units
+        self._set_error(dd, name, err)
+        return dd
+
+    def _get_kwargs(self, name, nrows, dtype):
+        """Arguments to create a dataset with its storage options"""
+        storage = self.columns.get(name, self.storage)
+        kwargs = get_storage_kwargs(storage, nrows=nrows,
+                                    resizable=self.resizable)
+        # Otherwise h5py sizes the chunks from the first block appended
+        if self.resizable and kwargs.get('chunks') in (None, True):
+            chunks = resizable_chunk_bytes//dtype.itemsize
+            if self.chunk_rows is not None:
+                chunks = min(chunks, self.chunk_rows)
+            kwargs['chunks'] = (max(chunks, 1),)
+        return kwargs
+
+    def _set_error(self, dd, name, err):
+        """Keep track of the maximum relative error of a dataset"""
+        if err is None:
+            return
+        dd.attrs['precision'] = self.precision[name]
+        dd.attrs['max_rel_error'] = max(err, dd.attrs.get('max_rel_error', 0.))
+
+    def append(self, name, vals, units):
+        """
+        Append a block of rows to a dataset, creating it if needed
+
+        Parameters
+        ----------
+        name : str
+            Name of the dataset
+        vals : numpy array
+            Values to be appended
+        units : str
+            Units, stored as an attribute of the dataset
+        """
+        data = self.hf['data']
+        if name not in data:
+            return self.write(name, vals, units)
+        dd = data[name]
+        vals = cast_dtype(vals, self.dtypes.get(name))
+        vals, pkwargs, err = apply_precision(vals, self.precision.get(name))
+        nrows = dd.shape[0]
+        dd.resize(nrows + len(vals), axis=0)
+        dd[nrows:] = vals
+        self._set_error(dd, name, err)
+        return dd
+
+    def write_at(self, name, vals, units, offset, nrows):
+        """
+        Write a block of rows at a given offset of a dataset,
+        creating it with the total number of rows if needed
+
+        Parameters
+        ----------
+        name : str
+            Name of the dataset
+        vals : numpy array
+            Values to be written
+        units : str
+            Units, stored as an attribute of the dataset
+        offset : int
+            First row of the dataset to be written
+        nrows : int
+            Total number of rows of the dataset
+        """
+        data = self.hf['data']
+        vals = cast_dtype(vals, self.dtypes.get(name))
+        vals, pkwargs, err = apply_precision(vals, self.precision.get(name))
+        if name not in data:
+            kwargs = self._get_kwargs(name, nrows, vals.dtype)
+            kwargs.update(pkwargs)
+            dd = data.create_dataset(name, shape=(nrows,) + vals.shape[1:],
+                                     dtype=vals.dtype, **kwargs)
+            dd.attrs['units'] = units
+        dd = data[name]
+        dd[offset:offset + len(vals)] = vals
+        self._set_error(dd, name, err)
+        return dd
+
+    def close(self):
+        """Flush the buffered header attributes and close the file"""
+        if self.hf is None:
+            return
+        head = self.hf['header']
+        for key, value in self.header.items():
+            head.attrs[key] = value
+        self.header = {}
+        self.hf.close()
+        self.hf = None
+
+    def __enter__(self):
+        if self.hf is None:
+            self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,73 @@
+# python -m unittest tests/test_cache.py
+
+import unittest
+import tempfile
+import shutil
+import os
+import h5py
+import numpy as np
+
+from src.cache import ColumnCache, CachedGroup
+import src.utils as u
+
+class TestColumnCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.test_dir, 'galaxies.hdf5')
+        with h5py.File(self.filename, 'w') as f:
+            f.create_dataset('mhhalo', data=np.arange(1000.))
+            f.create_dataset('xgal', data=np.arange(1000.)/10.)
+        self.hf = h5py.File(self.filename, 'r')
+
+    def tearDown(self):
+        self.hf.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_subsets(self):
+        cache = ColumnCache()
+        group = CachedGroup(self.hf, 'galaxies.hdf5', cache)
+        key = ('galaxies.hdf5', 'mhhalo')
+        rows = np.arange(100, 200, 3)
+
+        # Full block, then subsets of it
+        vals = u.read_column(group, 'mhhalo', None, 100, 200)
+        np.testing.assert_array_equal(vals, np.arange(100., 200.))
+        vals = u.read_column(group, 'mhhalo', rows, 100, 200)
+        np.testing.assert_array_equal(vals, rows)
+        vals = u.read_column(group, 'mhhalo', rows[::2], 100, 200)
+        np.testing.assert_array_equal(vals, rows[::2])
+        self.assertEqual(cache.nreads[key], 1)
+        self.assertEqual(cache.nhits, 2)
+
+        # Subset of subset, but not a superset
+        cache.clear()
+        u.read_column(group, 'mhhalo', rows, 100, 200)
+        u.read_column(group, 'mhhalo', rows[1:5], 100, 200)
+        self.assertEqual(cache.nreads[key], 2)
+        vals = u.read_column(group, 'mhhalo', rows + 1, 100, 201)
+        np.testing.assert_array_equal(vals, rows + 1)
+        self.assertEqual(cache.nreads[key], 3)
+
+        # Entries of previous blocks are dropped
+        u.read_column(group, 'xgal', None, 300, 400)
+        self.assertNotIn(key, cache.entries)
+
+    def test_budget(self):
+        cache = ColumnCache(budget=1000)
+        group = CachedGroup(self.hf, 'galaxies.hdf5', cache)
+        u.read_column(group, 'mhhalo', None, 0, 100)
+        u.read_column(group, 'xgal', None, 0, 100)
+        self.assertEqual(list(cache.entries), [('galaxies.hdf5', 'xgal')])
+        self.assertLessEqual(cache.nbytes, 1000)
+        u.read_column(group, 'xgal', None, 0, 1000)
+        self.assertEqual(cache.nbytes, 0)
+
+        cache = ColumnCache(budget=0)
+        group = CachedGroup(self.hf, 'galaxies.hdf5', cache)
+        for ii in range(2):
+            u.read_column(group, 'mhhalo', None, 0, 10)
+        self.assertEqual(cache.nreads[('galaxies.hdf5', 'mhhalo')], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
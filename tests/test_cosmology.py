@@ -0,0 +1,214 @@
+"""Tests for src/cosmology.py"""
+
+import unittest
+import tempfile
+import shutil
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import numpy as np
+
+import src.cosmology as cosmo
+
+class TestCosmology(unittest.TestCase):
+    """Test the comoving distance table"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_dir = cosmo.cache_dir
+        cosmo.cache_dir = os.path.join(self.test_dir, 'cache')
+        cosmo.table_cache.clear()
+
+    def tearDown(self):
+        cosmo.cache_dir = self.cache_dir
+        cosmo.table_cache.clear()
+        shutil.rmtree(self.test_dir)
+
+    def romberg_table(self, zz):
+        table = np.zeros(len(zz))
+        for i in range(1, len(zz)):
+            table[i] = table[i-1] + cosmo.romberg(cosmo.f, zz[i-1], zz[i])
+        return table
+
+    def test_comoving_table(self):
+        for params in [(0.3089, 0.0486, 0.6911, 0.6774),
+                       (0.3, 0.05, 0., 0.7)]:
+            cosmo.set_cosmology(*params)
+            zz = cosmo.redshift[:2001]
+            expected = self.romberg_table(zz)
+            np.testing.assert_allclose(cosmo.comoving_table(zz), expected,
+                                       rtol=1e-10, atol=0)
+            np.testing.assert_allclose(cosmo.r_comoving[:2001], expected,
+                                       rtol=1e-10, atol=0)
+
+            # Coarser and uneven grids
+            zz = np.array([0., 0.01, 0.1, 0.5, 1., 3.])
+            np.testing.assert_allclose(cosmo.comoving_table(zz, npoints=8),
+                                       self.romberg_table(zz), rtol=1e-8)
+
+    def test_table_cache(self):
+        build = patch.object(cosmo, 'comoving_table',
+                             wraps=cosmo.comoving_table)
+        with build as table:
+            cosmo.set_Planck15()
+            r1 = cosmo.r_comoving.copy()
+            cosmo.set_Planck13()
+            cosmo.set_Planck15()
+            self.assertEqual(table.call_count, 2)
+            np.testing.assert_array_equal(cosmo.r_comoving, r1)
+
+            # Stored on disk, for other processes
+            cosmo.table_cache.clear()
+            cosmo.set_Planck15()
+            self.assertEqual(table.call_count, 2)
+            np.testing.assert_array_equal(cosmo.r_comoving, r1)
+            files = os.listdir(cosmo.cache_dir)
+            self.assertEqual(len(files), 2)
+            self.assertTrue(all(name.endswith('.npy') for name in files))
+            for name in files:
+                mode = os.stat(os.path.join(cosmo.cache_dir, name)).st_mode
+                self.assertEqual(mode & 0o777, 0o666 & ~cosmo.umask)
+
+            # Least recently used tables dropped from memory
+            cosmo.table_cache_size = 1
+            try:
+                cosmo.set_Planck13()
+                self.assertEqual(len(cosmo.table_cache), 1)
+            finally:
+                cosmo.table_cache_size = 8
+
+            # Damaged files are rebuilt, and the cache can be disabled
+            cosmo.table_cache.clear()
+            for name in files:
+                with open(os.path.join(cosmo.cache_dir, name), 'wb') as ff:
+                    ff.write(b'partial')
+            cosmo.set_Planck15()
+            self.assertEqual(table.call_count, 3)
+            np.testing.assert_array_equal(cosmo.r_comoving, r1)
+            cosmo.cache_dir = None
+            cosmo.table_cache.clear()
+            cosmo.set_Planck15()
+            self.assertEqual(table.call_count, 4)
+
+        # Tables built and dropped from several threads at once
+        params = [(0.25 + 0.01*i, 0.045, 0.75 - 0.01*i, 0.7)
+                  for i in range(6)]
+        cosmo.table_cache_size = 2
+        try:
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                models = list(pool.map(lambda args: cosmo.Cosmology(*args),
+                                       params*4))
+            self.assertEqual(len(cosmo.table_cache), 2)
+        finally:
+            cosmo.table_cache_size = 8
+        for model in models[:6]:
+            np.testing.assert_array_equal(
+                model.r_comoving,
+                cosmo.comoving_table(cosmo.redshift, cosmology=model))
+
+    def test_instances(self):
+        planck15 = cosmo.Cosmology(0.3089, 0.0486, 0.6911, 0.6774)
+        open_model = cosmo.Cosmology(0.3, 0.05, 0., 0.7)
+        self.assertFalse(planck15.r_comoving.flags.writeable)
+        self.assertGreater(open_model.WK, 0.)
+
+        # Module functions use the cosmology that has been set
+        cosmo.set_Planck15()
+        z = np.array([0.1, 1., 3.])
+        np.testing.assert_array_equal(cosmo.luminosity_distance(z),
+                                      planck15.luminosity_distance(z))
+        self.assertEqual(cosmo.get_cosmology().get_table_key(),
+                         planck15.get_table_key())
+        self.assertEqual(cosmo.WK, planck15.WK)
+
+        # Thread-safe use of different cosmologies
+        models = [planck15, open_model]*8
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            dist = list(pool.map(lambda model: model.comoving_distance(z),
+                                 models))
+        for model, vals in zip(models, dist):
+            np.testing.assert_array_equal(vals, model.comoving_distance(z))
+
+        # Pickled without the table
+        data = pickle.dumps(planck15)
+        self.assertLess(len(data), 1000)
+        copy = pickle.loads(data)
+        self.assertEqual(copy.band_corrected_distance_modulus(0.5),
+                         planck15.band_corrected_distance_modulus(0.5))
+
+    def test_distances(self):
+        cosmo.set_Planck15()
+        self.assertAlmostEqual(cosmo.comoving_distance(0.), 0.)
+        r = cosmo.comoving_distance(1.)
+        self.assertAlmostEqual(cosmo.redshift_at_distance(r), 1., places=8)
+        self.assertAlmostEqual(cosmo.luminosity_distance(1.), 2*r, places=6)
+
+    def test_uniform_lookup(self):
+        model = cosmo.Cosmology(0.3089, 0.0486, 0.6911, 0.6774)
+        z = np.array([-1., 0., 1e-5, 0.3, 1.23456, 7., cosmo.zmax,
+                      30., np.nan])
+        expected = np.interp(z, cosmo.redshift, model.r_comoving)
+        np.testing.assert_allclose(model.comoving_distance(z), expected,
+                                   rtol=1e-12, atol=0.)
+        self.assertTrue(np.isnan(model.comoving_distance(z)[-1]))
+
+        r = np.concatenate([expected, model.r_comoving[[0, 1, 777, -1]],
+                            np.linspace(-10., 1.1*expected[-2], 100001)])
+        zr = model.redshift_at_distance(r)
+        np.testing.assert_allclose(zr, np.interp(r, model.r_comoving,
+                                                 cosmo.redshift),
+                                   rtol=1e-14, atol=1e-15)
+        self.assertTrue(np.isnan(zr[len(expected) - 1]))
+        self.assertEqual(zr[-1], model.redshift_at_distance(r[-1]))
+        self.assertIsNone(pickle.loads(pickle.dumps(model)).z_comoving)
+
+        z = np.array([0.00001, 0.1, 2.])
+        np.testing.assert_allclose(
+            model.band_corrected_distance_modulus(z),
+            [model.band_corrected_distance_modulus(zz) for zz in z],
+            rtol=1e-12)
+
+    def test_exact(self):
+        exact = cosmo.Cosmology(0.3089, 0.0486, 0.6911, 0.6774, exact=True)
+        self.assertTrue(exact.exact)
+        self.assertIsNone(exact.r_comoving)
+
+        # Closed form against a Gauss-Legendre quadrature
+        x, w = np.polynomial.legendre.leggauss(50)
+        z = np.array([1e-9, 1e-4, 0.3, 2., 19.99, 50.])
+        quad = np.array([0.5*zz*np.sum(w*exact.f(0.5*zz*(x + 1.)))
+                         for zz in z])
+        dist = exact.comoving_distance(z)
+        np.testing.assert_allclose(dist[:3], quad[:3], rtol=1e-14)
+        np.testing.assert_allclose(dist, quad, rtol=1e-9)
+        self.assertEqual(exact.comoving_distance(0.), 0.)
+        self.assertTrue(np.isnan(exact.comoving_distance([np.nan])[0]))
+
+        table = cosmo.Cosmology(0.3089, 0.0486, 0.6911, 0.6774)
+        np.testing.assert_allclose(exact.luminosity_distance(z[2:5]),
+                                   table.luminosity_distance(z[2:5]),
+                                   rtol=1e-12)
+        np.testing.assert_allclose(exact.redshift_at_distance(dist), z,
+                                   rtol=1e-14)
+        self.assertIsNone(pickle.loads(pickle.dumps(exact)).r_comoving)
+
+        # No table built for the module functions either
+        with patch.object(cosmo, 'get_comoving_table') as build:
+            cosmo.set_cosmology(0.3089, 0.0486, 0.6911, 0.6774, exact=True)
+            self.assertEqual(cosmo.comoving_distance(0.3), dist[2])
+            build.assert_not_called()
+        self.assertTrue(np.isnan(cosmo.r_comoving).all())
+        cosmo.set_Planck15()
+        np.testing.assert_array_equal(cosmo.r_comoving, table.r_comoving)
+
+        # Only for flat cosmologies without radiation
+        with patch('builtins.print'):
+            self.assertFalse(cosmo.Cosmology(0.3, 0.05, 0., 0.7,
+                                             exact=True).exact)
+            self.assertFalse(cosmo.Cosmology(include_radiation=True,
+                                             exact=True).exact)
+
+
+if __name__ == '__main__':
+    unittest.main()
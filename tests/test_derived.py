@@ -0,0 +1,74 @@
+# python -m unittest tests/test_derived.py
+
+import unittest
+from unittest.mock import patch
+import numpy as np
+
+import src.derived as der
+from src.derived import DerivedColumn, DerivedEngine
+from src.derived import divide_positive, add_constant
+
+class TestDerived(unittest.TestCase):
+    def setUp(self):
+        self.mcold = np.array([0., 2., 4., -1.])
+        self.metals = np.array([1., 0.2, 0.1, 3.])
+
+    def test_divide_positive(self):
+        out = np.empty(4)
+        divide_positive(out, self.metals, self.mcold)
+        np.testing.assert_array_equal(out, [0., 0.1, 0.025, 0.])
+        out = np.empty(4, dtype=np.float32)
+        divide_positive(out, self.metals, self.mcold, fill=-999.)
+        np.testing.assert_allclose(out, [-999., 0.1, 0.025, -999.])
+
+    def test_order_and_release(self):
+        square = lambda out, vals: np.multiply(vals, vals, out=out)
+        engine = DerivedEngine([
+            DerivedColumn('Z2', ['Zgas_disc'], square, 'M_Z/M squared'),
+            DerivedColumn('Zgas_disc', ['cold_metal', 'mcold'],
+                          divide_positive, 'M_Z/M'),
+            DerivedColumn('mag', ['mag'], add_constant, 'AB apparent',
+                          dtype='input', params={'constant': 'tomag'})])
+        self.assertEqual([col.name for col in engine.order],
+                         ['Zgas_disc', 'mag', 'Z2'])
+        self.assertEqual(sorted(engine.inputs), ['cold_metal', 'mag', 'mcold'])
+
+        values = {'mcold': self.mcold, 'cold_metal': self.metals,
+                  'mag': np.arange(4, dtype=np.float32)}
+        derived = engine.evaluate(values, dtype=np.float32,
+                                  params={'tomag': 10.}, keep=['mcold'])
+        self.assertEqual(list(values), ['mcold'])
+        self.assertEqual(derived['Zgas_disc'].dtype, np.float32)
+        np.testing.assert_allclose(derived['Z2'], [0., 0.01, 0.025**2, 0.],
+                                   rtol=1e-6)
+        self.assertEqual(derived['mag'].dtype, np.float32)
+        np.testing.assert_array_equal(derived['mag'], np.arange(4) + 10.)
+
+    def test_subset(self):
+        square = lambda out, vals: np.multiply(vals, vals, out=out)
+        engine = DerivedEngine([
+            DerivedColumn('Z2', ['Zgas_disc'], square, 'M_Z/M squared'),
+            DerivedColumn('Zgas_disc', ['cold_metal', 'mcold'],
+                          divide_positive, 'M_Z/M'),
+            DerivedColumn('mag', ['mag'], add_constant, 'AB apparent',
+                          dtype='input', params={'constant': 'tomag'})])
+        sub = engine.subset(['Z2'])
+        self.assertEqual([col.name for col in sub.order], ['Zgas_disc', 'Z2'])
+        self.assertEqual(sorted(sub.inputs), ['cold_metal', 'mcold'])
+        self.assertEqual(engine.subset(['mag']).inputs, ['mag'])
+
+    def test_cycle(self):
+        copy = lambda out, vals: np.copyto(out, vals)
+        with self.assertRaises(ValueError):
+            DerivedEngine([DerivedColumn('a', ['b'], copy, ''),
+                           DerivedColumn('b', ['a'], copy, '')])
+
+    def test_without_numexpr(self):
+        with patch.object(der, 'ne', None):
+            out = np.empty(4)
+            divide_positive(out, self.metals, self.mcold)
+            np.testing.assert_array_equal(out, [0., 0.1, 0.025, 0.])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,496 @@
+# python -m unittest tests/test_generate_input.py
+
+import unittest
+import tempfile
+import shutil
+import os
+import copy
+import io
+import h5py
+import numpy as np
+
+from unittest.mock import patch
+from contextlib import ExitStack, redirect_stdout
+
+import src.generate_input as gi
+import src.cosmology as cosmo
+from src.generate_input import generate_input_file, add_columns
+from src.manifest import is_up_to_date, read_manifest
+from src.manifest import get_manifest, get_checkpoint
+from src.writer import GneWriter
+from src.index import build_index
+
+class TestGenerateInput(unittest.TestCase):
+    """Test the generation of input files"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_dir = cosmo.cache_dir
+        cosmo.cache_dir = os.path.join(self.test_dir, 'cosmology')
+        self.input_dir = os.path.join(self.test_dir, 'input', '0')
+        os.makedirs(self.input_dir)
+        self.n_galaxies = 1000
+
+        rng = np.random.default_rng(7)
+        self.mhhalo = 10**rng.uniform(9, 13, self.n_galaxies)
+        self.xgal = rng.uniform(-10, 110, self.n_galaxies)
+        self.mcold = 10**rng.uniform(7, 10, self.n_galaxies)
+        self.mcold[::10] = 0.
+        self.cold_metal = self.mcold*rng.uniform(0.001, 0.03, self.n_galaxies)
+        self.L = 10**rng.uniform(-1, 2, self.n_galaxies)
+        self.L[::7] = 0.
+        self.L_ext = self.L*rng.uniform(0.1, 1., self.n_galaxies)
+
+        with h5py.File(os.path.join(self.input_dir, 'galaxies.hdf5'), 'w') as f:
+            grp = f.create_group('Output001')
+            grp.create_dataset('redshift', data=0.5)
+            grp.create_dataset('mhhalo', data=self.mhhalo)
+            grp.create_dataset('xgal', data=self.xgal)
+            grp.create_dataset('type', data=rng.integers(0, 2, self.n_galaxies))
+            grp.create_dataset('mcold', data=self.mcold)
+            grp.create_dataset('cold_metal', data=self.cold_metal)
+        with h5py.File(os.path.join(self.input_dir, 'tosedfit.hdf5'), 'w') as f:
+            grp = f.create_group('Output001')
+            grp.create_dataset('L_tot_Halpha', data=self.L)
+            grp.create_dataset('L_tot_Halpha_ext', data=self.L_ext)
+
+        self.config = {
+            'root': os.path.join(self.test_dir, 'input', ''),
+            'outroot': os.path.join(self.test_dir, 'output', ''),
+            'h0': 0.7, 'omega0': 0.3, 'omegab': 0.05, 'lambda0': 0.7,
+            'boxside': 100.0, 'mp': 1e9, 'snap': 39,
+            'mcold_disc': 'mcold', 'mcold_z_disc': 'cold_metal',
+            'mcold_burst': 'mcold_burst', 'mcold_z_burst': 'metals_burst',
+            'lines': ['Halpha'], 'line_prefix': 'L_tot_',
+            'line_suffix_ext': '_ext',
+            'selection': {
+                'galaxies.hdf5': {
+                    'group': 'Output001',
+                    'datasets': ['mhhalo', 'xgal'],
+                    'units': ['Msun/h', 'Mpc/h'],
+                    'low_limits': [1e11, 0.],
+                    'high_limits': [None, 100.]
+                }
+            },
+            'file_props': {
+                'galaxies.hdf5': {
+                    'group': 'Output001',
+                    'datasets': ['redshift', 'type', 'mcold', 'cold_metal'],
+                    'units': ['redshift', 'type', 'Msun/h', 'Msun/h']
+                },
+                'tosedfit.hdf5': {
+                    'group': 'Output001',
+                    'datasets': ['L_tot_Halpha', 'L_tot_Halpha_ext'],
+                    'units': ['1e40 erg/s', '1e40 erg/s']
+                }
+            }
+        }
+        self.outfile = os.path.join(self.test_dir, 'output', '0', 'gne_input.hdf5')
+
+    def tearDown(self):
+        cosmo.cache_dir = self.cache_dir
+        shutil.rmtree(self.test_dir)
+
+    def _read_output(self, config=None):
+        outfile = self.outfile
+        if config is not None:
+            outfile = os.path.join(config['outroot'], '0', 'gne_input.hdf5')
+        with h5py.File(outfile, 'r') as f:
+            data = {key: f['data'][key][:] for key in f['data']}
+            header = dict(f['header'].attrs)
+        return data, header
+
+    def test_full_read(self):
+        self.assertTrue(generate_input_file(self.config, 0))
+        data, header = self._read_output()
+
+        expected = np.where((self.mhhalo >= 1e11) &
+                            (self.xgal >= 0.) & (self.xgal <= 100.))[0]
+        np.testing.assert_array_equal(data['gal_index'], expected)
+        np.testing.assert_array_equal(data['mhhalo'], self.mhhalo[expected])
+        np.testing.assert_array_equal(data['mcold'], self.mcold[expected])
+        self.assertNotIn('cold_metal', data)
+        self.assertEqual(header['redshift'], 0.5)
+
+        mcold = self.mcold[expected]
+        Zdisc = np.zeros(len(expected))
+        Zdisc[mcold > 0] = self.cold_metal[expected][mcold > 0]/mcold[mcold > 0]
+        np.testing.assert_allclose(data['Zgas_disc'], Zdisc, rtol=1e-12)
+
+    def test_expression(self):
+        props = self.config['selection']['galaxies.hdf5']
+        self.assertTrue(generate_input_file(self.config, 0))
+        full, header_full = self._read_output()
+
+        # Expression equivalent to the limits
+        del props['low_limits'], props['high_limits']
+        props['expression'] = 'mhhalo >= 100*mp & 0 <= xgal <= boxside'
+        self.assertTrue(generate_input_file(self.config, 0, chunk_size=128))
+        data, header = self._read_output()
+        for key in full:
+            np.testing.assert_array_equal(data[key], full[key], err_msg=key)
+
+        # Conditions on datasets that are not written
+        props['expression'] += ' & (mcold > 0 | xgal < 50)'
+        self.assertTrue(generate_input_file(self.config, 0))
+        data, header = self._read_output()
+        expected = np.where((self.mhhalo >= 1e11) &
+                            (self.xgal >= 0.) & (self.xgal <= 100.) &
+                            ((self.mcold > 0) | (self.xgal < 50)))[0]
+        np.testing.assert_array_equal(data['gal_index'], expected)
+        self.assertEqual(set(data), set(full))
+
+    def test_derived_selection(self):
+        self.assertTrue(generate_input_file(self.config, 0))
+        full, header_full = self._read_output()
+        keep = (full['Zgas_disc'] > 0.01) & (full['ratio_Halpha'] < 0.5)
+        self.assertTrue(0 < np.count_nonzero(keep) < len(keep))
+
+        props = self.config['selection']['galaxies.hdf5']
+        props['expression'] = ('mhhalo >= 1e11 & 0 <= xgal <= 100 & '
+                               'Zgas_disc > 0.01 & ratio_Halpha < 0.5')
+        for kwargs in [{}, {'chunk_size': 100},
+                       {'chunk_size': 150, 'nworkers': 2},
+                       {'chunk_size': 100, 'pipeline': True}]:
+            self.assertTrue(generate_input_file(self.config, 0, **kwargs))
+            data, header = self._read_output()
+            self.assertEqual(set(data), set(full))
+            for key in full:
+                np.testing.assert_array_equal(data[key], full[key][keep],
+                                              err_msg=f'{key} {kwargs}')
+
+        # The derived quantities are computed only for the candidates
+        with ExitStack() as stack:
+            kernel = stack.enter_context(patch(
+                'src.generate_input.divide_positive', wraps=gi.divide_positive))
+            plan = gi.get_plan(self.config)
+            groups = gi.open_inputs(stack, self.config, 0, plan)
+            rows, seldata, masks = gi.select_block(self.config, groups, 0,
+                                                   self.n_galaxies, plan=plan)
+        nrows = [len(call.args[0]) for call in kernel.call_args_list]
+        self.assertLess(max(nrows), self.n_galaxies//2)
+        np.testing.assert_array_equal(rows, full['gal_index'][keep])
+
+    def test_samples(self):
+        self.assertTrue(generate_input_file(self.config, 0))
+        full, header_full = self._read_output()
+        massive = full['mhhalo'] >= 1e12
+        rich = full['Zgas_disc'] > 0.02
+        keep = massive | rich
+        self.assertTrue(np.count_nonzero(massive & rich) > 0)
+
+        props = self.config['selection']['galaxies.hdf5']
+        props['samples'] = {'massive': 'mhhalo >= 1e12',
+                            'rich': 'Zgas_disc > 0.02'}
+        for kwargs in [{}, {'chunk_size': 100},
+                       {'chunk_size': 150, 'nworkers': 2},
+                       {'chunk_size': 100, 'pipeline': True}]:
+            self.assertTrue(generate_input_file(self.config, 0, **kwargs))
+            data, header = self._read_output()
+            self.assertEqual(set(data),
+                             set(full) | {'sample_massive', 'sample_rich'})
+            for key in full:
+                np.testing.assert_array_equal(data[key], full[key][keep],
+                                              err_msg=f'{key} {kwargs}')
+            np.testing.assert_array_equal(data['sample_massive'], massive[keep])
+            np.testing.assert_array_equal(data['sample_rich'], rich[keep])
+
+        # Each dataset is read, and each sample evaluated, once,
+        # whatever the number of samples
+        props['samples']['poor'] = 'Zgas_disc < 0.005 & mhhalo < 1e12'
+        plan = gi.get_plan(self.config)
+        sample_masks = patch.object(gi, 'get_sample_masks',
+                                    wraps=gi.get_sample_masks)
+        with ExitStack() as stack, sample_masks as evaluate:
+            groups = gi.open_inputs(stack, self.config, 0, plan)
+            block = gi.process_block(self.config, plan, groups, 0,
+                                     self.n_galaxies)
+            cache = groups['galaxies.hdf5'].cache
+        self.assertEqual(evaluate.call_count, 1)
+        self.assertEqual(max(cache.nreads.values()), 1)
+        self.assertIn('sample_poor', block)
+
+    def test_index(self):
+        self.assertTrue(generate_input_file(self.config, 0))
+        full, header_full = self._read_output()
+        self.assertTrue(build_index(self.config, 0))
+        for kwargs in [{}, {'chunk_size': 100},
+                       {'chunk_size': 150, 'nworkers': 2}]:
+            self.assertTrue(generate_input_file(self.config, 0, **kwargs))
+            data, header = self._read_output()
+            for key in full:
+                np.testing.assert_array_equal(data[key], full[key],
+                                              err_msg=f'{key} {kwargs}')
+
+        # The selection datasets are only read at the selected rows
+        plan = gi.get_plan(self.config)
+        with ExitStack() as stack:
+            groups = gi.open_inputs(stack, self.config, 0, plan)
+            self.assertEqual(set(groups['galaxies.hdf5'].index),
+                             {'mhhalo', 'xgal'})
+            rows, seldata, masks = gi.select_block(self.config, groups, 0,
+                                                   self.n_galaxies)
+            entries = groups['galaxies.hdf5'].cache.entries
+            self.assertEqual(len(entries[('galaxies.hdf5', 'mhhalo')][2]),
+                             len(full['gal_index']))
+
+    def test_chunked_matches_full(self):
+        self.assertTrue(generate_input_file(self.config, 0))
+        full, header_full = self._read_output()
+        for chunk_size in [1, 64, 333, 5000]:
+            self.assertTrue(generate_input_file(self.config, 0,
+                                                chunk_size=chunk_size))
+            data, header = self._read_output()
+            self.assertEqual(set(data), set(full))
+            for key in full:
+                np.testing.assert_array_equal(data[key], full[key], err_msg=key)
+            self.assertEqual(header, header_full)
+
+    def test_parallel_matches_full(self):
+        self.assertTrue(generate_input_file(self.config, 0))
+        full, header_full = self._read_output()
+        for chunk_size in [None, 150]:
+            self.assertTrue(generate_input_file(self.config, 0,
+                                                chunk_size=chunk_size,
+                                                nworkers=2))
+            data, header = self._read_output()
+            self.assertEqual(set(data), set(full))
+            for key in full:
+                np.testing.assert_array_equal(data[key], full[key], err_msg=key)
+                self.assertEqual(data[key].dtype, full[key].dtype)
+            self.assertEqual(header, header_full)
+
+    def test_pipeline_matches_full(self):
+        self.assertTrue(generate_input_file(self.config, 0))
+        full, header_full = self._read_output()
+        for chunk_size in [None, 100]:
+            self.assertTrue(generate_input_file(self.config, 0,
+                                                chunk_size=chunk_size,
+                                                pipeline=True))
+            data, header = self._read_output()
+            self.assertEqual(set(data), set(full))
+            for key in full:
+                np.testing.assert_array_equal(data[key], full[key], err_msg=key)
+            self.assertEqual(header, header_full)
+
+    def test_precision(self):
+        self.assertTrue(generate_input_file(self.config, 0))
+        full, header_full = self._read_output()
+        self.config['selection']['galaxies.hdf5']['precision'] = [None, None]
+        self.config['file_props']['tosedfit.hdf5']['precision'] = ['float32',
+                                                                    None]
+        self.assertTrue(generate_input_file(self.config, 0))
+        data, header = self._read_output()
+        for key in ['gal_index', 'mhhalo', 'xgal', 'mcold']:
+            np.testing.assert_array_equal(data[key], full[key], err_msg=key)
+        for key in ['L_tot_Halpha', 'ratio_Halpha']:
+            self.assertEqual(data[key].dtype, np.float32)
+            np.testing.assert_allclose(data[key], full[key], rtol=1e-7)
+        with h5py.File(self.outfile, 'r') as f:
+            self.assertEqual(f['data/L_tot_Halpha'].attrs['precision'],
+                             'float32')
+            self.assertLess(f['data/L_tot_Halpha'].attrs['max_rel_error'], 1e-7)
+
+    def test_dtypes(self):
+        self.config['dtypes'] = {'type': 'int8', 'derived': 'float32'}
+        for nworkers in [1, 2]:
+            self.assertTrue(generate_input_file(self.config, 0,
+                                                nworkers=nworkers))
+            data, header = self._read_output()
+            self.assertEqual(data['gal_index'].dtype, np.uint16)
+            self.assertEqual(data['type'].dtype, np.int8)
+            self.assertEqual(data['Zgas_disc'].dtype, np.float32)
+            self.assertEqual(data['ratio_Halpha'].dtype, np.float32)
+            self.assertEqual(data['mcold'].dtype, np.float64)
+
+        # Smallest type fitting the values, kept for floats
+        self.config['dtypes'] = {'type': 'narrowest', 'mcold': 'narrowest'}
+        for kwargs in [{}, {'chunk_size': 100}, {'nworkers': 2}]:
+            self.assertTrue(generate_input_file(self.config, 0, **kwargs))
+            data, header = self._read_output()
+            self.assertEqual(data['type'].dtype, np.uint8)
+            self.assertEqual(data['mcold'].dtype, np.float64)
+        with h5py.File(os.path.join(self.input_dir, 'galaxies.hdf5'), 'a') as f:
+            f['Output001/type'][-1] = -40000
+        self.assertTrue(generate_input_file(self.config, 0, chunk_size=100))
+        data, header = self._read_output()
+        self.assertEqual(data['type'].dtype, np.int32)
+
+    def test_manifest(self):
+        self.assertFalse(is_up_to_date(self.config, 0))
+        self.assertTrue(generate_input_file(self.config, 0))
+        self.assertTrue(is_up_to_date(self.config, 0))
+
+        # Changes in the configuration
+        config = dict(self.config, lines=['Hbeta'])
+        self.assertFalse(is_up_to_date(config, 0))
+        config = dict(self.config, outroot=self.config['outroot'])
+        self.assertTrue(is_up_to_date(config, 0))
+
+        # Changes in an input file
+        infile = os.path.join(self.input_dir, 'tosedfit.hdf5')
+        stat = os.stat(infile)
+        os.utime(infile, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertFalse(is_up_to_date(self.config, 0))
+        self.assertTrue(generate_input_file(self.config, 0))
+        self.assertTrue(is_up_to_date(self.config, 0))
+
+        # Incomplete files have no manifest
+        self.config['file_props']['tosedfit.hdf5']['datasets'][1] = 'missing'
+        with self.assertRaises(KeyError):
+            generate_input_file(self.config, 0)
+        self.assertIsNone(read_manifest(self.outfile))
+
+    def test_add_columns(self):
+        self.assertTrue(generate_input_file(self.config, 0))
+        full, header_full = self._read_output()
+
+        config = dict(self.config)
+        config['file_props'] = {'galaxies.hdf5': {
+            'group': 'Output001',
+            'datasets': ['redshift', 'type', 'mcold'],
+            'units': ['redshift', 'type', 'Msun/h']}}
+        self.assertTrue(generate_input_file(config, 0))
+        self.assertNotIn('Zgas_disc', self._read_output()[0])
+
+        # The selection is not evaluated again
+        for chunk_size in [None, 100]:
+            with patch('src.generate_input.apply_selection',
+                       side_effect=AssertionError):
+                self.assertTrue(add_columns(self.config, 0,
+                                            chunk_size=chunk_size))
+            data, header = self._read_output()
+            self.assertEqual(set(data), set(full))
+            for key in full:
+                np.testing.assert_array_equal(data[key], full[key], err_msg=key)
+            self.assertEqual(header, header_full)
+            self.assertTrue(is_up_to_date(self.config, 0))
+            self.assertTrue(generate_input_file(config, 0))
+
+        # Not updated after a change of the selection
+        newconfig = copy.deepcopy(self.config)
+        newconfig['selection']['galaxies.hdf5']['low_limits'][0] = 1e12
+        before = self._read_output()[0]
+        self.assertFalse(add_columns(newconfig, 0))
+        self.assertFalse(is_up_to_date(newconfig, 0))
+        self.assertEqual(set(self._read_output()[0]), set(before))
+        newconfig['mp'] = 2e9
+        self.assertFalse(add_columns(newconfig, 0))
+        config['mp'] = 2e9
+        self.assertTrue(generate_input_file(config, 0))
+        self.assertTrue(add_columns(dict(self.config, mp=2e9), 0))
+
+    def test_add_columns_empty(self):
+        # No galaxy passing the selection
+        self.config['selection']['galaxies.hdf5']['low_limits'][0] = 1e15
+        config = copy.deepcopy(self.config)
+        config['file_props'] = {'galaxies.hdf5': {
+            'group': 'Output001', 'datasets': ['type'], 'units': ['type']}}
+        self.assertTrue(generate_input_file(config, 0))
+        self.assertTrue(add_columns(self.config, 0))
+        data = self._read_output()[0]
+        self.assertTrue(all(len(vals) == 0 for vals in data.values()))
+        self.assertTrue(is_up_to_date(self.config, 0))
+
+    def test_resume(self):
+        self.assertTrue(generate_input_file(self.config, 0))
+        full, header_full = self._read_output()
+        set_progress = GneWriter.set_progress
+        for pipeline in [False, True]:
+            # Job killed while committing the 4th block of rows
+            ncalls = [0]
+            def killed(writer, *args):
+                ncalls[0] += 1
+                if ncalls[0] == 4:
+                    raise RuntimeError('killed')
+                set_progress(writer, *args)
+            with patch.object(GneWriter, 'set_progress', killed):
+                with self.assertRaises(RuntimeError):
+                    generate_input_file(self.config, 0, chunk_size=100,
+                                        pipeline=pipeline)
+            manifest = get_manifest(self.config, 0)
+            self.assertEqual(get_checkpoint(self.outfile, manifest)[0], 300)
+            self.assertIsNone(read_manifest(self.outfile))
+
+            # Only the remaining blocks are processed
+            with patch('src.generate_input.read_selection',
+                       wraps=gi.read_selection) as mock:
+                self.assertTrue(generate_input_file(self.config, 0,
+                                                    chunk_size=100,
+                                                    pipeline=pipeline))
+            self.assertEqual(mock.call_count, 7)
+            data, header = self._read_output()
+            self.assertEqual(set(data), set(full))
+            for key in full:
+                np.testing.assert_array_equal(data[key], full[key], err_msg=key)
+            self.assertEqual(header, header_full)
+            self.assertTrue(is_up_to_date(self.config, 0))
+            with h5py.File(self.outfile, 'r') as f:
+                self.assertNotIn('progress', f)
+
+    def test_columns_read_once(self):
+        self.config['file_props']['galaxies.hdf5']['datasets'].append('xgal')
+        self.config['file_props']['galaxies.hdf5']['units'].append('Mpc/h')
+        plan = gi.get_plan(self.config)
+        with ExitStack() as stack:
+            groups = gi.open_inputs(stack, self.config, 0, plan)
+            block = gi.process_block(self.config, plan, groups, 0,
+                                     self.n_galaxies)
+            cache = groups['galaxies.hdf5'].cache
+        self.assertEqual(max(cache.nreads.values()), 1)
+        self.assertGreater(cache.nhits, 0)
+        np.testing.assert_array_equal(block['xgal'][0],
+                                      self.xgal[block['gal_index'][0]])
+
+    def test_generate_snapshots(self):
+        # Second snapshot in the same files
+        with h5py.File(os.path.join(self.input_dir, 'galaxies.hdf5'), 'a') as f:
+            f.copy('Output001', 'Output002')
+            f['Output002/mhhalo'][:] = self.mhhalo[::-1]
+            del f['Output002/redshift']
+            f['Output002/redshift'] = 1.
+        with h5py.File(os.path.join(self.input_dir, 'tosedfit.hdf5'), 'a') as f:
+            f.copy('Output001', 'Output002')
+        config2 = copy.deepcopy(self.config)
+        config2['outroot'] = os.path.join(self.test_dir, 'output2', '')
+        for props in (list(config2['selection'].values()) +
+                      list(config2['file_props'].values())):
+            props['group'] = 'Output002'
+        configs = {1: self.config, 2: config2}
+
+        expected = {}
+        for snap, config in configs.items():
+            self.assertTrue(generate_input_file(config, 0))
+            expected[snap] = self._read_output(config)
+
+        for snap, config in configs.items():
+            os.remove(os.path.join(config['outroot'], '0', 'gne_input.hdf5'))
+        with patch('src.generate_input.h5py.File', wraps=h5py.File) as mock:
+            self.assertTrue(gi.generate_snapshots(configs, 0))
+        opened = [call.args[0] for call in mock.call_args_list]
+        for ifile in ['galaxies.hdf5', 'tosedfit.hdf5']:
+            self.assertEqual(opened.count(os.path.join(self.input_dir, ifile)), 1)
+        for snap, config in configs.items():
+            data, header = self._read_output(config)
+            self.assertEqual(header, expected[snap][1])
+            for key in data:
+                np.testing.assert_array_equal(data[key], expected[snap][0][key])
+        self.assertNotEqual(len(data['gal_index']), len(expected[1][0]['gal_index']))
+
+        # Up-to-date snapshots are skipped
+        with patch('src.generate_input.generate_input_file') as mock:
+            self.assertTrue(gi.generate_snapshots(configs, 0))
+        mock.assert_not_called()
+
+        # Errors reported with the output of the subvolume
+        buf = io.StringIO()
+        with patch('src.generate_input.generate_input_file',
+                   side_effect=ValueError('broken input')), \
+             redirect_stdout(buf):
+            self.assertFalse(gi.generate_snapshots(configs, 0, overwrite=True))
+        self.assertIn('ValueError: broken input', buf.getvalue())
+        self.assertIn('snapshot 2 of ivol0 not generated', buf.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ import h5py
 import numpy as np
 import sys
 
+import src.cosmology as cosmo
 from src.generate_input import generate_input_file
 
 class TestLuminosityRatioCalculation(unittest.TestCase):
@@ -17,6 +18,8 @@ class TestLuminosityRatioCalculation(unittest.TestCase):
         """Set up test fixtures before each test method."""
         # Create temporary directories for input and output
         self.test_dir = tempfile.mkdtemp()
+        self.cache_dir = cosmo.cache_dir
+        cosmo.cache_dir = os.path.join(self.test_dir, 'cosmology')
         self.input_dir = os.path.join(self.test_dir, 'input', '0')
         self.output_dir = os.path.join(self.test_dir, 'output', '0')
         os.makedirs(self.input_dir)
@@ -60,6 +63,7 @@ class TestLuminosityRatioCalculation(unittest.TestCase):
     
     def tearDown(self):
         """Clean up test fixtures after each test method."""
+        cosmo.cache_dir = self.cache_dir
         shutil.rmtree(self.test_dir)
     
     def _create_mock_input_files(self):
@@ -273,6 +277,8 @@ class TestLuminosityRatioEdgeCases(unittest.TestCase):
     def setUp(self):
         """Set up test fixtures"""
         self.test_dir = tempfile.mkdtemp()
+        self.cache_dir = cosmo.cache_dir
+        cosmo.cache_dir = os.path.join(self.test_dir, 'cosmology')
         self.input_dir = os.path.join(self.test_dir, 'input', '0')
         os.makedirs(self.input_dir)
         
@@ -283,6 +289,7 @@ class TestLuminosityRatioEdgeCases(unittest.TestCase):
     
     def tearDown(self):
         """Clean up test fixtures"""
+        cosmo.cache_dir = self.cache_dir
         shutil.rmtree(self.test_dir)
     
     def _create_config(self):
@@ -0,0 +1,119 @@
+"""Tests for src/index.py"""
+
+import unittest
+import tempfile
+import shutil
+import os
+import time
+import h5py
+import numpy as np
+from unittest.mock import patch
+
+import src.utils as u
+from src.selection import Selection, limits_to_expression, apply_selection
+from src.index import SortedIndex, build_index, read_index, get_index_file
+
+class TestIndex(unittest.TestCase):
+    """Test the sorted index of selection columns"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(11)
+        self.ngal = 3000
+        self.mhhalo = 10**rng.uniform(9, 14, self.ngal)
+        self.xgal = rng.uniform(-10, 110, self.ngal).astype(np.float32)
+        self.xgal[::97] = np.nan
+        self.xgal[1::50] = 100.
+        self.infile = os.path.join(self.test_dir, 'input', '0',
+                                   'galaxies.hdf5')
+        os.makedirs(os.path.dirname(self.infile))
+        with h5py.File(self.infile, 'w') as f:
+            grp = f.create_group('Output001')
+            grp.create_dataset('mhhalo', data=self.mhhalo)
+            grp.create_dataset('xgal', data=self.xgal)
+        self.config = {
+            'root': os.path.join(self.test_dir, 'input', ''),
+            'outroot': os.path.join(self.test_dir, 'output', ''),
+            'selection': {'galaxies.hdf5': {
+                'group': 'Output001', 'datasets': ['mhhalo', 'xgal'],
+                'low_limits': [1e12, 0.], 'high_limits': [None, 100.]}}}
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_range_rows(self):
+        index = SortedIndex.from_column(self.xgal)
+        self.assertEqual(index.order.dtype, np.uint16)
+        x = self.xgal
+        cases = [((0., 100.), (x >= 0) & (x <= 100)),
+                 ((0., 100., False, False), (x > 0) & (x < 100)),
+                 ((None, 100.), x <= 100),
+                 ((50., None), x >= 50),
+                 ((None, None), ~np.isnan(x)),
+                 ((100., 100.), x == 100),
+                 ((60., 40.), np.zeros(self.ngal, dtype=bool)),
+                 ((10.000000001, None), x >= 10.000000001)]
+        for args, expected in cases:
+            np.testing.assert_array_equal(index.range_rows(*args),
+                                          np.where(expected)[0],
+                                          err_msg=str(args))
+
+        # Within a range of rows
+        rows = index.range_rows(0., 100., start=1000, stop=2000)
+        expected = np.where((x >= 0) & (x <= 100))[0]
+        np.testing.assert_array_equal(
+            rows, expected[(expected >= 1000) & (expected < 2000)])
+
+    def test_build_and_read(self):
+        self.assertEqual(read_index(self.config, 0, 'galaxies.hdf5'), {})
+        self.assertTrue(build_index(self.config, 0))
+        self.assertTrue(os.path.exists(get_index_file(self.config, 0)))
+        index = read_index(self.config, 0, 'galaxies.hdf5')
+        self.assertEqual(set(index), {'mhhalo', 'xgal'})
+        with h5py.File(get_index_file(self.config, 0), 'r') as hf:
+            np.testing.assert_array_equal(hf[index['mhhalo'].values][:],
+                                          np.sort(self.mhhalo))
+
+        # Each range is resolved once, and blocks are cut out of it
+        blocks = [index['xgal'].range_rows(0., 100., start=start,
+                                           stop=start + 500)
+                  for start in range(0, self.ngal, 500)]
+        self.assertEqual(len(index['xgal'].rows), 1)
+        x = self.xgal
+        np.testing.assert_array_equal(np.concatenate(blocks),
+                                      np.where((x >= 0) & (x <= 100))[0])
+
+        # The index is used in place of the datasets
+        props = self.config['selection']['galaxies.hdf5']
+        alldata = np.vstack((self.mhhalo, self.xgal))
+        expected = u.combined_mask(alldata, props['low_limits'],
+                                   props['high_limits'], verbose=False)
+        selection = Selection(limits_to_expression(props['datasets'],
+                                                   props['low_limits'],
+                                                   props['high_limits']))
+        with h5py.File(self.infile, 'r') as f:
+            with patch.object(u, 'read_column', wraps=u.read_column) as read:
+                rows, vals = apply_selection(f['Output001'], selection, [],
+                                             index=index)
+                np.testing.assert_array_equal(rows, expected)
+                rows, vals = apply_selection(f['Output001'],
+                                             Selection('mhhalo >= 1e15'), [],
+                                             index=index)
+                self.assertIsNone(rows)
+            read.assert_not_called()
+
+        # Stale once the input file changes, or for other groups
+        time.sleep(0.01)
+        with h5py.File(self.infile, 'a') as f:
+            f['Output001/mhhalo'][0] = 1.
+        self.assertEqual(read_index(self.config, 0, 'galaxies.hdf5'), {})
+        self.assertTrue(build_index(self.config, 0,
+                                    columns={'galaxies.hdf5': ['mhhalo']}))
+        self.assertEqual(set(read_index(self.config, 0, 'galaxies.hdf5')),
+                         {'mhhalo'})
+        props['group'] = 'Output002'
+        self.assertEqual(read_index(self.config, 0, 'galaxies.hdf5'), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# python -m unittest tests/test_parallel.py
+
+import unittest
+from unittest.mock import patch
+import tempfile
+import shutil
+import os
+import io
+from contextlib import redirect_stdout, redirect_stderr
+
+import src.parallel as par
+
+def square_is_even(ivol, verbose=False):
+    print(f'ivol{ivol}: start')
+    if ivol == 3:
+        raise ValueError('failing subvolume')
+    print(f'ivol{ivol}: end')
+    return (ivol*ivol) % 2 == 0
+
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_get_nproc(self):
+        with patch.dict(os.environ, {'SLURM_CPUS_PER_TASK': '16'}):
+            self.assertEqual(par.get_nproc(), 16)
+            self.assertEqual(par.get_nproc(4), 4)
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(par.get_nproc(), 1)
+        self.assertEqual(par.get_nproc(0), 1)
+
+    def test_sort_subvols(self):
+        root = os.path.join(self.test_dir, 'ivol')
+        for ivol, size in zip([0, 1, 2], [10, 300, 20]):
+            os.makedirs(root + str(ivol))
+            with open(root + str(ivol) + '/galaxies.hdf5', 'wb') as f:
+                f.write(b'0'*size)
+        config = {'root': root, 'selection': None,
+                  'file_props': {'galaxies.hdf5': {}, 'agn.hdf5': {}}}
+        self.assertEqual(par.sort_subvols(config, [0, 1, 2]), [1, 2, 0])
+
+    def test_run_subvols(self):
+        tasks = {ivol: ((ivol,), {'verbose': True}) for ivol in range(5)}
+        expected = {0: True, 1: False, 2: True, 3: False, 4: True}
+        for nproc in [1, 3]:
+            buf = io.StringIO()
+            with redirect_stdout(buf), redirect_stderr(io.StringIO()):
+                results = par.run_subvols(square_is_even, tasks, nproc=nproc)
+            self.assertEqual(results, expected)
+
+            # Output of each subvolume printed as one block
+            log = buf.getvalue()
+            for ivol in [0, 1, 2, 4]:
+                self.assertIn(f'ivol{ivol}: start\nivol{ivol}: end\n', log)
+        self.assertIn('failing subvolume', log)
+
+
+if __name__ == '__main__':
+    unittest.main()
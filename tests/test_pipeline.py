@@ -0,0 +1,37 @@
+# python -m unittest tests/test_pipeline.py
+
+import unittest
+
+from src.pipeline import run_pipeline
+
+class TestPipeline(unittest.TestCase):
+    def test_order(self):
+        out = []
+        nitems = run_pipeline(lambda: iter(range(50)),
+                              lambda x: None if x % 5 == 0 else x*x,
+                              out.append, maxsize=1)
+        self.assertEqual(nitems, 50)
+        self.assertEqual(out, [x*x for x in range(50) if x % 5 != 0])
+
+    def test_errors(self):
+        def produce():
+            yield 1
+            raise IOError('read failed')
+        with self.assertRaises(IOError):
+            run_pipeline(produce, lambda x: x, lambda x: None)
+
+        def process(x):
+            if x == 3:
+                raise ValueError('process failed')
+            return x
+        with self.assertRaises(ValueError):
+            run_pipeline(lambda: iter(range(100)), process, lambda x: None)
+
+        def consume(x):
+            raise IOError('write failed')
+        with self.assertRaises(IOError):
+            run_pipeline(lambda: iter(range(100)), lambda x: x, consume)
+
+
+if __name__ == '__main__':
+    unittest.main()
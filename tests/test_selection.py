@@ -0,0 +1,230 @@
+"""Tests for src/selection.py"""
+
+import unittest
+import tempfile
+import shutil
+import os
+import h5py
+import numpy as np
+from unittest.mock import patch
+
+import src.selection as sel
+from src.selection import Selection, limits_to_expression
+from src.selection import get_selection, get_samples, apply_selection
+from src.index import SortedIndex
+
+class TestSelection(unittest.TestCase):
+    """Test the selection expressions"""
+
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        self.ngal = 4000
+        self.values = {
+            'mhhalo': 10**rng.uniform(9, 14, self.ngal),
+            'mstars_disk': 10**rng.uniform(6, 10, self.ngal),
+            'mstars_bulge': 10**rng.uniform(6, 10, self.ngal),
+            'xgal': rng.uniform(-10, 110, self.ngal).astype(np.float32),
+            'type': rng.integers(0, 3, self.ngal, dtype=np.int8)}
+        self.test_dir = tempfile.mkdtemp()
+        self.infile = os.path.join(self.test_dir, 'gal.hdf5')
+        with h5py.File(self.infile, 'w') as f:
+            for key, vals in self.values.items():
+                f.create_dataset(key, data=vals)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_evaluate(self):
+        v = self.values
+        sl = Selection('mhhalo >= 20*mp & (mstars_disk + mstars_bulge) > 1e9',
+                       {'mp': 1e10})
+        self.assertEqual(sl.datasets, ['mhhalo', 'mstars_disk', 'mstars_bulge'])
+        self.assertEqual(len(sl.terms), 2)
+        expected = ((v['mhhalo'] >= 2e11) &
+                    (v['mstars_disk'] + v['mstars_bulge'] > 1e9))
+        np.testing.assert_array_equal(sl.evaluate(v), expected)
+
+        # Chained comparisons, functions, precedence and backquotes
+        cases = [
+            ('0 <= xgal < 50', (v['xgal'] >= 0) & (v['xgal'] < 50)),
+            ('log10(mhhalo) > 12 | type == 0 & xgal > 50',
+             (np.log10(v['mhhalo']) > 12) | ((v['type'] == 0) & (v['xgal'] > 50))),
+            ('not (`type` != 1) and -xgal > -2**3',
+             (v['type'] == 1) & (-v['xgal'] > -8)),
+            ('~(abs(xgal - 50) <= 10)', np.abs(v['xgal'] - 50) > 10)]
+        for expression, expected in cases:
+            np.testing.assert_array_equal(Selection(expression).evaluate(v),
+                                          expected, err_msg=expression)
+
+        # Empty selection and conditions without datasets
+        self.assertTrue(Selection('').evaluate(v, self.ngal).all())
+        self.assertEqual(len(Selection(None).evaluate(v, 10)), 10)
+        self.assertFalse(Selection('mp > 1', {'mp': 0.5}).evaluate(v, 5).any())
+
+    def test_errors(self):
+        for expression in ['mhhalo >', 'mhhalo > 1)', '(xgal < 1',
+                           'xgal $ 3', 'xgal < < 3']:
+            with self.assertRaises(ValueError, msg=expression):
+                Selection(expression)
+        sl = Selection('mhhalo > 20*mp & mstars > 0', {'mp': 1.})
+        with self.assertRaises(ValueError):
+            sl.check(self.values)
+        sl.check(['mhhalo', 'mstars'])
+
+        # Constants cannot hide datasets with the same name
+        with self.assertRaises(ValueError):
+            sl.check(['mhhalo', 'mstars', 'mp'])
+        with h5py.File(self.infile, 'a') as f:
+            f.create_dataset('mp', data=np.ones(self.ngal))
+        with h5py.File(self.infile, 'r') as f:
+            with self.assertRaises(ValueError):
+                apply_selection(f, Selection('mhhalo > mp', {'mp': 1e10}),
+                                ['mhhalo'])
+
+    def test_typed_limits(self):
+        values = {'xgal': np.array([0.1, 0.2, 0.05], dtype=np.float32),
+                  'id': np.array([2**53, 2**53 + 1, 5], dtype=np.int64)}
+        cases = [(['xgal'], [None], [0.1], [True, False, True]),
+                 (['xgal'], [0.1], [None], [True, True, False]),
+                 (['id'], [2**53 + 1], [None], [False, True, False]),
+                 (['id'], [None], [2**53], [True, False, True])]
+        # Same rows with numpy and numexpr (if installed) as with the index
+        backends = [None] if sel.ne is None else [None, sel.ne]
+        for backend in backends:
+            with patch.object(sel, 'ne', backend):
+                for datasets, low, high, expected in cases:
+                    sl = Selection(limits_to_expression(datasets, low, high))
+                    np.testing.assert_array_equal(sl.evaluate(values),
+                                                  expected, err_msg=sl.expression)
+                    index = SortedIndex.from_column(values[datasets[0]])
+                    np.testing.assert_array_equal(
+                        index.range_rows(low[0], high[0]),
+                        np.flatnonzero(expected))
+                sl = Selection('xgal*mp <= mp/10 & id > 0', {'mp': 1e9})
+                np.testing.assert_array_equal(
+                    sl.evaluate(values), [True, False, True])
+
+    def test_without_numexpr(self):
+        sl = Selection('mhhalo >= 1e12 & 0 <= xgal <= 100 | type == 2')
+        with patch.object(sel, 'ne', None):
+            mask = sl.evaluate(self.values)
+        v = self.values
+        expected = (((v['mhhalo'] >= 1e12) & (v['xgal'] >= 0) &
+                     (v['xgal'] <= 100)) | (v['type'] == 2))
+        np.testing.assert_array_equal(mask, expected)
+
+    def test_limits(self):
+        datasets = ['xgal', 'mhhalo', 'type']
+        low_lim = [0., 1e13, None]
+        high_lim = [100., None, None]
+        expression = limits_to_expression(datasets, low_lim, high_lim)
+        self.assertEqual(len(Selection(expression).terms), 2)
+        v = self.values
+        expected = (v['xgal'] >= 0) & (v['xgal'] <= 100) & (v['mhhalo'] >= 1e13)
+        np.testing.assert_array_equal(
+            Selection(expression).evaluate(v), expected)
+
+        props = {'datasets': datasets, 'low_limits': low_lim,
+                 'high_limits': high_lim}
+        self.assertEqual(get_selection(props, {}).expression, expression)
+        props['expression'] = 'mhhalo > 20*mp'
+        sl = get_selection(props, {'mp': 1e9, 'root': 'path'})
+        self.assertEqual(sl.datasets, ['mhhalo'])
+        self.assertEqual(sl.constants, {'mp': 1e9})
+
+    def test_samples(self):
+        config = {'mp': 1e9, 'selection': {
+            'gal.hdf5': {'datasets': ['mhhalo'],
+                         'samples': {'massive': 'mhhalo > 100*mp',
+                                     'bright': 'mag_K < 20'}},
+            'sed.hdf5': {'datasets': [], 'samples': {'bright': 'L > 1'}}}}
+        samples = get_samples(config)
+        self.assertEqual(set(samples), {'massive', 'bright'})
+        self.assertEqual(set(samples['bright']), {'gal.hdf5', 'sed.hdf5'})
+        self.assertEqual(samples['massive']['gal.hdf5'].constants, {'mp': 1e9})
+        self.assertEqual(get_selection(config['selection']['gal.hdf5'],
+                                       config).terms, [])
+        self.assertEqual(get_samples({'selection': None}), {})
+
+    def test_get_range(self):
+        cases = {'mhhalo >= 20*mp': ('mhhalo', 2e10, None, True, True),
+                 '0 < xgal <= boxside': ('xgal', 0., 100., False, True),
+                 '`type` == 1': ('type', 1., 1., True, True),
+                 '1e12 > mhhalo': ('mhhalo', None, 1e12, True, False),
+                 'mhhalo > 1 | xgal > 1': None,
+                 'mhhalo + 1 > 2': None,
+                 'mhhalo != 2': None,
+                 '1 < mhhalo < 3 < 5': None,
+                 'xgal < 1 < xgal': None}
+        constants = {'mp': 1e9, 'boxside': 100.}
+        for expression, expected in cases.items():
+            self.assertEqual(Selection(expression, constants).get_range(),
+                             expected, msg=expression)
+
+    def test_apply_selection(self):
+        v = self.values
+        sl = Selection('mhhalo >= 1e13 & (mstars_disk + mstars_bulge) > 1e9')
+        expected = np.where(sl.evaluate(v))[0]
+        datasets = ['xgal', 'type']
+        with h5py.File(self.infile, 'r') as f:
+            for nsample in [10, 1000, 10000]:
+                rows, vals = apply_selection(f, sl, datasets, nsample=nsample)
+                np.testing.assert_array_equal(rows, expected)
+                np.testing.assert_array_equal(vals[0], v['xgal'][expected])
+                np.testing.assert_array_equal(vals[1], v['type'][expected])
+                self.assertEqual(vals[1].dtype, np.int8)
+
+            # The sample is read as contiguous runs of rows
+            getitem = h5py.Dataset.__getitem__
+            keys = []
+            def record(dset, key):
+                keys.append(key)
+                return getitem(dset, key)
+            with patch.object(h5py.Dataset, '__getitem__', record):
+                apply_selection(f, sl, datasets, nsample=100)
+            keys = [key for key in keys if isinstance(key, slice)]
+            self.assertTrue(all(key.step is None for key in keys))
+            self.assertIn(10, [key.stop - key.start for key in keys])
+
+            # Within a range of rows and given candidate rows
+            rows, vals = apply_selection(f, sl, datasets, 1000, 3000)
+            sub = expected[(expected >= 1000) & (expected < 3000)]
+            np.testing.assert_array_equal(rows, sub)
+            cand = np.arange(1000, 3000, 3)
+            rows, vals = apply_selection(f, sl, datasets, 1000, 3000,
+                                         rows=cand)
+            np.testing.assert_array_equal(rows, np.intersect1d(sub, cand))
+
+            # Derived quantities, computed only for the candidate rows
+            nread = []
+            def mstars(read):
+                disk = read(f, 'mstars_disk')
+                nread.append(len(disk))
+                return disk + read(f, 'mstars_bulge')
+            sl = Selection('mhhalo >= 1e13 & mstars > 1e9')
+            rows, vals = apply_selection(f, sl, datasets, nsample=self.ngal,
+                                         derived={'mstars': mstars})
+            np.testing.assert_array_equal(rows, expected)
+            self.assertLess(max(nread), self.ngal//2)
+
+            # Ranges resolved with a sorted index
+            index = {'mhhalo': SortedIndex.from_column(v['mhhalo'])}
+            sl = Selection('mhhalo >= 1e13 & (mstars_disk + mstars_bulge) > 1e9')
+            with patch.object(sel.u, 'read_column',
+                              wraps=sel.u.read_column) as read:
+                rows, vals = apply_selection(f, sl, datasets, 1000, 3000,
+                                             index=index)
+            np.testing.assert_array_equal(rows, sub)
+            self.assertNotIn('mhhalo', [call.args[1]
+                                        for call in read.call_args_list])
+
+            # No rows passing the selection or unknown datasets
+            rows, vals = apply_selection(f, Selection('mhhalo > 1e15'),
+                                         datasets)
+            self.assertIsNone(rows)
+            with self.assertRaises(ValueError):
+                apply_selection(f, Selection('mstars > 1'), datasets)
+
+
+if __name__ == '__main__':
+    unittest.main()
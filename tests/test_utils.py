@@ -69,6 +69,49 @@ class TestPredict(unittest.TestCase):
         np.testing.assert_array_equal(mask,[1])
 
 
+    def test_get_row_ranges(self):
+        rows = np.array([0, 1, 2, 5, 6, 20])
+        ranges = u.get_row_ranges(rows)
+        np.testing.assert_array_equal(ranges, [[0,3],[5,7],[20,21]])
+
+        ranges = u.get_row_ranges(rows, gap=3)
+        np.testing.assert_array_equal(ranges, [[0,7],[20,21]])
+
+        ranges = u.get_row_ranges(rows, align=10)
+        np.testing.assert_array_equal(ranges, [[0,10],[20,30]])
+
+        ranges = u.get_row_ranges([])
+        self.assertEqual(ranges.shape, (0,2))
+
+    def test_read_rows(self):
+        vals = np.arange(100000, dtype=float)
+        rows = np.sort(np.random.default_rng(1).choice(
+            np.arange(20000, 90000), size=30, replace=False))
+        rowsfile = os.path.join(self.test_dir, 'rows.hdf5')
+        with h5py.File(rowsfile, 'w') as f:
+            f.create_dataset('contiguous', data=vals)
+            f.create_dataset('chunked', data=vals, chunks=(1000,))
+        with h5py.File(rowsfile, 'r') as f:
+            for name in ['contiguous', 'chunked']:
+                # Sparse selection
+                out = u.read_rows(f[name], rows)
+                np.testing.assert_array_equal(out, vals[rows])
+
+                # Selection within a range of rows
+                out = u.read_rows(f[name], rows, 20000, 90000)
+                np.testing.assert_array_equal(out, vals[rows])
+
+                # Dense selection
+                dense = np.arange(10, 50000, 2)
+                out = u.read_rows(f[name], dense, 10, 50000)
+                np.testing.assert_array_equal(out, vals[dense])
+
+                # All or no rows
+                out = u.read_rows(f[name], np.arange(5, 15), 5, 15)
+                np.testing.assert_array_equal(out, vals[5:15])
+                out = u.read_rows(f[name], np.array([], dtype=int))
+                self.assertEqual(len(out), 0)
+
     def test_get_zz_subvols(self):
         vb = False    
         # Create multiple subvolume directories with matching iz subdirectories
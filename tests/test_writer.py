@@ -0,0 +1,172 @@
+# python -m unittest tests/test_writer.py
+
+import unittest
+import tempfile
+import shutil
+import os
+import h5py
+import numpy as np
+from unittest.mock import patch
+
+from src.writer import GneWriter, get_storage_kwargs, apply_precision
+from src.writer import get_index_dtype, get_int_dtype, cast_dtype
+
+class TestGneWriter(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.outfile = os.path.join(self.test_dir, 'gne_input.hdf5')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_single_open(self):
+        nopens = GneWriter.nopens
+        with GneWriter(self.outfile) as writer:
+            writer.set_header('h0', 0.7)
+            writer.write('mhhalo', np.arange(5.), 'Msun/h')
+            writer.write('type', np.zeros(5, dtype=int), 'Gal. type')
+            writer.set_header('redshift', 0.5)
+        self.assertEqual(GneWriter.nopens - nopens, 1)
+
+        with h5py.File(self.outfile, 'r') as hf:
+            self.assertEqual(hf['header'].attrs['h0'], 0.7)
+            self.assertEqual(hf['header'].attrs['redshift'], 0.5)
+            np.testing.assert_array_equal(hf['data/mhhalo'][:], np.arange(5.))
+            self.assertEqual(hf['data/mhhalo'].attrs['units'], 'Msun/h')
+            self.assertIn('type', hf['data'])
+
+    def test_header_flushed_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with GneWriter(self.outfile) as writer:
+                writer.set_header('h0', 0.7)
+                raise RuntimeError('stop')
+        with h5py.File(self.outfile, 'r') as hf:
+            self.assertEqual(hf['header'].attrs['h0'], 0.7)
+
+    def test_storage(self):
+        storage = {'compression': 'gzip', 'compression_opts': 4,
+                   'shuffle': True, 'chunks': 100}
+        columns = {'type': {'compression': 'lzf'}, 'index': None}
+        with GneWriter(self.outfile, storage=storage,
+                       columns=columns) as writer:
+            writer.write('mhhalo', np.arange(1000.), 'Msun/h')
+            writer.write('small', np.arange(10.), 'Msun/h')
+            writer.write('type', np.zeros(1000, dtype=int), 'Gal. type')
+            writer.write('index', np.arange(1000), 'index')
+        with h5py.File(self.outfile, 'r') as hf:
+            dd = hf['data/mhhalo']
+            self.assertEqual(dd.compression, 'gzip')
+            self.assertEqual(dd.compression_opts, 4)
+            self.assertTrue(dd.shuffle)
+            self.assertEqual(dd.chunks, (100,))
+            np.testing.assert_array_equal(dd[:], np.arange(1000.))
+            self.assertEqual(hf['data/small'].chunks, (10,))
+            self.assertEqual(hf['data/type'].compression, 'lzf')
+            self.assertIsNone(hf['data/index'].compression)
+            self.assertIsNone(hf['data/index'].chunks)
+
+    def test_resizable_chunks(self):
+        storage = {'compression': 'gzip', 'shuffle': True}
+        columns = {'index': {'chunks': 100}}
+        with GneWriter(self.outfile, resizable=True, storage=storage,
+                       columns=columns) as writer:
+            for start in range(0, 3000, 1000):
+                for name in ['mhhalo', 'index']:
+                    writer.append(name, np.arange(start, start + 6.), 'Msun/h')
+                writer.append('type', np.zeros(6, dtype=np.int8), 'type')
+        with h5py.File(self.outfile, 'r') as hf:
+            self.assertEqual(hf['data/mhhalo'].chunks, (2**17,))
+            self.assertEqual(hf['data/type'].chunks, (2**20,))
+            self.assertEqual(hf['data/index'].chunks, (100,))
+            self.assertEqual(hf['data/mhhalo'].shape, (18,))
+
+        # Limited to the rows of the input blocks
+        with GneWriter(self.outfile, resizable=True, chunk_rows=1000) as writer:
+            writer.append('mhhalo', np.arange(6.), 'Msun/h')
+        with h5py.File(self.outfile, 'r') as hf:
+            self.assertEqual(hf['data/mhhalo'].chunks, (1000,))
+
+    def test_storage_without_plugin(self):
+        with patch('src.writer.hdf5plugin', None):
+            kwargs = get_storage_kwargs({'compression': 'zstd'})
+        self.assertEqual(kwargs, {'compression': 'gzip'})
+        self.assertEqual(get_storage_kwargs(None), {})
+        self.assertEqual(get_storage_kwargs({'chunks': 50}, nrows=0), {})
+        self.assertEqual(get_storage_kwargs({'chunks': 50}, nrows=10,
+                                            resizable=True),
+                         {'chunks': (50,)})
+
+    def test_apply_precision(self):
+        vals = 10**np.linspace(-3, 12, 1000)
+        vals[0] = 0.
+        new, kwargs, err = apply_precision(vals, 'float32')
+        self.assertEqual(new.dtype, np.float32)
+        self.assertLess(err, 2**-23)
+        new, kwargs, err = apply_precision(vals, 'bits:10')
+        self.assertEqual(new.dtype, vals.dtype)
+        self.assertLessEqual(err, 2**-11)
+        np.testing.assert_allclose(new, vals, rtol=2**-11)
+        self.assertEqual(new[0], 0.)
+        new, kwargs, err = apply_precision(vals, 'scaleoffset:3')
+        self.assertEqual(kwargs, {'scaleoffset': 3})
+        np.testing.assert_array_equal(new, np.round(vals*1e3)/1e3)
+        ivals = np.arange(10)
+        self.assertEqual(apply_precision(ivals, 'bits:4'), (ivals, {}, None))
+        self.assertEqual(apply_precision(vals, None)[2], None)
+
+    def test_precision(self):
+        vals = 10**np.linspace(-3, 12, 1000)
+        precision = {'mhhalo': 'bits:8', 'index': 'float32'}
+        with GneWriter(self.outfile, resizable=True,
+                       precision=precision) as writer:
+            writer.append('mhhalo', vals[:500], 'Msun/h')
+            writer.append('mhhalo', vals[500:], 'Msun/h')
+            writer.write('mgas', vals, 'Msun/h')
+            writer.write('index', np.arange(1000), 'index')
+        expected = apply_precision(vals, 'bits:8')[2]
+        with h5py.File(self.outfile, 'r') as hf:
+            dd = hf['data/mhhalo']
+            self.assertEqual(dd.attrs['precision'], 'bits:8')
+            self.assertEqual(dd.attrs['max_rel_error'], expected)
+            np.testing.assert_allclose(dd[:], vals, rtol=2**-9)
+            self.assertNotIn('max_rel_error', hf['data/mgas'].attrs)
+            np.testing.assert_array_equal(hf['data/mgas'][:], vals)
+            self.assertEqual(hf['data/index'].dtype, np.arange(1).dtype)
+
+        # The error of the scale-offset filter is that of the stored values
+        vals = np.random.default_rng(3).uniform(0.1, 1, 5000)
+        with GneWriter(self.outfile, resizable=True,
+                       precision={'mhhalo': 'scaleoffset:3'}) as writer:
+            for start in range(0, len(vals), 1200):
+                writer.append('mhhalo', vals[start:start + 1200], 'Msun/h')
+        with h5py.File(self.outfile, 'r') as hf:
+            dd = hf['data/mhhalo']
+            self.assertAlmostEqual(dd.attrs['max_rel_error'],
+                                   np.max(np.abs(dd[:] - vals)/vals),
+                                   places=12)
+
+    def test_dtypes(self):
+        self.assertEqual(get_index_dtype(255), np.uint8)
+        self.assertEqual(get_index_dtype(256), np.uint16)
+        self.assertEqual(get_index_dtype(10**6), np.uint32)
+        self.assertEqual(get_index_dtype(10**10), np.uint64)
+        self.assertEqual(get_int_dtype(0, 255), np.uint8)
+        self.assertEqual(get_int_dtype(-1, 255), np.int16)
+        self.assertEqual(get_int_dtype(-2**31, 2**31 - 1), np.int32)
+        with self.assertRaises(ValueError):
+            cast_dtype(np.array([0, 300]), 'int8')
+
+        dtypes = {'gal_index': get_index_dtype(1000), 'type': 'int8'}
+        with GneWriter(self.outfile, resizable=True, dtypes=dtypes) as writer:
+            writer.append('gal_index', np.arange(500), 'index')
+            writer.append('gal_index', np.arange(500, 1000), 'index')
+            writer.write('type', np.array([0, 1, 2]), 'Gal. type')
+        with h5py.File(self.outfile, 'r') as hf:
+            self.assertEqual(hf['data/gal_index'].dtype, np.uint16)
+            np.testing.assert_array_equal(hf['data/gal_index'][:],
+                                          np.arange(1000))
+            self.assertEqual(hf['data/type'].dtype, np.int8)
+
+
+if __name__ == '__main__':
+    unittest.main()